@@ -23,6 +23,7 @@ from acq4.pyqtgraph.Qt import QtCore, QtGui
 import acq4.util.reload as reload
 
 from .util import DataManager, ptime, configfile
+from .util.StorageQueue import StorageQueue
 from .Interfaces import *
 from .util.Mutex import Mutex
 from .util.debug import *
@@ -148,6 +149,7 @@ class Manager(QtCore.QObject):
         self.disableAllDevs = False
         self.alreadyQuit = False
         self.taskLock = Mutex(QtCore.QMutex.Recursive)
+        self.storageQueue = StorageQueue()  ## write-behind storage for task results
         
         try:
             if Manager.CREATED:
@@ -359,6 +361,17 @@ class Manager(QtCore.QObject):
                     import acq4.pyqtgraph.metaarray as ma
                     ma.MetaArray.defaultCompression = comp
 
+                elif key == 'writeProfiles':
+                    import acq4.pyqtgraph.metaarray as ma
+                    for name, opts in cfg[key].items():
+                        ma.MetaArray.writeProfiles.setdefault(name, {}).update(opts)
+
+                elif key == 'dataManager':
+                    DataManager.getDataManager().configure(**cfg[key])
+
+                elif key == 'storageQueue':
+                    self.storageQueue.configure(**cfg[key])
+
                 ## load stylesheet
                 elif key == 'stylesheet':
                     try:
@@ -696,6 +709,8 @@ class Manager(QtCore.QObject):
                 self.currentDir.sigChanged.disconnect(self.currentDirChanged)
             except TypeError:
                 pass
+            ## fold any journaled meta-info changes into the index files we are leaving
+            DataManager.compactIndexes()
             
         if isinstance(d, basestring):
             self.currentDir = self.baseDir.getDir(d, create=True)
@@ -860,6 +875,12 @@ class Manager(QtCore.QObject):
                     dlg.setValue(lm-len(self.modules))
                 #pdb.set_trace()
                     
+                print "Waiting for data storage to finish.."
+                try:
+                    self.storageQueue.flush()
+                except:
+                    printExc("Error while storing data:")
+                    
                 print "Requesting all devices shut down.."
                 for d in self.devices:
                     print "    %s" % d
@@ -1197,9 +1218,15 @@ class Task:
                     
                     ## Store data if requested
                     if 'storeData' in self.cfg and self.cfg['storeData'] is True:
-                        self.cfg['storageDir'].setInfo(result['protocol'])
+                        dh = self.cfg['storageDir']
+                        ## with writeBehind, files are written in the background by the
+                        ## manager's storage queue; the caller must flush the queue before
+                        ## reading the stored data.
+                        if self.cfg.get('writeBehind', False) and self.dm.storageQueue.enabled:
+                            dh = self.dm.storageQueue.handle(dh)
+                        dh.setInfo(result['protocol'])
                         for t in self.tasks:
-                            self.tasks[t].storeResult(self.cfg['storageDir'])
+                            self.tasks[t].storeResult(dh)
                     prof.mark("store data")
             finally:   
                 ## Regardless of any other problems, at least make sure we 
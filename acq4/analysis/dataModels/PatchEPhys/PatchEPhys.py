@@ -203,6 +203,27 @@ def buildSequenceArrayIter(dh, func=None, join=True, truncate=False, fill=None):
 
     yield data, None
 
+def buildSequenceView(dh, fileName=None, fill=None):
+    """Return a read-only MetaArray presenting one file from every iteration of a 
+    protocol sequence, with one leading axis per sequence parameter. Unlike 
+    buildSequenceArray, no data is read until the array is indexed, and then only
+    the selected parts of each file (see acq4.util.SequenceView).
+    
+    If fileName is None, the clamp file of the first iteration is used.
+    
+    Example: primary channel of all clamp recordings over the first 100 ms
+        buildSequenceView(seqDir)['Channel': 'primary', 'Time': 0.0:0.1]"""
+    from acq4.util.SequenceView import SequenceView
+    if fileName is None:
+        for name in dh.subDirs():
+            fh = getClampFile(dh[name])
+            if fh is not None:
+                fileName = fh.shortName()
+                break
+        else:
+            raise Exception("No clamp files found in sequence '%s'." % dh.name())
+    return SequenceView(dh, fileName, fill=fill)
+
 def getParent(child, parentType):
     """Return the (grand)parent of child that matches parentType"""
     if dirType(child) == parentType:
@@ -516,6 +537,39 @@ def getCellType(dh):
         return cellInfo.get('type', '')
     else:
         return('Unknown')
+
+def findProtocols(catalog=None, protocol=None, cellType=None, temperature=None, under=None):
+    """
+    Use a DataCatalog to find protocol directories without walking the storage tree.
+    Returns a list of DirHandles.
+    
+    protocol     glob pattern for the protocol directory name (eg. 'cciv*')
+    cellType     required 'type' of the enclosing Cell directory
+    temperature  required temperature; matches either the protocol's bath 
+                 temperature or the 'temperature' of the enclosing Day (see getTemp)
+    under        only search beneath this directory (handle or path)
+    
+    If catalog is None, the catalog attached to the DataManager is used.
+    """
+    if catalog is None:
+        catalog = DataManager.getDataManager().getCatalog()
+        if catalog is None:
+            raise Exception("No data catalog is attached to the DataManager.")
+    ancestors = {}
+    if cellType is not None:
+        ancestors['Cell'] = {'type': cellType}
+    
+    paths = set()
+    for ptype in ('Protocol', 'ProtocolSequence'):
+        if temperature is None:
+            paths |= set(catalog.find(type=ptype, name=protocol, under=under, ancestors=ancestors))
+        else:
+            paths |= set(catalog.find(type=ptype, name=protocol, under=under, ancestors=ancestors,
+                                      fields={'Temperature.BathTemp': temperature}))
+            dayAncestors = ancestors.copy()
+            dayAncestors['Day'] = {'temperature': temperature}
+            paths |= set(catalog.find(type=ptype, name=protocol, under=under, ancestors=dayAncestors))
+    return [DataManager.getDirHandle(p) for p in sorted(paths)]
         
 def file_cell_protocol(filename):
     """
@@ -108,6 +108,7 @@ class Ui_Form(object):
         self.ImagePhys_ImgMethod.addItem(_fromUtf8(""))
         self.ImagePhys_ImgMethod.addItem(_fromUtf8(""))
         self.ImagePhys_ImgMethod.addItem(_fromUtf8(""))
+        self.ImagePhys_ImgMethod.addItem(_fromUtf8(""))
         self.verticalLayout_3.addWidget(self.ImagePhys_ImgMethod)
         self.ImagePhys_DisplayTraces = QtGui.QPushButton(self.layoutWidget)
         sizePolicy = QtGui.QSizePolicy(QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Preferred)
@@ -352,6 +353,7 @@ class Ui_Form(object):
         self.ImagePhys_ImgMethod.setItemText(3, QtGui.QApplication.translate("Form", "Norm\'d", None, QtGui.QApplication.UnicodeUTF8))
         self.ImagePhys_ImgMethod.setItemText(4, QtGui.QApplication.translate("Form", "Slow Filter", None, QtGui.QApplication.UnicodeUTF8))
         self.ImagePhys_ImgMethod.setItemText(5, QtGui.QApplication.translate("Form", "G/R", None, QtGui.QApplication.UnicodeUTF8))
+        self.ImagePhys_ImgMethod.setItemText(6, QtGui.QApplication.translate("Form", "Rolling F0", None, QtGui.QApplication.UnicodeUTF8))
         self.ImagePhys_DisplayTraces.setText(QtGui.QApplication.translate("Form", "dF/F -> MPL", None, QtGui.QApplication.UnicodeUTF8))
         self.ImagePhys_ExportTiff.setText(QtGui.QApplication.translate("Form", "Export TIFF", None, QtGui.QApplication.UnicodeUTF8))
         self.ImagePhys_FileGroup.setTitle(QtGui.QApplication.translate("Form", "File Operations", None, QtGui.QApplication.UnicodeUTF8))
@@ -36,6 +36,8 @@ import acq4.pyqtgraph.debug as debug
 import acq4.util.DatabaseGui as DatabaseGui
 import PIL as Image
 from acq4.util.metaarray import MetaArray
+from acq4.util.imaging.video_reader import VideoReader
+from acq4.util.imaging.background import BackgroundModel
 import numpy as np
 import scipy
 import ctrlTemplate
@@ -793,9 +795,10 @@ class pbm_ImageAnalysis(AnalysisModule):
         
         dh = self.fileLoaderInstance.selectedFiles()
         dh = dh[0]
-        imt = MetaArray(file=dh.name()) # , subset=(slice(block_pos,block_pos+block_size),slice(None), slice(None)))
+        imt = VideoReader(dh.name())  # frames are only read from disk as they are indexed
         sh = imt.shape
         info = imt.infoCopy()
+        imt.close()
         self.downSample = int(self.ctrl.ImagePhys_Downsample.currentText())
         if self.downSample <= 0:
             self.downSample = 1 # same as "none"
@@ -809,7 +812,7 @@ class pbm_ImageAnalysis(AnalysisModule):
         print 'Frame rate is: %12.5f s per frame or %8.2f Hz' % (dt, 1.0/dt)
         
     def tryDownSample(self, dh):
-        imt = MetaArray(file=dh.name()) # , subset=(slice(block_pos,block_pos+block_size),slice(None), slice(None)))
+        imt = VideoReader(dh.name())  # frames are only read from disk as they are indexed
         if imt is None:
             raise HelpfulException("Failed to read file %s in tryDownSample" % dh.name(), msgType='status')
         sh = imt.shape
@@ -825,38 +828,41 @@ class pbm_ImageAnalysis(AnalysisModule):
         imt_out = np.empty((outframes, sh[1], sh[2]), dtype=np.float32)
         tfr = 0
 #        nfr = 0
-        with pg.ProgressDialog("Downsampling", 0, outframes) as dlg:
-            avgflag = True
-            dlg.setLabelText("Reading images...")
-            dlg.setValue(0)
-            dlg.setMaximum(outframes)
+        try:
+            with pg.ProgressDialog("Downsampling", 0, outframes) as dlg:
+                avgflag = True
+                dlg.setLabelText("Reading images...")
+                dlg.setValue(0)
+                dlg.setMaximum(outframes)
 #            bbcount = 0
-            for bb in range(nbigblocks):
-                img = imt[bb*bigblock:(bb+1)*bigblock, :, :]
-                try:
-                    img = img.asarray()
-                except:
-                    pass
-                if bb == nbigblocks-1:
-                    nframesperblock = int(np.floor(nlastblock/self.downSample))
-                    print "reading last block of short..."
-                for fr in range(nframesperblock):
-                    dlg.setLabelText("Reading block %d of %d" % (tfr, outframes))
-                    block_pos = fr * self.downSample
-                    #print 'tfr: %d  block: %5d,  frame: %d ' % (tfr, block_pos, nfr)
-                    if avgflag:
-                        imt_out[tfr] = np.mean(img[block_pos:(block_pos+self.downSample)], axis=0)
-    #                    imt_out[fr] = np.mean(imt[block_pos:(block_pos+self.downSample)], axis=0)
-                    else:
-                        try:
-                            imt_out[tfr] = img[block_pos,:,:]
-                        except:
-                            print 'Failing!!! fr: %d   blockpos: %d  bb: %d' % (fr, block_pos, bb)
-                    dlg += 1
-                    tfr += 1
+                for bb in range(nbigblocks):
+                    img = imt[bb*bigblock:(bb+1)*bigblock, :, :]
+                    try:
+                        img = img.asarray()
+                    except:
+                        pass
+                    if bb == nbigblocks-1:
+                        nframesperblock = int(np.floor(nlastblock/self.downSample))
+                        print "reading last block of short..."
+                    for fr in range(nframesperblock):
+                        dlg.setLabelText("Reading block %d of %d" % (tfr, outframes))
+                        block_pos = fr * self.downSample
+                        #print 'tfr: %d  block: %5d,  frame: %d ' % (tfr, block_pos, nfr)
+                        if avgflag:
+                            imt_out[tfr] = np.mean(img[block_pos:(block_pos+self.downSample)], axis=0)
+        #                    imt_out[fr] = np.mean(imt[block_pos:(block_pos+self.downSample)], axis=0)
+                        else:
+                            try:
+                                imt_out[tfr] = img[block_pos,:,:]
+                            except:
+                                print 'Failing!!! fr: %d   blockpos: %d  bb: %d' % (fr, block_pos, bb)
+                        dlg += 1
+                        tfr += 1
 #                    nfr = tfr*self.downSample
-                    if dlg.wasCanceled():
-                        raise Exception("Downample input canceled by user.")
+                        if dlg.wasCanceled():
+                            raise Exception("Downample input canceled by user.")
+        finally:
+            imt.close()
                 
         return(imt_out, info)
 
@@ -973,6 +979,8 @@ class pbm_ImageAnalysis(AnalysisModule):
             self.normalizeImage()  # another normalization
         if method == 4:
             self.slowFilterImage()  # slow filtering normalization: (F-Fslow)/Fslow on pixel basis over time
+        if method == 6:
+            self.rollingF0Image()  # (F-F0)/F0 with F0 a low percentile over a sliding window
         print 'normalize method: ', method
         print self.dataState['ratioLoaded']
         print self.useRatio
@@ -2479,6 +2487,28 @@ class pbm_ImageAnalysis(AnalysisModule):
 #        self.backgroundPlot.plot(y=imm, x=self.imageTimes[0:ndl], clear=True)
         self.paintImage()
 
+    def rollingF0Image(self, window=5.0, percentile=10.):
+        """ (F-F0)/F0 where F0 for each pixel is the *percentile* of the frames
+            collected over the preceding *window* seconds. This follows slow
+            changes in fluorescence (bleaching, drift) without needing a quiet
+            baseline period.
+        """
+        if self.dataState['Normalized'] is True and self.dataState['bleachCorrection'] is True:
+            print 'Data is already Normalized, type = %s ' % (self.dataState['NType'])
+            return
+        self.imageData = self.rawData.copy()  # start over with the raw data...
+        model = BackgroundModel('percentile', window=window, percentile=percentile, updateInterval=0.)
+        dff = np.empty(self.imageData.shape, dtype=np.float32)
+        for i in range(self.imageData.shape[0]):
+            model.addFrame(self.imageData[i], now=self.imageTimes[i])
+            F0 = model.background(now=self.imageTimes[i])
+            dff[i] = (self.imageData[i] - F0) / F0
+        self.imageData = dff
+        self.ctrl.ImagePhys_NormInfo.setText('(F-F0r)/F0r')
+        self.dataState['Normalized'] = True
+        self.dataState['NType'] = 'rolling F0'
+        self.paintImage()
+
     def GRRatioImage(self):
         print 'Doing G/R Ratio calculation'
         if self.dataState['bleachCorrection'] is False:
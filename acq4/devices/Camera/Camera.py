@@ -18,6 +18,8 @@ import acq4.util.ptime as ptime
 from acq4.util.Mutex import Mutex
 from acq4.util.debug import *
 from acq4.util import imaging
+from acq4.util.imaging.frame_pool import FramePool
+from acq4.util.imaging.telemetry import PipelineTelemetry
 from acq4.pyqtgraph import Vector, SRTTransform3D
 
 from CameraInterface import CameraInterface
@@ -44,6 +46,16 @@ class Camera(DAQGeneric, OptomechDevice):
         exposeChannel: 'DAQ', '/Dev1/port0/line14'  ## Channel for recording expose signal
         triggerOutChannel: 'DAQ', '/Dev1/PFI5'  ## Channel the DAQ should trigger off of to sync with camera
         triggerInChannel: 'DAQ', '/Dev1/port0/line13'  ## Channel the DAQ should raise to trigger the camera
+        framePoolSize: 16  ## Number of preallocated frame buffers (see newFrames)
+        recordQueue:       ## Frames waiting to be recorded (see imaging.FrameQueue)
+            maxBytes: 500e6
+            policy: 'drop'     ## or 'spill' (to a scratch file in spillDir), or 'block'
+                               ## (acquisition waits for the writer)
+        recordReduction:   ## Reduce recorded stacks (see imaging.FrameReducer)
+            average: 4         ## mean of every 4 frames
+            binning: 2         ## mean of 2x2 pixel blocks
+            region: (0, 0, 256, 256)  ## crop (x, y, w, h) in image pixels
+            dtype: 'uint8'     ## output type; values are multiplied by *scale* and clipped
         params:
             GAIN_INDEX: 2
             CLEAR_MODE: 'CLEAR_PRE_SEQUENCE'  ## Overlap mode for QuantEM
@@ -70,6 +82,8 @@ class Camera(DAQGeneric, OptomechDevice):
         
         self.camConfig = config
         self.stateStack = []
+        self.framePool = FramePool(config.get('framePoolSize', 16))
+        self.telemetry = PipelineTelemetry()
                 
         if 'scaleFactor' not in self.camConfig:
             self.camConfig['scaleFactor'] = [1., 1.]
@@ -172,7 +186,10 @@ class Camera(DAQGeneric, OptomechDevice):
         """Returns a list of all new frames that have arrived since the last call. The list looks like:
             [{'id': 0, 'data': array, 'time': 1234678.3213}, ...]
         id is a unique integer representing the frame number since the start of the program.
-        data should be a permanent copy of the image (ie, not directly from a circular buffer)
+        data should be a permanent copy of the image (ie, not directly from a circular buffer).
+            Drivers should copy into an array from self.framePool.acquire(shape, dtype) rather than
+            allocating a new array for each frame; the pool buffer is not reused until all
+            references to it (the Frame and any views of its data) have been released.
         time is the time of arrival of the frame. Optionally, 'exposeStartTime' and 'exposeDoneTime' 
             may be specified if they are available.
         """
@@ -415,6 +432,18 @@ class Camera(DAQGeneric, OptomechDevice):
     def isRunning(self):
         return self.acqThread.isRunning()
 
+    def framePoolStats(self):
+        """Return usage statistics for the frame buffer pool since the camera
+        was last started (see FramePool.stats)."""
+        return self.framePool.stats()
+
+    def pipelineStats(self):
+        """Return latency, frame rate, queue and drop statistics for frames from
+        this camera (see PipelineTelemetry.stats), including frame pool usage."""
+        stats = self.telemetry.stats()
+        stats['framePool'] = self.framePoolStats()
+        return stats
+
     def wait(self, *args, **kargs):
         return self.acqThread.wait(*args, **kargs)
 
@@ -423,8 +452,8 @@ class Frame(imaging.Frame):
     def __init__(self, data, info):
         ## make frame transform to map from image coordinates to sensor coordinates.
         ## (these may differ due to binning and region of interest settings)
-        tr = Camera.makeFrameTransform(info['region'], info['binning'])
-        info['frameTransform'] = tr
+        if 'frameTransform' not in info:
+            info['frameTransform'] = Camera.makeFrameTransform(info['region'], info['binning'])
 
         imaging.Frame.__init__(self, data, info)
     
@@ -579,12 +608,12 @@ class CameraTask(DAQGenericTask):
         
     def storeResult(self, dirHandle):
         result = self.getResult()
-        result = {'frames': (result.asMetaArray(), result.info()), 'daqResult': (result.daqResult(), {})}
+        result = {'frames': (result.asMetaArray(), result.info(), 'video'), 'daqResult': (result.daqResult(), {}, 'trace')}
         dh = dirHandle.mkdir(self.dev.name())
         for k in result:
-            data, info = result[k]
+            data, info, profile = result[k]
             if data is not None:
-                dh.writeFile(data, k, info=info)
+                dh.writeFile(data, k, info=info, profile=profile)
 
 class CameraTaskResult:
     def __init__(self, task, frames, daqResult):
@@ -797,13 +826,16 @@ class AcquireThread(Thread):
         exposure = camState['exposure']
         region = camState['region']
         mode = camState['triggerMode']
+        frameTransform = Camera.makeFrameTransform(region, binning)
+        self.dev.framePool.resetCounters()
+        telemetry = self.dev.telemetry
         
         try:
             #self.dev.setParam('ringSize', self.ringSize, autoRestart=False)
             self.dev.startCamera()
             
             lastFrameTime = lastStopCheck = ptime.time()
-            frameInfo = {}
+            info = {}
             scopeState = None
 
             while True:
@@ -816,29 +848,29 @@ class AcquireThread(Thread):
                     if lastFrameId is not None:
                         drop = frames[0]['id'] - lastFrameId - 1
                         if drop > 0:
+                            telemetry.drop('camera', drop)
                             print "WARNING: Camera dropped %d frames" % drop
+                    telemetry.queueDepth('driver', len(frames))
                         
-                    ## Build meta-info for this frame(s)
-                    info = camState.copy()
-                    
+                    ## Build meta-info for this frame(s). This only changes with the scope state,
+                    ## so the transforms are computed here rather than for every frame.
                     ss = self.dev.getScopeState()
 
                     if ss['id'] != scopeState:
                         scopeState = ss['id']
-                        ## regenerate frameInfo here
                         ps = ss['pixelSize']  ## size of CCD pixel
                         transform = pg.SRTTransform3D(ss['transform'])
 
-                        frameInfo = {
+                        info = camState.copy()
+                        info.update({
                             'pixelSize': [ps[0] * binning[0], ps[1] * binning[1]],  ## size of image pixel
                             'objective': ss.get('objective', None),
                             'deviceTransform': transform,
-                            'lightSource': ss.get('lightSourceState', None)
-                        }
+                            'lightSource': ss.get('lightSourceState', None),
+                            'frameTransform': frameTransform,
+                            'transform': pg.SRTTransform3D(transform * frameTransform),
+                        })
 
-                    ## Copy frame info to info array
-                    info.update(frameInfo)                    
-                    
                     ## Process all waiting frames. If there is more than one frame waiting, guess the frame times.
                     dt = (now - lastFrameTime) / len(frames)
                     if dt > 0:
@@ -847,10 +879,13 @@ class AcquireThread(Thread):
                         info['fps'] = None
                     
                     for frame in frames:
+                        ## each frame gets its own info dict; the data array is passed
+                        ## on without copying (it is usually leased from dev.framePool)
                         frameInfo = info.copy()
                         data = frame.pop('data')
                         frameInfo.update(frame)  # copies 'time' key supplied by camera
                         out = Frame(data, frameInfo)
+                        telemetry.frame('acquire', out)
                         with self.connectMutex:
                             conn = list(self.connections)
                         for c in conn:
@@ -913,6 +948,11 @@ class AcquireThread(Thread):
                 raise Exception("Timed out waiting for thread exit!")
         #print "AcquireThread.stop: thread exited"
 
+    def stopRequested(self):
+        """Return True if stop() has been called and the thread has not yet exited
+        its acquisition loop."""
+        return self.stopThread
+
     def reset(self):
         if self.isRunning():
             self.stop()
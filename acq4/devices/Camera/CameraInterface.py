@@ -44,7 +44,9 @@ class CameraInterface(CameraModuleInterface):
 
         # takes care of displaying image data, 
         # contrast & background subtraction user interfaces
-        self.imagingCtrl = ImagingCtrl()
+        self.imagingCtrl = ImagingCtrl(telemetry=camera.telemetry,
+                                       recordQueue=camera.camConfig.get('recordQueue', None),
+                                       recordReduction=camera.camConfig.get('recordReduction', None))
         self.frameDisplay = self.imagingCtrl.frameDisplay
 
         ## Move control panels into docks
@@ -117,6 +119,8 @@ class CameraInterface(CameraModuleInterface):
 
         ## Signals from Camera device
         self.cam.sigNewFrame.connect(self.newFrame)
+        ## holds back acquisition while the record queue is full (with the 'block' policy)
+        self.cam.acqThread.connectCallback(self.waitForRecordQueue)
         self.cam.sigCameraStopped.connect(self.cameraStopped)
         self.cam.sigCameraStarted.connect(self.cameraStarted)
         self.cam.sigShowMessage.connect(self.showMessage)
@@ -130,6 +134,10 @@ class CameraInterface(CameraModuleInterface):
         self.imagingCtrl.newFrame(frame)
         self.sigNewFrame.emit(self, frame)
 
+    def waitForRecordQueue(self, frame):
+        ## called from the acquisition thread; stop waiting if the camera is being stopped
+        self.imagingCtrl.recordThread.waitForRoom(frame, until=self.cam.acqThread.stopRequested)
+
     def controlWidget(self):
         return self.widget
         
@@ -205,6 +213,7 @@ class CameraInterface(CameraModuleInterface):
             self.cam.setParam('region', self.region, autoRestart=autoRestart)
 
     def quit(self):
+        self.cam.acqThread.disconnectCallback(self.waitForRecordQueue)
         self.imagingCtrl.quit()
 
         if self.hasQuit:
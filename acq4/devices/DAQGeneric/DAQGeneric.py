@@ -476,7 +476,9 @@ class DAQGenericTask(DeviceTask):
             return None
             
     def storeResult(self, dirHandle):
-        DeviceTask.storeResult(self, dirHandle)
+        result = self.getResult()
+        if result is not None:
+            dirHandle.writeFile(result, self.dev.name(), profile='trace')
         for ch in self._DAQCmd:
             if self._DAQCmd[ch].get('recordInit', False):
             #if 'recordInit' in self._DAQCmd[ch] and self._DAQCmd[ch]['recordInit']:
@@ -53,6 +53,9 @@ class MockCamera(Camera):
             ('sensorSize',      (None, False, True, [])),
             ('bitDepth',        (None, False, True, [])),
         ])
+        self.benchmark = None
+        self.benchmarkBase = None
+        self.noise16 = None
         
         self.groupParams = {
             'binning':         ('binningX', 'binningY'),
@@ -85,14 +88,31 @@ class MockCamera(Camera):
         self.cells = cells
         
     def setupCamera(self):
-        pass
+        ## In benchmark mode, frames are generated at a fixed rate and sensor size
+        ## for load testing the display and recording code, eg:
+        ##     benchmark:
+        ##         fps: 100
+        ##         sensorSize: (2048, 2048)
+        self.benchmark = self.camConfig.get('benchmark', None)
+        if self.benchmark is not None:
+            self.setSensorSize(*self.benchmark.get('sensorSize', (2048, 2048)))
+
+    def setSensorSize(self, w, h):
+        self.params.update([('regionX', 0), ('regionY', 0), ('regionW', w), ('regionH', h), ('sensorSize', (w, h))])
+        self.paramRanges['regionX'] = ((0, w-1), True, True, ['regionW'])
+        self.paramRanges['regionY'] = ((0, h-1), True, True, ['regionH'])
+        self.paramRanges['regionW'] = ((1, w), True, True, ['regionX'])
+        self.paramRanges['regionH'] = ((1, h), True, True, ['regionY'])
+        self.background = None
         
     def globalTransformChanged(self):
         self.background = None
+        self.benchmarkBase = None
     
     def startCamera(self):
         self.cameraStarted = True
-        self.lastFrameTime = ptime.time()
+        self.lastFrameTime = self.lastCellUpdate = ptime.time()
+        self.benchmarkBase = None
         
     def stopCamera(self):
         self.cameraStopped = True
@@ -146,26 +166,60 @@ class MockCamera(Camera):
         dt = now - self.lastFrameTime
         exp = self.getParam('exposure')
         bin = self.getParam('binning')
-        fps = 1.0 / (exp+(40e-3/(bin[0]*bin[1])))
+        if self.benchmark is None:
+            fps = 1.0 / (exp+(40e-3/(bin[0]*bin[1])))
+        else:
+            fps = self.benchmark.get('fps', 100)
         nf = int(dt * fps)
         if nf == 0:
             return []
+
+        ## frames arrive at regular intervals; those that would have overflowed the
+        ## camera's ring buffer are lost, leaving a gap in frame ids.
+        times = self.lastFrameTime + np.arange(1, nf+1) / fps
+        self.lastFrameTime = times[-1]
+        if nf > self.ringSize:
+            self.frameId += nf - self.ringSize
+            times = times[-self.ringSize:]
         
         region = self.getParam('region') 
-        bg = self.getBackground()[region[0]:region[0]+region[2], region[1]:region[1]+region[3]]
-        
-        ## update cells
+        self.updateCells(now)
+
+        frames = []
+        for t in times:
+            if self.benchmark is None:
+                data = self.renderImage(region, bin, exp)
+                frame = self.framePool.acquire(data.shape, np.uint16)
+                np.copyto(frame, data, casting='unsafe')
+            else:
+                frame = self.benchmarkFrame(region, bin, exp, now)
+            self.frameId += 1
+            frames.append({'data': frame, 'time': t, 'id': self.frameId})
+        return frames
+
+    def updateCells(self, now):
+        dt = now - self.lastCellUpdate
+        self.lastCellUpdate = now
         spikes = np.random.poisson(min(dt, 0.4) * self.cells['rate'])
         self.cells['value'] *= np.exp(-dt / self.cells['decayTau'])
         self.cells['value'] = np.clip(self.cells['value'] + spikes * 0.2, 0, 1)
+
+    def renderImage(self, region, bin, exp, noise=True):
+        """Return a simulated (binned, floating point) image of the camera *region*."""
         shape = region[2:]
-        self.lastFrameTime = now + exp
-        data = self.getNoise(shape)
-        data[data<0] = 0
+        if noise:
+            data = self.getNoise(shape)
+            data[data<0] = 0
+        else:
+            data = np.zeros(shape)
         
+        bg = self.getBackground()[region[0]:region[0]+region[2], region[1]:region[1]+region[3]]
         data += bg * (exp*1000)
-        
-        ## draw cells
+        self.drawCells(data, region, exp)
+        return binImage(data, bin)
+
+    def drawCells(self, data, region, exp):
+        """Add all cells to *data*, the unbinned image of the camera *region*."""
         px = (self.pixelVectors()[0]**2).sum() ** 0.5
         
         ## Generate transform that maps grom global coordinates to image coordinates
@@ -173,27 +227,33 @@ class MockCamera(Camera):
         # note we use binning=(1,1) here because the image is downsampled later.
         frameTr = self.makeFrameTransform(region, [1, 1]).inverted()[0]
         tr = pg.SRTTransform(frameTr * cameraTr)
-        
-        for cell in self.cells:
-            w = cell['size'] / px
-            pos = pg.Point(cell['x'], cell['y'])
-            imgPos = tr.map(pos)
-            start = (int(imgPos.x()), int(imgPos.y()))
-            stop = (start[0]+w, start[1]+w)
-            val = cell['intensity'] * cell['value'] * self.getParam('exposure')
-            data[max(0,start[0]):max(0,stop[0]), max(0,start[1]):max(0,stop[1])] += val
-        
-        data = fn.downsample(data, bin[0], axis=0)
-        data = fn.downsample(data, bin[1], axis=1)
-        data = data.astype(np.uint16)
-        
-        self.frameId += 1
-        frames = []
-        for i in range(nf):
-            frames.append({'data': data, 'time': now + (i / fps), 'id': self.frameId})
-        return frames
+        m = pg.transformToArray(tr)[:2]
+
+        cells = self.cells
+        pos = np.dot(m, np.vstack([cells['x'], cells['y'], np.ones(len(cells))]))
+        start = pos.astype(int)
+        stop = start + (cells['size'] / px).astype(int)
+        val = cells['intensity'] * cells['value'] * exp
+        splatRects(data, start, stop, val)
+
+    def benchmarkFrame(self, region, bin, exp, now):
+        """Return a distinct frame for benchmark mode by adding a random slice of
+        pre-generated noise to an image of the background and cells that is
+        re-rendered every 100 ms."""
+        if self.benchmarkBase is None or now - self.benchmarkBase[0] > 0.1:
+            base = self.renderImage(region, bin, exp, noise=False)
+            base = np.clip(base, 0, 2**16 - 2**12 - 1).astype(np.uint16)
+            self.benchmarkBase = (now, base)
+        base = self.benchmarkBase[1]
+        n = base.size
+        if self.noise16 is None or len(self.noise16) < 2 * n:
+            noise = np.random.normal(size=max(2 * n, len(self.noise)), loc=100, scale=50)
+            self.noise16 = np.clip(noise, 0, 2**12 - 1).astype(np.uint16)
+        i = np.random.randint(len(self.noise16) - n)
+        frame = self.framePool.acquire(base.shape, np.uint16)
+        np.add(base, self.noise16[i:i+n].reshape(base.shape), out=frame)
+        return frame
             
-                
     def quit(self):
         pass
         
@@ -278,6 +338,35 @@ class MockCameraTask(CameraTask):
         return data
         
 
+def binImage(data, bin):
+    """Average *data* over blocks of bin[0] x bin[1] pixels, discarding partial blocks."""
+    if tuple(bin) == (1, 1):
+        return data
+    w = data.shape[0] // bin[0]
+    h = data.shape[1] // bin[1]
+    return data[:w*bin[0], :h*bin[1]].reshape(w, bin[0], h, bin[1]).mean(axis=3).mean(axis=1)
+
+
+def splatRects(data, start, stop, val):
+    """Add val[i] to the rectangle data[start[0,i]:stop[0,i], start[1,i]:stop[1,i]]
+    for all i at once, by summing corner values into an integral image."""
+    x0, y0 = [np.clip(a, 0, n) for a, n in zip(start, data.shape)]
+    x1, y1 = [np.clip(a, 0, n) for a, n in zip(stop, data.shape)]
+    mask = (x1 > x0) & (y1 > y0)
+    if not mask.any():
+        return
+    x0, y0, x1, y1, val = x0[mask], y0[mask], x1[mask], y1[mask], val[mask]
+
+    ## only integrate over the bounding box of all rectangles
+    bx, by = x0.min(), y0.min()
+    acc = np.zeros((x1.max() - bx + 1, y1.max() - by + 1))
+    np.add.at(acc, (x0-bx, y0-by), val)
+    np.add.at(acc, (x1-bx, y0-by), -val)
+    np.add.at(acc, (x0-bx, y1-by), -val)
+    np.add.at(acc, (x1-bx, y1-by), val)
+    data[bx:x1.max(), by:y1.max()] += acc.cumsum(axis=0).cumsum(axis=1)[:-1, :-1]
+
+
 def mandelbrot(w=500, h=None, maxIter=20, xRange=(-2.0, 1.0), yRange=(-1.2, 1.2)):
     x0,x1 = xRange
     y0,y1 = yRange
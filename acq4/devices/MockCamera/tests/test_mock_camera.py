@@ -0,0 +1,38 @@
+import numpy as np
+from acq4.devices.MockCamera.mock_camera import splatRects, binImage
+
+
+def test_splatRects():
+    shape = (40, 30)
+    rng = np.random.RandomState(0)
+    n = 200
+    ## rectangles may be empty, partially clipped, or entirely off the image
+    start = rng.randint(-20, 50, size=(2, n))
+    stop = start + rng.randint(0, 15, size=(2, n))
+    val = rng.normal(size=n)
+
+    data = np.zeros(shape)
+    splatRects(data, start, stop, val)
+
+    expect = np.zeros(shape)
+    for i in range(n):
+        ## clip by hand; negative indices would wrap around
+        x0, y0, x1, y1 = [max(a, 0) for a in (start[0, i], start[1, i], stop[0, i], stop[1, i])]
+        expect[x0:x1, y0:y1] += val[i]
+    assert np.allclose(data, expect)
+
+    ## nothing on the image; data is left untouched
+    data = np.ones(shape)
+    splatRects(data, np.array([[-10, 45], [0, 0]]), np.array([[-2, 50], [5, 5]]), np.array([1., 1.]))
+    assert np.all(data == 1)
+
+
+def test_binImage():
+    data = np.arange(7 * 10, dtype=float).reshape(7, 10)
+    assert binImage(data, (1, 1)) is data
+
+    binned = binImage(data, (2, 3))
+    assert binned.shape == (3, 3)
+    for i in range(3):
+        for j in range(3):
+            assert np.allclose(binned[i, j], data[i*2:(i+1)*2, j*3:(j+1)*3].mean())
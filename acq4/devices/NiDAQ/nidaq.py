@@ -18,6 +18,8 @@ class NiDAQ(Device):
         defaultAIMode: 'mode'  # mode to use for ai channels by default ('rse', 'nrse', or 'diff')
         defaultAIRange: [-10, 10]  # default voltage range to use for AI ports
         defaultAORange: [-10, 10]  # default voltage range to use for AO ports
+        mock: True | {...}         # use the simulated DAQ; a dict of options is passed
+                                   # to MockNIDAQ.configure() (see drivers/nidaq/mock.py)
     """
     def __init__(self, dm, config, name):
         Device.__init__(self, dm, config, name)
@@ -28,6 +30,8 @@ class NiDAQ(Device):
         ## make local copy of device handle
         if config is not None and config.get('mock', False):
             from acq4.drivers.nidaq.mock import NIDAQ
+            if isinstance(config['mock'], dict):
+                NIDAQ.configure(**config['mock'])
             self.n = NIDAQ
         else:
             from acq4.drivers.nidaq.nidaq import NIDAQ
@@ -135,7 +135,9 @@ class PVCam(Camera):
             frame = {}
             frame['time'] = self.lastFrameTime + (dt * (i+1))
             frame['id'] = self.frameId
-            frame['data'] = self.acqBuffer[fInd].copy()
+            data = self.framePool.acquire(self.acqBuffer.shape[1:], self.acqBuffer.dtype)
+            data[...] = self.acqBuffer[fInd]
+            frame['data'] = data
             #print frame['data']
             frames.append(frame)
             self.frameId += 1
@@ -28,6 +28,7 @@ class QCam(Camera):
         if serial not in cams:
             raise Exception('QCam camera "%s" not found. Options are: %s' % (serial, list(cams.keys())))
         self.cam = self.qcd.getCamera(cams[serial]) #open first camera
+        self.cam.framePool = self.framePool
             
     def listParams(self, params=None):
         """List properties of specified parameters, or of all parameters if None"""
@@ -171,6 +171,7 @@ class QCameraClass:
         self.stopSignal = True
         self.mutex = Mutex(Mutex.Recursive)
         self.lastImage = (None,0)
+        self.framePool = None  ## optional FramePool supplying the arrays returned by newFrames
         self.fnp1 = lib.AsyncCallback(self.callBack1)
         self.fnpNull = lib.AsyncCallback(self.doNothing)
         self.counter = 0
@@ -844,7 +845,7 @@ class QCameraClass:
         with self.mutex:
             #print "Mutex locked from qcam.callBack1()"
             #print "set last index", args[1]
-            self.lastImages.append({'id':self.counter, 'data':self.arrays[args[1]].copy(), 'time': self.frameTimes[args[1]], 'exposeDoneTime':self.frameTimes[args[1]]})
+            self.lastImages.append({'id':self.counter, 'data':self.copyFrame(self.arrays[args[1]]), 'time': self.frameTimes[args[1]], 'exposeDoneTime':self.frameTimes[args[1]]})
             self.counter += 1
             
             if self.stopSignal == False:
@@ -887,6 +888,14 @@ class QCameraClass:
         #time.sleep(0.5)
         #self.mutex.unlock()
 
+    def copyFrame(self, array):
+        ## copy a frame out of the ring buffer before it is reused by the camera
+        if self.framePool is None:
+            return array.copy()
+        data = self.framePool.acquire(array.shape, array.dtype)
+        data[...] = array
+        return data
+
     def newFrames(self):
         with self.mutex:
             #print "Mutex locked from qcam.lastFrame()"
@@ -1,13 +1,30 @@
 # -*- coding: utf-8 -*-
-import time
+import time, threading, Queue, sys, traceback
 from numpy import *
 import acq4.util.ptime as ptime  ## platform-independent precision timing
 from collections import OrderedDict
 from .base import NIDAQError
+import acq4.util.debug as debug
 
 
 class SuperTask:
-    """Class for creating and encapsulating multiple synchronous tasks. Holds and assembles arrays for writing to each task as well as per-channel meta data."""
+    """Class for creating and encapsulating multiple synchronous tasks. Holds and assembles arrays for writing to each task as well as per-channel meta data.
+    
+    Tasks are normally finite: configureClocks(rate, nPts), start(), then
+    getResult() once isDone(). For long recordings, tasks may instead stream
+    continuously in chunks (see configureStream)::
+    
+        st.configureStream(rate=20e3, chunkSize=2000)
+        writer = StreamFileWriter('recording.ma', ('Dev1', 'ai'))
+        st.startStream(callback=writer)
+        ...
+        st.stopStream()
+        writer.close()
+    """
+    
+    ## Number of chunks of generated output that are written ahead of acquisition
+    ## when streaming with a waveform function
+    outputAheadChunks = 2
     
     def __init__(self, daq):
         self.daq = daq
@@ -18,6 +35,8 @@ class SuperTask:
         self.devs = daq.listDevices()
         self.triggerChannel = None
         self.result = None
+        self.chunkSize = None  ## set by configureStream
+        self.streamThreads = []
         
     def absChanName(self, chan):
         parts = chan.lstrip('/').split('/')
@@ -163,6 +182,33 @@ class SuperTask:
         
     def configureClocks(self, rate, nPts):
         """Configure sample clock and triggering for all tasks"""
+        self.chunkSize = None
+        self._configureClocks(rate, nPts, self.daq.Val_FiniteSamps)
+        
+    def configureStream(self, rate, chunkSize, bufferChunks=8, waveformFunc=None):
+        """Configure all tasks for continuous acquisition, to be run with startStream().
+        
+        Input data are read in chunks of *chunkSize* samples per channel; the
+        device buffers up to *bufferChunks* chunks for each task.
+        
+        Output channels either repeat the waveforms given to setWaveform() 
+        (regenerated by the device), or, if *waveformFunc* is given, are
+        generated on the fly: waveformFunc(chan, start, nPts) must return the
+        output for *chan* from sample *start* to start+nPts. It is called from 
+        the stream reader thread, outputAheadChunks chunks before the samples 
+        are generated.
+        """
+        self.chunkSize = chunkSize
+        self.waveformFunc = waveformFunc
+        self._configureClocks(rate, chunkSize * bufferChunks, self.daq.Val_ContSamps)
+        for k in self.tasks:
+            if self.tasks[k].isOutputTask():
+                if waveformFunc is None:
+                    self.tasks[k].SetWriteRegenMode(self.daq.Val_AllowRegen)
+                else:
+                    self.tasks[k].SetWriteRegenMode(self.daq.Val_DoNotAllowRegen)
+        
+    def _configureClocks(self, rate, nPts, sampleMode):
         clkSource = None
         if len(self.tasks) == 0:
             raise Exception("No tasks to configure.")
@@ -213,10 +259,10 @@ class SuperTask:
             if k[1] != clkSource:
                 #print "%s CfgSampClkTiming(%s, %f, Val_Rising, Val_FiniteSamps, %d)" % (str(k), clk, rate, nPts)
 
-                self.tasks[k].CfgSampClkTiming(clk, rate, self.daq.Val_Rising, self.daq.Val_FiniteSamps, nPts)
+                self.tasks[k].CfgSampClkTiming(clk, rate, self.daq.Val_Rising, sampleMode, nPts)
             else:
                 #print "%s CfgSampClkTiming('', %f, Val_Rising, Val_FiniteSamps, %d)" % (str(k), rate, nPts)
-                self.tasks[k].CfgSampClkTiming("", rate, self.daq.Val_Rising, self.daq.Val_FiniteSamps, nPts)
+                self.tasks[k].CfgSampClkTiming("", rate, self.daq.Val_Rising, sampleMode, nPts)
 
         
     def setTrigger(self, trig):
@@ -235,7 +281,8 @@ class SuperTask:
         self.triggerChannel = trig
 
     def start(self):
-        self.writeTaskData()  ## Only writes if needed.
+        if self.chunkSize is None or self.waveformFunc is None:
+            self.writeTaskData()  ## Only writes if needed.
         
         self.result = None
         ## TODO: Reserve all hardware needed before starting tasks
@@ -358,3 +405,174 @@ class SuperTask:
         #print "get samples.."
         r = self.getResult()
         return r
+
+    def startStream(self, callback=None):
+        """Start the tasks configured with configureStream().
+        
+        Chunks are read by a reader thread into one of two sets of buffers while 
+        the other set is handed to *callback* in a separate thread. For each
+        chunk, callback(chunk) is called with a dict::
+        
+            {'start': index of the first sample in the chunk,
+             'time': time of the first sample (based on the start time of the tasks),
+             'rate': sample rate,
+             'nPts': number of samples per channel,
+             'data': {taskKey: array (channels, nPts)},  ## input tasks only
+             'channels': {taskKey: [channel names]}}
+        
+        The data arrays are reused for later chunks; callbacks must copy any data
+        they keep. Use chunkChannel() to get the data for a single channel. If
+        callbacks fall behind, the device buffer absorbs the difference until it
+        overflows, which stops the stream (see stopStream).
+        """
+        if self.chunkSize is None:
+            raise Exception("Must call configureStream() before startStream().")
+        if self.waveformFunc is not None:
+            for i in range(self.outputAheadChunks):
+                self._writeOutputChunk(i * self.chunkSize)
+        
+        self.streamCallback = callback
+        self.streamError = None
+        self._stopStream = False
+        self._freeBuffers = Queue.Queue()
+        self._fullBuffers = Queue.Queue()
+        for i in range(2):
+            bufs = {}
+            for k in self.tasks:
+                if self.tasks[k].isInputTask():
+                    dtype = float64 if k[1] == 'ai' else uint32
+                    bufs[k] = empty((self.tasks[k].GetTaskNumChans(), self.chunkSize), dtype=dtype)
+            self._freeBuffers.put(bufs)
+        
+        self.start()
+        self.streamThreads = [
+            threading.Thread(target=self._readStream, name='SuperTask stream reader'),
+            threading.Thread(target=self._dispatchStream, name='SuperTask stream dispatch'),
+        ]
+        for t in self.streamThreads:
+            t.daemon = True
+            t.start()
+            
+    def isStreaming(self):
+        return any([t.is_alive() for t in self.streamThreads])
+            
+    def stopStream(self):
+        """Stop streaming and release the hardware. All chunks read before the 
+        stream stopped are passed to the callback before this method returns.
+        Raises the error that stopped the stream, if any (eg. buffer overflow).
+        """
+        self._stopStream = True
+        try:
+            for t in self.streamThreads:
+                t.join()
+        finally:
+            self.streamThreads = []
+            self.stop(abort=True)
+        if self.streamError is not None:
+            exc = self.streamError
+            self.streamError = None
+            raise exc[0], exc[1], exc[2]
+            
+    def chunkChannel(self, chunk, chan):
+        """Return the data for *chan* from a chunk passed to the stream callback."""
+        info = self.channelInfo[self.absChanName(chan)]
+        return chunk['data'][info['task']][info['index']]
+        
+    def _writeOutputChunk(self, start):
+        for k in self.tasks:
+            if not self.tasks[k].isOutputTask():
+                continue
+            waves = []
+            for ch in self.taskInfo[k]['chans']:
+                w = asarray(self.waveformFunc(ch, start, self.chunkSize))
+                if k[1] == 'ao':
+                    w = clip(w.astype(float64), -10., 10.)
+                else:
+                    w = w.astype(uint32)
+                waves.append(w)
+            self.tasks[k].write(vstack(waves))
+    
+    def _readStream(self):
+        ## runs in the reader thread
+        inputs = [k for k in self.tasks if self.tasks[k].isInputTask()]
+        timeout = max(10., 4. * self.chunkSize / self.rate)
+        index = 0
+        try:
+            while not self._stopStream:
+                try:
+                    bufs = self._freeBuffers.get(timeout=0.1)
+                except Queue.Empty:
+                    continue
+                for k in inputs:
+                    self.tasks[k].read(self.chunkSize, timeout, out=bufs[k], fromStart=False)
+                if len(inputs) == 0:
+                    ## output only; keep pace with the sample clock
+                    wait = self.startTime + float(index + self.chunkSize) / self.rate - ptime.time()
+                    if wait > 0:
+                        time.sleep(wait)
+                if self.waveformFunc is not None:
+                    self._writeOutputChunk(index + self.outputAheadChunks * self.chunkSize)
+                self._fullBuffers.put((index, bufs))
+                index += self.chunkSize
+        except:
+            self.streamError = sys.exc_info()
+        finally:
+            self._fullBuffers.put(None)
+            
+    def _dispatchStream(self):
+        ## runs in the dispatch thread
+        channels = dict([(k, self.taskInfo[k]['chans']) for k in self.tasks])
+        while True:
+            item = self._fullBuffers.get()
+            if item is None:
+                break
+            index, bufs = item
+            if self.streamCallback is not None:
+                chunk = {
+                    'start': index,
+                    'time': self.startTime + float(index) / self.rate,
+                    'rate': self.rate,
+                    'nPts': self.chunkSize,
+                    'data': bufs,
+                    'channels': channels,
+                }
+                try:
+                    self.streamCallback(chunk)
+                except:
+                    debug.printExc("Error in DAQ stream callback:")
+            self._freeBuffers.put(bufs)
+
+
+class StreamFileWriter(object):
+    """SuperTask stream callback that appends the data from one input task
+    (given by its key, eg. ('Dev1', 'ai')) to a MetaArray file with axes
+    (Channel, Time). The file is complete once close() is called."""
+    
+    def __init__(self, fileName, task):
+        ## imported here to keep the driver usable without the rest of acq4
+        from acq4.util.metaarray import MetaArray, MetaArrayStackWriter
+        self.MetaArray = MetaArray
+        self.MetaArrayStackWriter = MetaArrayStackWriter
+        self.fileName = fileName
+        self.task = task
+        self.writer = None
+        self.numPts = 0
+        
+    def __call__(self, chunk):
+        data = chunk['data'][self.task]
+        start = chunk['start']
+        info = [
+            {'name': 'Channel', 'cols': [{'name': ch} for ch in chunk['channels'][self.task]]},
+            {'name': 'Time', 'units': 's', 'values': arange(start, start + data.shape[1]) / float(chunk['rate'])},
+            {'rate': chunk['rate'], 'startTime': chunk['time'] - start / float(chunk['rate'])},
+        ]
+        if self.writer is None:
+            self.writer = self.MetaArrayStackWriter(self.fileName, appendAxis='Time', data=self.MetaArray(data, info=info), profile='trace')
+        else:
+            self.writer.append(self.MetaArray(data, info=info))
+        self.numPts += data.shape[1]
+        
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
@@ -1,40 +1,85 @@
 # -*- coding: utf-8 -*-
-import sys, time, os
+"""
+Simulated NI-DAQmx driver.
+
+Tasks run in real time: finite tasks finish nPts / rate seconds after their
+sample clock starts, and continuous tasks make samples available as the
+clock advances. The simulated hardware is set with MockNIDAQ.configure()
+(or the 'mock' option of the NiDAQ device, see config/example/devices.cfg):
+
+    devices:      {'Dev1': {'ai': 32, 'ao': 4, 'lines': 32, 'maxRate': 1.25e6}}
+    noise:        rms noise (V) added to analog inputs
+    jitter:       maximum random delay (s) added to the completion of tasks and reads
+    loopback:     {aiChannel: {'source': aoChannel, 'gain': 1.0, 'offset': 0.0,
+                               'tau': 0.0, 'delay': 0}, ...}
+                  connects outputs to inputs through a first-order low-pass filter
+                  with time constant *tau* (s) and a delay of *delay* samples.
+                  Digital input lines may be looped back from digital output lines.
+    triggerDelay: time (s) from starting a triggered task until its start
+                  trigger arrives, or None to wait for fireTrigger()
+
+Analog inputs that are not looped back read 0 V plus noise, unless the
+channel was created with a 'mockFunc' option (used by mock devices).
+"""
+import sys, time, os, collections
 import numpy as np
 import acq4.util.clibrary as clibrary
 import ctypes
 modDir = os.path.dirname(__file__)
 headerFiles = [os.path.join(modDir, "NIDAQmx.h")]
-cacheFile = os.path.join(modDir, 'NIDAQmx_headers_%s.cache' % sys.platform)   
+cacheFile = os.path.join(modDir, 'NIDAQmx_headers_%s.cache' % sys.platform)
 
 DEFS = clibrary.CParser(headerFiles, cache=cacheFile, types={'__int64': ('long long')}, verbose=False)
 
 import SuperTask
+from .base import NIDAQError
 
 class MockNIDAQ:
+
+    defaultConfig = {
+        'devices': {'Dev1': {'ai': 32, 'ao': 4, 'lines': 32, 'maxRate': 2e6}},
+        'noise': 0.0,
+        'jitter': 0.0,
+        'loopback': {},
+        'triggerDelay': 0.0,
+    }
+
     def __init__(self):
         self.lib = clibrary.CLibrary(None, DEFS, prefix='DAQmx_')
-        #self.data = mockdata.getMockData('cell')
-        #self.data = hstack([self.data, self.data])
-        #self.sampleRate = 20000.
-        #self.loopTime = 20.
-        #self.dataPtr = 0.0
-        self.devs = {
-            'Dev1': {
-                'aiChans': {'/Dev1/ai0': 0, '/Dev1/ai1': 0, '/Dev1/ai2': 0, '/Dev1/ai3': 0},
-                'aoChans': {'/Dev1/ao0': 0, '/Dev1/ao1': 0, '/Dev1/ao2': 0, '/Dev1/ao3': 0},
-                'ports': {'/Dev1/port0': 0},
-                'lines': {'/Dev1/port0/line0': 0, '/Dev1/port0/line1': 0, '/Dev1/port0/line2': 0, '/Dev1/port0/line3': 0,},
-            }
-        }
         self.clocks = {}
+        self.configure()
 
     def __getattr__(self, attr):
         return getattr(self.lib, attr)
 
+    def configure(self, **opts):
+        """Set the simulated hardware; see module docstring for options."""
+        config = dict(self.defaultConfig)
+        config.update(opts)
+        self.config = config
+        self.noise = config['noise']
+        self.jitter = config['jitter']
+        self.triggerDelay = config['triggerDelay']
+        self.loopback = {}
+        for chan, lb in config['loopback'].items():
+            lb = dict(lb)
+            lb['source'] = self.normChannel(lb['source'])
+            self.loopback[self.normChannel(chan)] = lb
+
+        self.devs = {}
+        for dev, cfg in config['devices'].items():
+            self.devs[dev] = {
+                'aiChans': dict([('/%s/ai%d' % (dev, i), 0) for i in range(cfg.get('ai', 32))]),
+                'aoChans': dict([('/%s/ao%d' % (dev, i), 0) for i in range(cfg.get('ao', 4))]),
+                'ports': {'/%s/port0' % dev: 0},
+                'lines': dict([('/%s/port0/line%d' % (dev, i), 0) for i in range(cfg.get('lines', 32))]),
+                'maxRate': cfg.get('maxRate', 2e6),
+            }
+        self.outputs = {}  ## chan: OutputSignal for waveforms written to output tasks
+
     def listAIChannels(self, dev):
         return self.devs[dev]['aiChans'].keys()
-    
+
     def listAOChannels(self, dev):
         return self.devs[dev]['aoChans'].keys()
 
@@ -49,35 +94,12 @@ class MockNIDAQ:
 
     def listDOPorts(self, dev):
         return self.devs[dev]['ports'].keys()
-    
+
     def listDevices(self):
         return self.devs.keys()
 
-    def createTask(self, *args):
-        return self
-    
     def createSuperTask(self):
         return SuperTask.SuperTask(self)
-    
-    def start(self):
-        self.dataPtr = time.time()
-    
-    def read(self, size):
-        #dataLen = size / self.sampleRate
-        #dataEnd = self.dataPtr + dataLen
-        #now = time.time()
-        #if dataEnd > now:
-            #time.sleep(dataEnd-now)
-        #start = int((self.dataPtr % self.loopTime) * self.sampleRate)
-        #stop = int(start + size)
-        #self.dataPtr = dataEnd
-        ##print "read", start, stop
-        ##print "DAQ Returning %d:%d at %f" % (start, stop, time.time())
-        #return (self.data[:, start:stop], size)
-        return np.zeros(size)
-    
-    def GetReadAvailSampPerChan(self):
-        return self.sampleRate * (time.time() - self.dataPtr)
 
     def createTask(self):
         return Task(self)
@@ -94,7 +116,7 @@ class MockNIDAQ:
             mode = mode.lower()
             mode = modes.get(mode, None)
         return mode
-    
+
     def interpretChannel(self, chan):
 
         parts = chan.lstrip('/').split('/')
@@ -106,62 +128,165 @@ class MockNIDAQ:
             chan = '/'.join(parts)
         return dev, chan
 
+    def normChannel(self, chan):
+        """Return the full name of *chan*, eg. '/Dev1/line3' => '/Dev1/port0/line3'"""
+        return '/%s/%s' % self.interpretChannel(chan)
+
+    def checkChannel(self, chan, typ):
+        dev, name = self.interpretChannel(chan)
+        if dev not in self.devs:
+            raise NIDAQError(-200220, "Device identifier is invalid: %s" % dev)
+        key = {'ai': 'aiChans', 'ao': 'aoChans'}.get(typ, None)
+        if key is not None and self.normChannel(chan) not in self.devs[dev][key]:
+            raise NIDAQError(-200170, "Physical channel specified does not exist on this device: %s" % chan)
+
     def writeAnalogSample(self, chan, value, vRange=[-10., 10.], timeout=10.0):
         """Set the value of an AO or DO port"""
-        t = self.createTask()
-        t.CreateAOVoltageChan(chan, "", vRange[0], vRange[1], self.lib.Val_Volts, None)
-        #t.WriteAnalogScalarF64(True, timeout, value, None)
-        
+        self.checkChannel(chan, 'ao')
+        self.outputs[self.normChannel(chan)] = OutputSignal(np.array([value], dtype=float), periodic=True)
+
     def readAnalogSample(self, chan, mode=None, vRange=[-10., 10.], timeout=10.0):
         """Get the value of an AI port"""
-        if mode is None:
-            mode = self.lib.Val_Cfg_Default
-        else:
-            mode = self.interpretMode(mode)
-        t = self.createTask()
-        t.CreateAIVoltageChan(chan, "", mode, vRange[0], vRange[1], self.lib.Val_Volts, None)
-        #val = ctypes.c_double(0.)
-        #t.ReadAnalogScalarF64(timeout, byref(val), None)
-        #return val.value
-        return 0.0
+        self.checkChannel(chan, 'ai')
+        return float(self.inputData([self.normChannel(chan)], 0, 1, 'ai', 1.0)[0, 0])
 
     def writeDigitalSample(self, chan, value, timeout=10.):
         """Set the value of an AO or DO port"""
         dev, chan = self.interpretChannel(chan)
         chan = '/%s/%s' % (dev, chan)
         self.devs[dev]['lines'][chan] = value
-        # t = self.createTask()
-        # t.CreateDOChan(chan, "", self.lib.Val_ChanForAllLines)
-        #t.WriteDigitalScalarU32(True, timeout, value, None)
-        
+        self.outputs[chan] = OutputSignal(np.array([value], dtype=np.uint32), periodic=True)
+
     def readDigitalSample(self, chan, timeout=10.0):
         """Get the value of an AI port"""
-        dev, chan = self.interpretChannel(chan)
-        chan = '/%s/%s' % (dev, chan)
+        chan = self.normChannel(chan)
+        if chan in self.loopback:
+            return int(self.inputData([chan], 0, 1, 'di', 1.0)[0, 0])
+        dev, name = self.interpretChannel(chan)
         return self.devs[dev]['lines'][chan]
-        # t = self.createTask()
-        # t.CreateDIChan(chan, "", self.lib.Val_ChanForAllLines)
-        # val = ctypes.c_ulong(0)
-        # t.ReadDigitalScalarU32(timeout, byref(val), None)
-        # return val.value
 
-    def startClock(self, clock, duration):
-        self.clocks[clock] = (time.time(), duration)
+    def inputData(self, chans, start, n, typ, rate, filterState=None):
+        """Return simulated input data (len(chans), n) for samples start:start+n
+        acquired at *rate*. *filterState* is a dict used to continue the loopback
+        filters of each channel from a previous call."""
+        if typ == 'ai':
+            data = np.zeros((len(chans), n))
+            if self.noise > 0:
+                data += np.random.normal(scale=self.noise, size=data.shape)
+        else:
+            data = np.zeros((len(chans), n), dtype=np.uint32)
+        for i, chan in enumerate(chans):
+            lb = self.loopback.get(chan, None)
+            if lb is None:
+                if typ != 'ai' and chan in self.outputs:
+                    data[i] = self.outputs[chan].get(start, n)
+                continue
+            src = self.outputs.get(lb['source'], None)
+            if src is None:
+                continue
+            x = src.get(start - lb.get('delay', 0), n)
+            if typ != 'ai':
+                data[i] = x
+                continue
+            x = x.astype(float)
+            if lb.get('tau', 0) > 0:
+                x = self.lowpass(x, lb['tau'], rate, chan, filterState)
+            data[i] += lb.get('gain', 1.0) * x + lb.get('offset', 0.0)
+        return data
+
+    def lowpass(self, x, tau, rate, chan, state):
+        import scipy.signal
+        a = np.exp(-1.0 / (rate * tau))
+        b = [1 - a]
+        a = [1, -a]
+        if state is not None and chan in state:
+            zi = state[chan]
+        else:
+            zi = scipy.signal.lfilter_zi(b, a) * x[0]
+        y, zf = scipy.signal.lfilter(b, a, x, zi=zi)
+        if state is not None:
+            state[chan] = zf
+        return y
+
+    def startClock(self, clock, duration, trigger=None):
+        """Start the sample clock for a task lasting *duration* seconds (None for
+        continuous tasks), after *trigger* arrives if given."""
+        start = time.time()
+        if trigger is not None:
+            if self.triggerDelay is None:
+                start = None
+            else:
+                start += self.triggerDelay
+        jitter = np.random.uniform(0, self.jitter) if self.jitter > 0 else 0
+        self.clocks[clock] = {'start': start, 'duration': duration, 'trigger': trigger, 'jitter': jitter}
+
+    def fireTrigger(self, trigger):
+        """Start all clocks waiting for *trigger* (when triggerDelay is None)."""
+        now = time.time()
+        for clk in self.clocks.values():
+            if clk['start'] is None and clk['trigger'] == trigger:
+                clk['start'] = now
+
+    def clockStart(self, clock):
+        """Return the time at which *clock* started, or None if it has not."""
+        clk = self.clocks.get(clock, None)
+        if clk is None:
+            return None
+        return clk['start']
+
+    def clockEnd(self, clock):
+        clk = self.clocks.get(clock, None)
+        if clk is None or clk['start'] is None or clk['duration'] is None:
+            return None
+        return clk['start'] + clk['duration'] + clk['jitter']
 
     def stopClock(self, clock):
         if clock not in self.clocks:
             return
-        now = time.time()
-        start, dur = self.clocks[clock]
-        diff = (start+dur)-now
-        if diff > 0:
-            time.sleep(diff)
+        end = self.clockEnd(clock)
+        if end is not None:
+            diff = end - time.time()
+            if diff > 0:
+                time.sleep(diff)
+        del self.clocks[clock]
 
     def checkClock(self, clock):
-        now = time.time()
-        start, dur = self.clocks[clock]
-        diff = (start+dur)-now
-        return diff <= 0
+        if clock not in self.clocks:
+            return True
+        end = self.clockEnd(clock)
+        return end is not None and end <= time.time()
+
+
+class OutputSignal(object):
+    """Samples written to one output channel, indexed from the start of the task.
+    Regenerated (periodic) waveforms repeat; streamed chunks are kept until
+    they have been read. Samples before the first / after the last one written
+    hold the first / last value."""
+    def __init__(self, data=None, periodic=False):
+        self.periodic = periodic
+        self.data = data
+        self.chunks = collections.deque()  ## (start, data) of streamed output
+
+    def append(self, start, data):
+        self.chunks.append((start, data))
+
+    def get(self, start, n):
+        if self.data is not None:
+            index = np.arange(start, start + n)
+            if self.periodic:
+                index %= len(self.data)
+            else:
+                index = np.clip(index, 0, len(self.data) - 1)
+            return self.data[index]
+        if len(self.chunks) == 0:
+            return np.zeros(n)
+        ## discard chunks that end before this read
+        while len(self.chunks) > 1 and self.chunks[0][0] + len(self.chunks[0][1]) <= start:
+            self.chunks.popleft()
+        c0 = self.chunks[0][0]
+        data = np.concatenate([c[1] for c in self.chunks])
+        index = np.clip(np.arange(start, start + n) - c0, 0, len(data) - 1)
+        return data[index]
 
 
 class Task:
@@ -171,141 +296,198 @@ class Task:
         self.chOpts = []
         self.clock = None
         self.nativeClock = None
+        self.trigger = None
         self.data = None
         self.mode = None
-        
-    #def __getattr__(self, attr):
-        #return lambda *args: self
-    
-    def CreateAIVoltageChan(self, *args, **kargs):
-        self.chans.append(args[0])
+        self.rate = None
+        self.nPts = None
+        self.continuous = False
+        self.regen = True
+        self.running = False
+        self.startTime = None
+        self.readPos = 0
+        self.writePos = 0
+        self.filterState = {}
+
+    def _addChan(self, chan, mode, kargs):
+        self.nd.checkChannel(chan, mode)
+        self.chans.append(self.nd.normChannel(chan))
         self.chOpts.append(kargs)
-        self.mode = 'ai'
-        
+        self.mode = mode
+
+    def CreateAIVoltageChan(self, *args, **kargs):
+        self._addChan(args[0], 'ai', kargs)
+
     def CreateAOVoltageChan(self, *args, **kargs):
-        self.chans.append(args[0])
-        self.chOpts.append(kargs)
-        self.mode = 'ao'
-        
+        self._addChan(args[0], 'ao', kargs)
+
     def CreateDIChan(self, *args, **kargs):
-        self.chans.append(args[0])
-        self.chOpts.append(kargs)
-        self.mode = 'di'
-        
+        self._addChan(args[0], 'di', kargs)
+
     def CreateDOChan(self, *args, **kargs):
-        self.chans.append(args[0])
-        self.chOpts.append(kargs)
-        self.mode = 'do'
-        
-    def CfgSampClkTiming(self, clock, rate, b, c, nPts):
+        self._addChan(args[0], 'do', kargs)
+
+    def CfgSampClkTiming(self, clock, rate, b, sampleMode, nPts):
         if 'ai' in self.chans[0]:
             self.nativeClock = self.device()+'/ai/SampleClock'
         elif 'ao' in self.chans[0]:
             self.nativeClock = self.device()+'/ao/SampleClock'
-            
+
         if clock == '':
             clock = None
-        self.clock = clock 
-        self.rate = rate 
+        self.clock = clock
+        self.rate = float(rate)
         self.nPts = nPts
-        #print self.chans, self.clock
-        
+        ## in continuous mode, nPts is the buffer size
+        self.continuous = sampleMode == self.nd.lib.Val_ContSamps
+
+    def CfgDigEdgeStartTrig(self, trigger, edge):
+        self.trigger = self.absChannelName(trigger)
+
     def GetSampClkMaxRate(self):
-        return 2e6
-        
+        return self.nd.devs[self.device().lstrip('/')]['maxRate']
+
     def device(self):
         return '/'+self.chans[0].split('/')[1]
-        
-    def write(self, data):
+
+    def absChannelName(self, n):
+        parts = n.lstrip('/').split('/')
+        if parts[0] not in self.nd.devs:
+            parts = [self.device().lstrip('/')] + parts
+        return '/' + '/'.join(parts)
+
+    def sampleClock(self):
+        return self.nativeClock if self.clock is None else self.clock
+
+    def SetWriteRegenMode(self, mode):
+        self.regen = mode == self.nd.lib.Val_AllowRegen
+
+    def write(self, data, timeout=10.):
+        data = np.atleast_2d(data)
+        if self.continuous and not self.regen:
+            ## streamed output is appended to the samples already written;
+            ## wait for room in the output buffer
+            start = self.nd.clockStart(self.sampleClock())
+            if self.running and start is not None:
+                wait = start + (self.writePos + data.shape[1] - self.nPts) / self.rate - time.time()
+                if wait > timeout:
+                    raise NIDAQError(-200292, "Timed out waiting for space in the output buffer.")
+                if wait > 0:
+                    time.sleep(wait)
+            for i, chan in enumerate(self.chans):
+                if self.writePos == 0 or chan not in self.nd.outputs or self.nd.outputs[chan].data is not None:
+                    self.nd.outputs[chan] = OutputSignal()
+                self.nd.outputs[chan].append(self.writePos, data[i])
+            self.writePos += data.shape[1]
+            return data.shape[1]
+
         self.data = data
-        
+        for i, chan in enumerate(self.chans):
+            self.nd.outputs[chan] = OutputSignal(data[i], periodic=self.continuous)
+
         ## Send data off to callbacks if they were specified
         #print "write:", self.chOpts
         for i in range(len(self.chOpts)):
             if 'mockFunc' in self.chOpts[i]:
-                self.chOpts[i]['mockFunc'](data[i], 1.0/self.rate)  
-        
-        return len(data)
-        
-    def read(self):
-        dur = self.nPts / self.rate
-        tVals = np.linspace(0, dur, self.nPts)
-        if 'd' in self.mode:
-            data = np.empty((len(self.chans), self.nPts), dtype=np.int32)
-        else:
-            data = np.empty((len(self.chans), self.nPts))
-            
-        for i in range(len(self.chOpts)):
-            if 'mockFunc' in self.chOpts[i]:
-                data[i] = self.chOpts[i]['mockFunc']()
+                self.chOpts[i]['mockFunc'](data[i], 1.0/self.rate)
+
+        return data.shape[1]
+
+    def read(self, samples=None, timeout=10., dtype=None, out=None, fromStart=True):
+        if samples is None:
+            samples = self.nPts
+        if fromStart:
+            self.readPos = 0
+            self.filterState = {}
+        start = self.readPos
+        end = start + samples
+        if not self.continuous and end > self.nPts:
+            raise NIDAQError(-200278, "Attempted to read samples that will never be acquired.")
+
+        ## wait until the requested samples have been acquired
+        clock = self.sampleClock()
+        deadline = time.time() + timeout
+        while True:
+            if clock in self.nd.clocks:
+                t0 = self.nd.clockStart(clock)
             else:
-                data[i] = 0
-        return (data, self.nPts)
+                ## external clock; assume it runs at the configured rate
+                t0 = self.startTime
+            if t0 is not None:
+                ready = t0 + end / self.rate
+                if not self.continuous:
+                    ready = max(ready, self.nd.clockEnd(clock) or 0)
+                elif self.nd.jitter > 0:
+                    ready += np.random.uniform(0, self.nd.jitter)
+                if ready <= deadline:
+                    break
+            if time.time() >= deadline:
+                raise NIDAQError(-200284, "Some or all of the samples requested have not yet been acquired.")
+            time.sleep(min(0.01, max(0, deadline - time.time())))
+        wait = ready - time.time()
+        if wait > 0:
+            time.sleep(wait)
+        elif self.continuous and (time.time() - t0) * self.rate - self.readPos > self.nPts:
+            raise NIDAQError(-200279, "The application is not able to keep up with the hardware acquisition.")
+
+        data = self.nd.inputData(self.chans, start, samples, self.mode, self.rate, self.filterState)
+        if not self.continuous:
+            for i in range(len(self.chOpts)):
+                if 'mockFunc' in self.chOpts[i]:
+                    data[i] = self.chOpts[i]['mockFunc']()
+        if out is not None:
+            out[:] = data
+            data = out
+        self.readPos = end
+        return (data, samples)
 
     def start(self):
+        self.running = True
+        self.startTime = time.time()
+        self.readPos = 0
         ## only start clock if it matches the native clock for this channel
         if self.clock is None or self.clock == self.nativeClock:
-            dur = self.nPts / self.rate
-            self.nd.startClock(self.nativeClock, dur)
-        
-        
-    def stop(self):        
+            dur = None if self.continuous else self.nPts / self.rate
+            self.nd.startClock(self.nativeClock, dur, self.trigger)
+
+    def stop(self):
+        self.running = False
+        self.writePos = 0
+        if self.continuous:
+            if self.clock is None:
+                self.nd.clocks.pop(self.nativeClock, None)
+            return
         if self.clock is None:
             self.nd.stopClock(self.nativeClock)
         else:
             self.nd.stopClock(self.clock)
 
     def isDone(self):
+        if self.continuous:
+            return not self.running
         if self.clock is None:
             return self.nd.checkClock(self.nativeClock)
         else:
             return self.nd.checkClock(self.clock)
-        
+
 
     def GetTaskNumChans(self):
         return len(self.chans)
-        
+
     def isOutputTask(self):
         return self.mode in ['ao', 'do']
-        
+
     def isInputTask(self):
         return self.mode in ['ai', 'di']
-        
+
     def TaskControl(self, *args):
         pass
 
     def WriteAnalogScalarF64(self, a, timeout, val, b):
         pass
-    
+
     def WriteDigitalScalarU32(self, a, timeout, val, b):
         pass
-    
-
-#class SuperTask:
-    #def __init__(self, nd):
-        #self.nd = nd
-
-    #def __getattr__(self, attr):
-        #print "SuperTask."+attr
-        #return lambda *args, **kargs: self
 
 
 NIDAQ = MockNIDAQ()
-
-
-#class ModWrapper(object):
-    #def __init__(self, wrapped):
-        #self.wrapped = wrapped
-
-    #def __getattr__(self, name):
-        #try:
-            #return getattr(self.wrapped, name)
-        #except AttributeError:
-            #if name[:3] == 'Val':
-                #return None
-            #else:
-                #return lambda *args: NIDAQ
-
-    #def __iter__
-
-#sys.modules[__name__] = ModWrapper(sys.modules[__name__])
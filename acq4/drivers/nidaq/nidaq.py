@@ -263,7 +263,14 @@ class Task:
     def isDone(self):
         return self.IsTaskDone()
 
-    def read(self, samples=None, timeout=10., dtype=None):
+    def read(self, samples=None, timeout=10., dtype=None, out=None, fromStart=True):
+        """Read *samples* samples per channel, returning (data, samplesRead).
+        
+        By default, samples are read from the beginning of the acquisition. For 
+        continuous acquisitions, *fromStart* must be False to read the samples 
+        following those already read. If *out* is given, data are read into this
+        (numChans, samples) array rather than a new one.
+        """
         #reqSamps = samples
         #if samples is None:
         #    samples = self.GetSampQuantSampPerChan()
@@ -279,6 +286,8 @@ class Task:
         
         ## Determine the default dtype based on the task type
         tt = self.taskType()
+        if dtype is None and out is not None:
+            dtype = out.dtype.type
         if dtype is None:
             if tt in [LIB.Val_AI, LIB.Val_AO]:
                 dtype = float64
@@ -287,7 +296,12 @@ class Task:
             else:
                 raise Exception("No default dtype for %s tasks." % chTypes[tt])
 
-        buf = empty(shape, dtype=dtype)
+        if out is None:
+            buf = empty(shape, dtype=dtype)
+        else:
+            if out.shape != shape or out.dtype != dtype:
+                raise Exception("Output array must have shape %s and dtype %s" % (str(shape), str(np.dtype(dtype))))
+            buf = out
         #samplesRead = ctypes.c_long()
         
         ## Determine the correct function name to call based on the dtype requested
@@ -311,7 +325,10 @@ class Task:
             
         fName += dtypes[np.dtype(dtype).descr[0][1]]
         
-        self.SetReadRelativeTo(LIB.Val_FirstSample)
+        if fromStart:
+            self.SetReadRelativeTo(LIB.Val_FirstSample)
+        else:
+            self.SetReadRelativeTo(LIB.Val_CurrReadPos)
         self.SetReadOffset(0)
         
         ## buf.ctypes is a c_void_p, but the function requires a specific pointer type so we are forced to recast the pointer:
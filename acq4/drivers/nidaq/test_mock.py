@@ -0,0 +1,74 @@
+import time, threading
+import numpy as np
+from acq4.drivers.nidaq.mock import NIDAQ
+from acq4.drivers.nidaq.base import NIDAQError
+
+
+def teardown_function(func):
+    NIDAQ.configure()
+
+
+def finiteTask(chans, rate, nPts):
+    st = NIDAQ.createSuperTask()
+    for ch in chans:
+        st.addChannel(ch, ch.split('/')[-1][:2])
+    st.configureClocks(rate=rate, nPts=nPts)
+    return st
+
+
+def test_channels():
+    NIDAQ.configure(devices={'Dev1': {'ai': 64, 'ao': 8, 'lines': 8}})
+    assert len(NIDAQ.listAIChannels('Dev1')) == 64
+    chans = ['/Dev1/ai%d' % i for i in range(64)]
+    st = finiteTask(chans, 10000., 1000)
+    start = time.time()
+    data = st.run()[('Dev1', 'ai')]['data']
+    assert data.shape == (64, 1000)
+    assert time.time() - start >= 0.1  # data is acquired in real time
+
+    try:
+        st.addChannel('/Dev1/ao8', 'ao')
+        raise AssertionError("Expected invalid channel error")
+    except NIDAQError as exc:
+        assert exc.errCode == -200170
+
+
+def test_loopback():
+    NIDAQ.configure(loopback={
+        '/Dev1/ai0': {'source': '/Dev1/ao0', 'gain': 2.0, 'offset': 0.5},
+        '/Dev1/ai1': {'source': '/Dev1/ao0', 'tau': 1e-3, 'delay': 10},
+        '/Dev1/line1': {'source': '/Dev1/line0'},
+    })
+    st = finiteTask(['/Dev1/ai0', '/Dev1/ai1', '/Dev1/ai2', '/Dev1/ao0'], 10000., 500)
+    cmd = np.zeros(500)
+    cmd[100:] = 1.0
+    st.setWaveform('/Dev1/ao0', cmd)
+    res = st.run()[('Dev1', 'ai')]['data']
+    assert np.allclose(res[0], cmd * 2 + 0.5)
+    assert np.all(res[2] == 0)
+    ## delayed step, filtered with a 10-sample time constant
+    assert np.all(res[1][:110] == 0)
+    expect = 1 - np.exp(-np.arange(1, 391) / 10.)
+    assert np.allclose(res[1][110:], expect)
+
+    NIDAQ.writeAnalogSample('/Dev1/ao0', 3.0)
+    assert NIDAQ.readAnalogSample('/Dev1/ai0') == 6.5
+    NIDAQ.writeDigitalSample('/Dev1/line0', 1)
+    assert NIDAQ.readDigitalSample('/Dev1/line1') == 1
+
+
+def test_trigger():
+    NIDAQ.configure(triggerDelay=None, noise=0.1)
+    st = finiteTask(['/Dev1/ai0', '/Dev1/ai1'], 10000., 200)
+    st.setTrigger('/Dev1/PFI0')
+    st.start()
+    time.sleep(0.05)
+    assert not st.isDone()  # waiting for the trigger
+    threading.Timer(0.05, NIDAQ.fireTrigger, args=['/Dev1/PFI0']).start()
+    start = time.time()
+    data = st.read()[('Dev1', 'ai')][0]
+    assert time.time() - start >= 0.07
+    assert st.isDone()
+    st.stop()
+    assert data.shape == (2, 200)
+    assert 0.05 < data.std() < 0.2
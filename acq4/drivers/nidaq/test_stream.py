@@ -0,0 +1,69 @@
+import time, tempfile, shutil, os
+import numpy as np
+from acq4.drivers.nidaq.mock import NIDAQ
+from acq4.drivers.nidaq.SuperTask import StreamFileWriter
+from acq4.drivers.nidaq.base import NIDAQError
+from acq4.util.metaarray import MetaArray
+
+root = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(root)
+
+
+def makeTask():
+    st = NIDAQ.createSuperTask()
+    st.addChannel('/Dev1/ai0', 'ai')
+    st.addChannel('/Dev1/ai1', 'ai')
+    st.addChannel('/Dev1/ao0', 'ao')
+    return st
+
+
+def test_stream():
+    st = makeTask()
+    generated = []
+    def waveform(chan, start, n):
+        generated.append(start)
+        return np.arange(start, start + n) * 1e-4
+    st.configureStream(rate=10000., chunkSize=500, waveformFunc=waveform)
+
+    fileName = os.path.join(root, 'stream.ma')
+    writer = StreamFileWriter(fileName, ('Dev1', 'ai'))
+    chunks = []
+    def callback(chunk):
+        chunks.append(chunk['start'])
+        assert st.chunkChannel(chunk, '/Dev1/ai1').shape == (500,)
+        writer(chunk)
+
+    start = time.time()
+    st.startStream(callback)
+    time.sleep(0.3)
+    st.stopStream()
+    writer.close()
+
+    ## chunks arrive in real time, in order, without gaps
+    n = len(chunks)
+    assert 4 <= n <= 8
+    assert chunks == range(0, n * 500, 500)
+    assert time.time() - start >= n * 0.05
+    ## output is generated ahead of acquisition
+    assert generated[:n + st.outputAheadChunks] == range(0, (n + st.outputAheadChunks) * 500, 500)
+
+    ma = MetaArray(file=fileName)
+    assert ma.shape == (2, n * 500)
+    assert ma.listColumns()['Channel'] == ['/Dev1/ai0', '/Dev1/ai1']
+    assert np.allclose(ma.xvals('Time'), np.arange(n * 500) * 1e-4)
+
+
+def test_overflow():
+    st = makeTask()
+    st.configureStream(rate=10000., chunkSize=100, bufferChunks=2)
+    st.setWaveform('/Dev1/ao0', np.zeros(100))
+    st.startStream(lambda chunk: time.sleep(0.05))  ## much slower than the 10 ms chunks
+    time.sleep(0.2)
+    try:
+        st.stopStream()
+        raise AssertionError("Expected buffer overflow")
+    except NIDAQError as exc:
+        assert exc.errCode == -200279
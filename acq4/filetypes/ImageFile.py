@@ -64,6 +64,7 @@ if Image.VERSION == '1.1.6':
 from numpy import array, ndarray
 from acq4.util.metaarray import MetaArray as MA
 from FileType import *
+from acq4.util.ImagePyramid import buildPyramid
 
 #import libtiff
 #from PyQt4 import QtCore, QtGui
@@ -82,12 +83,15 @@ class ImageFile(FileType):
     def write(cls, data, dirHandle, fileName, **args):
         """Write data to fileName.
         Return the file name written (this allows the function to modify the requested file name)
+        If *pyramid* is True and data is a large image, an image pyramid is also generated.
         """
         fileName = cls.addExtension(fileName)
         ext = os.path.splitext(fileName)[1].lower()[1:]
         
         img = Image.fromarray(data.transpose())
         img.save(os.path.join(dirHandle.name(), fileName))
+        if args.get('pyramid', False):
+            buildPyramid(data, os.path.join(dirHandle.name(), fileName))
         
         #if ext in ['tif', 'tiff']:
             #d = data.transpose()
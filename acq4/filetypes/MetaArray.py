@@ -3,6 +3,7 @@
 from acq4.util.metaarray import MetaArray as MA
 from numpy import ndarray
 from FileType import *
+from acq4.util.ImagePyramid import buildPyramid
 
 #class MetaArray(FileType):
     #@staticmethod
@@ -28,14 +29,18 @@ class MetaArray(FileType):
     def write(cls, data, dirHandle, fileName, **args):
         """Write data to fileName.
         Return the file name written (this allows the function to modify the requested file name)
+        If *pyramid* is True and data is a large image, an image pyramid is also generated.
         """
         ext = cls.extensions[0]
         if fileName[-len(ext):] != ext:
             fileName = fileName + ext
             
+        pyramid = args.pop('pyramid', False)
         if not isinstance(data, MA):
             data = MA(data)
         data.write(os.path.join(dirHandle.name(), fileName), **args)
+        if pyramid:
+            buildPyramid(data, os.path.join(dirHandle.name(), fileName))
         return fileName
         
     @classmethod
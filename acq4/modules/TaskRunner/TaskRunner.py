@@ -643,6 +643,8 @@ class TaskRunner(Module):
         #prof.mark('protocol state')
         store = (dh is not None)
         prot['protocol']['storeData'] = store
+        ## results are written by the manager's storage queue; TaskThread flushes it when the run ends
+        prot['protocol']['writeBehind'] = True
         if store:
             if params != {}:
                 name = '_'.join(map(lambda i: '%03d'%i, params.values()))
@@ -968,6 +970,13 @@ class TaskThread(Thread):
             self.paramSpace = None
             printExc("Error in task thread, exiting.")
             self.sigExitFromError.emit()
+        finally:
+            ## make sure all results are on disk before the thread reports that it has stopped
+            try:
+                self.dm.storageQueue.flush()
+            except:
+                printExc("Error storing task results:")
+                self.sigExitFromError.emit()
                     
     def runOnce(self, params=None):
         # good time to collect garbage
@@ -115,7 +115,7 @@ class ImagingModule(AnalysisModule):
                         'imageProcessing': result['params'],
                     }]
             ma = metaarray.MetaArray(result['image'], info=info)
-            fh = dirhandle.writeFile(ma, 'Imaging.ma')
+            fh = dirhandle.writeFile(ma, 'Imaging.ma', profile='scan')
             fh.setInfo(transform=result['transform'])
 
     def autoDecomb(self):
@@ -9,7 +9,7 @@ file format. Data structures may be nested and contain any data type as long
 as it can be converted to/from a string using repr and eval.
 """
 
-import re, os, sys
+import re, os, sys, ast, operator
 from .pgcollections import OrderedDict
 GLOBAL_PATH = None # so not thread safe.
 from . import units
@@ -43,7 +43,13 @@ def writeConfigFile(data, fname):
     fd.write(s)
     fd.close()
     
-def readConfigFile(fname):
+def readConfigFile(fname, engine='eval'):
+    """Read and parse a configuration file.
+    
+    *engine* selects the parser: 'eval' evaluates every value with eval(), 
+    while 'fast' uses parseStringFast(), which accepts the same syntax but
+    evaluates literal values without eval().
+    """
     #cwd = os.getcwd()
     global GLOBAL_PATH
     if GLOBAL_PATH is not None:
@@ -60,7 +66,12 @@ def readConfigFile(fname):
         fd.close()
         s = s.replace("\r\n", "\n")
         s = s.replace("\r", "\n")
-        data = parseString(s)[1]
+        if engine == 'fast':
+            data = parseStringFast(s, fileName=fname)
+        elif engine == 'eval':
+            data = parseString(s)[1]
+        else:
+            raise ValueError("Unknown config parser engine '%s'" % engine)
     except ParseError:
         sys.exc_info()[1].fileName = fname
         raise
@@ -187,6 +198,242 @@ def measureIndent(s):
     while n < len(s) and s[n] == ' ':
         n += 1
     return n
+
+
+## Namespace used by the fast parser when it must fall back to eval().
+## Built once rather than once per line.
+_EVAL_NAMESPACE = None
+
+def _evalNamespace():
+    global _EVAL_NAMESPACE
+    if _EVAL_NAMESPACE is None:
+        local = units.allUnits.copy()
+        local['OrderedDict'] = OrderedDict
+        local['readConfigFile'] = readConfigFile
+        local['Point'] = Point
+        local['QtCore'] = QtCore
+        local['ColorMap'] = ColorMap
+        local['array'] = numpy.array
+        for dtype in ['int8', 'uint8', 
+                      'int16', 'uint16', 'float16',
+                      'int32', 'uint32', 'float32',
+                      'int64', 'uint64', 'float64']:
+            local[dtype] = getattr(numpy, dtype)
+        _EVAL_NAMESPACE = local
+    return _EVAL_NAMESPACE
+
+
+class _NotLiteral(Exception):
+    pass
+
+_INT_RE = re.compile(r'-?(0|[1-9][0-9]*)$')
+_FLOAT_RE = re.compile(r'-?(([0-9]+\.[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?|[0-9]+[eE][-+]?[0-9]+)$')
+_CONSTANTS = {'True': True, 'False': False, 'None': None}
+## Callables that may be invoked on literal arguments without resorting to eval()
+_SAFE_CALLS = ['array', 'OrderedDict', 'Point', 'int8', 'uint8', 'int16', 'uint16', 'float16',
+               'int32', 'uint32', 'float32', 'int64', 'uint64', 'float64']
+_BINOPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: getattr(operator, 'div', operator.truediv),  ## match eval() semantics in this module
+    ast.Pow: operator.pow,
+}
+_UNARYOPS = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+def _literalNode(node):
+    """Evaluate an AST expression node that contains only literals, unit names,
+    arithmetic, and calls to a small set of constructors. Raises _NotLiteral
+    for anything else."""
+    typ = type(node)
+    if typ.__name__ in ('Num', 'Str', 'Bytes', 'NameConstant', 'Constant'):
+        for attr in ('value', 'n', 's'):
+            if hasattr(node, attr):
+                return getattr(node, attr)
+    elif typ is ast.Name:
+        if node.id in _CONSTANTS:
+            return _CONSTANTS[node.id]
+        ns = _evalNamespace()
+        if node.id in ns and node.id not in _SAFE_CALLS:
+            return ns[node.id]
+    elif typ is ast.Tuple:
+        return tuple([_literalNode(n) for n in node.elts])
+    elif typ is ast.List:
+        return [_literalNode(n) for n in node.elts]
+    elif typ is ast.Dict:
+        return dict([(_literalNode(k), _literalNode(v)) for k, v in zip(node.keys, node.values)])
+    elif typ is ast.UnaryOp and type(node.op) in _UNARYOPS:
+        return _UNARYOPS[type(node.op)](_literalNode(node.operand))
+    elif typ is ast.BinOp and type(node.op) in _BINOPS:
+        return _BINOPS[type(node.op)](_literalNode(node.left), _literalNode(node.right))
+    elif typ is ast.Call and type(node.func) is ast.Name and node.func.id in _SAFE_CALLS:
+        if getattr(node, 'starargs', None) is not None or getattr(node, 'kwargs', None) is not None:
+            raise _NotLiteral()
+        args = []
+        for a in node.args:
+            if type(a).__name__ == 'Starred':
+                raise _NotLiteral()
+            args.append(_literalNode(a))
+        kwds = {}
+        for kw in node.keywords:
+            if kw.arg is None:
+                raise _NotLiteral()
+            if kw.arg == 'dtype' and type(kw.value) is ast.Name and kw.value.id in _SAFE_CALLS:
+                kwds[kw.arg] = _evalNamespace()[kw.value.id]
+            else:
+                kwds[kw.arg] = _literalNode(kw.value)
+        return _evalNamespace()[node.func.id](*args, **kwds)
+    raise _NotLiteral()
+
+_UNIT_RE = re.compile(r'([-+0-9.eE]+)\*([A-Za-z]+)$')
+_NO_SCALAR = object()
+
+def _scalar(v):
+    """Convert a simple scalar literal (string without escapes, number, 
+    number*unit, True/False/None) directly. Returns _NO_SCALAR otherwise."""
+    c = v[0]
+    if c == "'" or c == '"':
+        body = v[1:-1]
+        if len(v) > 1 and v[-1] == c and c not in body and '\\' not in body:
+            try:
+                return str(body)
+            except UnicodeError:
+                pass
+    elif v in _CONSTANTS:
+        return _CONSTANTS[v]
+    elif _INT_RE.match(v):
+        return int(v)
+    elif _FLOAT_RE.match(v):
+        return float(v)
+    else:
+        m = _UNIT_RE.match(v)
+        if m is not None and m.group(2) in units.allUnits:
+            num = _scalar(m.group(1))
+            if num is not _NO_SCALAR and not isinstance(num, basestring):
+                return num * units.allUnits[m.group(2)]
+    return _NO_SCALAR
+
+def evalLiteral(v):
+    """Evaluate the value string *v* as written by genString().
+    
+    Common literals (numbers, plain strings, True/False/None, flat tuples and
+    lists of these) are converted directly, other literals (nested containers,
+    dicts, array(...), unit arithmetic) are evaluated from their syntax tree, 
+    and eval() is used only for expressions that cannot be evaluated safely 
+    otherwise.
+    """
+    val = _scalar(v)
+    if val is not _NO_SCALAR:
+        return val
+    
+    ## flat tuple or list of scalars
+    c = v[0]
+    if (c == '(' and v[-1] == ')') or (c == '[' and v[-1] == ']'):
+        body = v[1:-1]
+        if not any(x in body for x in '([{\'"#'):
+            items = [x.strip() for x in body.split(',')]
+            if len(items) > 0 and items[-1] == '':
+                items.pop()   ## trailing comma
+            vals = []
+            for x in items:
+                if x == '':
+                    break
+                val = _scalar(x)
+                if val is _NO_SCALAR:
+                    break
+                vals.append(val)
+            else:
+                if c == '[':
+                    return vals
+                if len(vals) != 1 or body.rstrip().endswith(','):  ## "(x)" is not a tuple
+                    return tuple(vals)
+    
+    try:
+        tree = ast.parse(v.strip(), mode='eval')
+    except SyntaxError:
+        tree = None
+    if tree is not None:
+        try:
+            return _literalNode(tree.body)
+        except _NotLiteral:
+            pass
+    return eval(v, _evalNamespace().copy())
+
+def parseStringFast(s, fileName=None):
+    """Parse a configuration string, returning an OrderedDict.
+    
+    This accepts the same syntax as parseString(), but processes the text in
+    a single pass and evaluates values with evalLiteral() rather than eval().
+    """
+    root = OrderedDict()
+    keyCache = {}    ## tuple keys are typically repeated many times in .index files
+    stack = None     ## [(indent, dict), ...] for all open levels
+    pending = None   ## (dict, key, indent) of the last key with no value
+    
+    for lineNum, l in enumerate(s.split('\n')):
+        ## Skip blank lines and comments
+        stripped = l.lstrip()
+        if len(stripped) == 0 or stripped[0] == '#':
+            continue
+        ind = len(l) - len(l.lstrip(' '))
+        
+        if stack is None:
+            stack = [(ind, root)]
+        
+        ## A key with no value followed by a more-indented line opens a nested dict
+        if pending is not None:
+            pdict, pkey, pind = pending
+            pending = None
+            if ind > pind:
+                sub = OrderedDict()
+                pdict[pkey] = sub
+                stack.append((ind, sub))
+        
+        while ind < stack[-1][0]:
+            stack.pop()
+            if len(stack) == 0:
+                ## parseString() silently stops at a line indented less than the first line
+                return root
+        if ind > stack[-1][0]:
+            raise ParseError('Indentation is incorrect. Expected %d, got %d' % (stack[-1][0], ind), lineNum+1, l, fileName)
+        data = stack[-1][1]
+        
+        (k, p, v) = l.partition(':')
+        if p == '':
+            raise ParseError('Missing colon', lineNum+1, l, fileName)
+        k = k.strip()
+        v = v.strip()
+        if len(k) < 1:
+            raise ParseError('Missing name preceding colon', lineNum+1, l, fileName)
+        if k[0] == '(' and k[-1] == ')':  ## If the key looks like a tuple, try evaluating it.
+            if k in keyCache:
+                k = keyCache[k]
+            else:
+                k1 = k
+                try:
+                    k1 = evalLiteral(k)
+                    if type(k1) is not tuple:
+                        k1 = k
+                except Exception:
+                    pass
+                keyCache[k] = k1
+                k = k1
+        
+        if len(v) > 0 and v[0] != '#':
+            try:
+                val = evalLiteral(v)
+            except Exception:
+                ex = sys.exc_info()[1]
+                raise ParseError("Error evaluating expression '%s': [%s: %s]" % (v, ex.__class__.__name__, str(ex)), lineNum+1, l, fileName)
+        else:
+            val = {}
+            pending = (data, k, ind)
+        data[k] = val
+    
+    return root
     
     
     
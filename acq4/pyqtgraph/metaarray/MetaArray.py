@@ -12,7 +12,8 @@ More info at http://www.scipy.org/Cookbook/MetaArray
 
 import numpy as np
 import types, copy, threading, os, re
-import pickle
+import pickle, zlib, collections
+from multiprocessing.pool import ThreadPool
 from functools import reduce
 #import traceback
 
@@ -48,6 +49,54 @@ def axis(name=None, cols=None, values=None, units=None):
             ax['cols'].append(col)
     return ax
 
+def chunkShape(shape, itemsize, chunkBytes, access='columns', columnAxes=(), appendAxis=None):
+    """Return an HDF5 chunk shape for an array of the given shape and item size.
+    
+    Chunks hold roughly *chunkBytes* bytes, arranged according to the expected 
+    *access* pattern:
+    
+    =========  ===========================================================
+    'frames'   Data is read one or more frames at a time along the first
+               axis (or appendAxis); chunks contain whole frames if possible.
+    'columns'  Data is read one column at a time, over long ranges of the
+               other axes; chunks span a single column of each axis in
+               *columnAxes* and as many rows of the last axes as possible.
+    'blocks'   Data is read as arbitrary sub-regions; chunks are as close
+               to cubical as the array shape allows.
+    =========  ===========================================================
+    
+    The appendAxis is treated as unbounded, since the array will grow along it.
+    """
+    ndim = len(shape)
+    shape = [max(1, int(x)) for x in shape]
+    if appendAxis is not None:
+        shape[appendAxis] = 2**62
+    chunks = [1] * ndim
+    n = max(1, int(chunkBytes // itemsize))  # number of elements per chunk
+    
+    if access == 'columns':
+        axes = [i for i in reversed(range(ndim)) if i not in columnAxes]
+    elif access == 'frames':
+        frameAxis = 0 if appendAxis is None else appendAxis
+        axes = [i for i in reversed(range(ndim)) if i != frameAxis] + [frameAxis]
+    elif access == 'blocks':
+        ## give each axis an equal share of the chunk, smallest axes first
+        axes = sorted(range(ndim), key=lambda i: shape[i])
+        for j, i in enumerate(axes):
+            side = int(round(n ** (1. / (ndim - j))))
+            chunks[i] = max(1, min(shape[i], side))
+            n = max(1, n // chunks[i])
+        return tuple(chunks)
+    else:
+        raise ValueError("Access pattern must be 'frames', 'columns', or 'blocks' (got %r)" % access)
+    
+    ## fill axes in order until the chunk is full
+    for i in axes:
+        chunks[i] = max(1, min(shape[i], n))
+        n = max(1, n // chunks[i])
+    return tuple(chunks)
+
+
 class sliceGenerator(object):
     """Just a compact way to generate tuples of slice objects."""
     def __getitem__(self, arg):
@@ -112,6 +161,18 @@ class MetaArray(object):
     # May also be a tuple (filter, opts), such as ('gzip', 3)
     defaultCompression = None
     
+    ## Named write profiles, used as write(fileName, profile=name). Each profile 
+    ## chooses the chunk shape using chunkShape() with the given access pattern 
+    ## and target chunk size in bytes, and may set 'compression' (otherwise 
+    ## defaultCompression is used). Profiles may be modified or added through the
+    ## 'writeProfiles' section of the acq4 configuration; use 
+    ## tools/benchmarkMetaArray.py to measure the effect of each setting.
+    writeProfiles = {
+        'video': {'access': 'frames', 'chunkBytes': 4e6},    # camera stacks
+        'trace': {'access': 'columns', 'chunkBytes': 256e3},  # multichannel recordings
+        'scan': {'access': 'blocks', 'chunkBytes': 1e6},     # scanner / PMT records
+    }
+    
     ## Types allowed as axis or column names
     nameTypes = [basestring, tuple]
     @staticmethod
@@ -126,6 +187,7 @@ class MetaArray(object):
         object.__init__(self)
         #self._infoOwned = False
         self._isHDF = False
+        self._lazy = False
         
         if file is not None:
             self._data = None
@@ -137,6 +199,11 @@ class MetaArray(object):
             if (hasattr(data, 'implements') and data.implements('MetaArray')):
                 self._info = data._info
                 self._data = data.asarray()
+            elif kwargs.get('lazy', False) and not isinstance(data, np.ndarray):
+                ## data is an h5py Dataset or similar object providing shape, dtype, and
+                ## __getitem__ for integer / increasing slice indexes; it is read on demand.
+                self._data = data
+                self._lazy = True
             elif isinstance(data, tuple):  ## create empty array with specified shape
                 self._data = np.empty(data, dtype=dtype)
             else:
@@ -219,7 +286,10 @@ class MetaArray(object):
         nInd = self._interpretIndexes(ind)
         
         #a = np.ndarray.__getitem__(self, nInd)
-        a = self._data[nInd]
+        if isinstance(self._data, np.ndarray):
+            a = self._data[nInd]
+        else:
+            a = self._readHDF5Subset(nInd)
         if len(nInd) == self.ndim:
             if np.all([not isinstance(ind, slice) for ind in nInd]):  ## no slices; we have requested a single value from the array
                 return a
@@ -351,6 +421,11 @@ class MetaArray(object):
     def asarray(self):
         if isinstance(self._data, np.ndarray):
             return self._data
+        elif self._lazy:
+            ## lazy arrays are read into memory once, then the file is closed
+            self._data = self._data[...]
+            self.close()
+            return self._data
         else:
             return np.array(self._data)
             
@@ -475,7 +550,7 @@ class MetaArray(object):
             return copy.deepcopy(self._info[self._interpretAxis(axis)])
   
     def copy(self):
-        return MetaArray(self._data.copy(), info=self.infoCopy())
+        return MetaArray(self.asarray().copy(), info=self.infoCopy())
   
   
     def _interpretIndexes(self, ind):
@@ -590,6 +665,55 @@ class MetaArray(object):
             #print "  normal numerical index"
             return (pos, ind, False)
   
+    def _readHDF5Subset(self, ind):
+        """Read the selection *ind* (as returned by _interpretIndexes) from an HDF5 dataset
+        (or other lazily-read data; see __init__).
+        
+        h5py only supports increasing hyperslab selections, so the dataset is read 
+        with one (strided) slice per axis covering the requested region; any 
+        index lists, masks, or reversed slices are then applied in memory.
+        """
+        h5Ind = []
+        post = []
+        fancy = False
+        for i, index in enumerate(ind):
+            n = self._data.shape[i]
+            if isinstance(index, slice):
+                start, stop, step = index.indices(n)
+                if step > 0:
+                    h5Ind.append(slice(start, max(start, stop), step))
+                    post.append(slice(None))
+                    continue
+                index = np.arange(start, stop, step)
+            elif isinstance(index, (int, long, np.integer)):
+                if index < -n or index >= n:
+                    raise IndexError("Index %d is out of bounds for axis %d with size %d" % (index, i, n))
+                h5Ind.append(index % n)
+                continue
+            
+            ## index list or boolean mask
+            index = np.asarray(index)
+            if index.dtype == bool:
+                index = np.nonzero(index)[0]
+            index = np.where(index < 0, index + n, index)
+            if index.size == 0:
+                h5Ind.append(slice(0, 0))
+                post.append(slice(None))
+                continue
+            lo = index.min()
+            hi = index.max() + 1
+            h5Ind.append(slice(lo, hi))
+            if index.ndim == 1 and hi - lo == len(index) and np.all(np.diff(index) == 1):
+                post.append(slice(None))  # contiguous selection; no need to re-index
+            else:
+                post.append(index - lo)
+                fancy = True
+        
+        data = self._data[tuple(h5Ind)]
+        if fancy:
+            data = data[tuple(post)]
+        return data
+  
     def _getAxis(self, name):
         for i in range(0, len(self._info)):
             axis = self._info[i]
@@ -674,7 +798,12 @@ class MetaArray(object):
 
     def axisCollapsingFn(self, fn, axis=None, *args, **kargs):
         #arr = self.view(np.ndarray)
-        fn = getattr(self._data, fn)
+        data = self._data
+        if not isinstance(data, np.ndarray):
+            ## lazy data (HDF5 dataset, VideoReader frames) has no reduction methods;
+            ## read it for this call only so the array stays lazy.
+            data = np.asarray(data[...])
+        fn = getattr(data, fn)
         if axis is None:
             return fn(axis, *args, **kargs)
         else:
@@ -724,6 +853,11 @@ class MetaArray(object):
                           and the file is closed (this is the default for files < 500MB). Otherwise, the file will
                           be left open and data will be read only as requested (this is 
                           the default for files >= 500MB).
+            *lazy* (bool) if True, the file is left open and indexing the array (including by 
+                          axis name, column name, or axis value range) reads only the selected
+                          region from disk. The entire array is read (and the file closed) 
+                          the first time it is needed, eg. by asarray() or arithmetic.
+                          Ignored for non-HDF5 files.
         
         
         """
@@ -896,9 +1030,12 @@ class MetaArray(object):
         #raise Exception()  ## stress-testing
         #return subarr
 
-    def _readHDF5(self, fileName, readAllData=None, writable=False, **kargs):
+    def _readHDF5(self, fileName, readAllData=None, writable=False, lazy=False, **kargs):
         if 'close' in kargs and readAllData is None: ## for backward compatibility
             readAllData = kargs['close']
+        if lazy and HAVE_HDF5:
+            readAllData = False
+            self._lazy = not writable
        
         if readAllData is True and writable is True:
             raise Exception("Incompatible arguments: readAllData=True and writable=True")
@@ -936,6 +1073,15 @@ class MetaArray(object):
             self._data = f['data'][:]
             f.close()
             
+    def close(self):
+        """Close the HDF5 file backing this array, if any. Data that has not been 
+        read from the file is no longer available afterward."""
+        f = getattr(self, '_openFile', None)
+        if f is not None:
+            self._openFile = None
+            self._lazy = False
+            f.close()
+
     def _readHDF5Remote(self, fileName):
         ## Used to read HDF5 files via remote process.
         ## This is needed in the case that HDF5 is not importable due to the use of python-dbg.
@@ -1021,12 +1167,14 @@ class MetaArray(object):
             appendAxis: the name (or index) of the appendable axis. Allows the array to grow.
             compression: None, 'gzip' (good compression), 'lzf' (fast compression), etc.
             chunks: bool or tuple specifying chunk shape
+            profile: name of one of the writeProfiles (or a profile dict) used to 
+                     select chunk shape and compression
         """
         
         if USE_HDF5 and HAVE_HDF5:
             return self.writeHDF5(fileName, **opts)
         else:
-            return self.writeMa(fileName, **opts)
+            return self.writeMa(fileName, appendAxis=opts.get('appendAxis', None), newFile=opts.get('newFile', False))
 
     def writeMeta(self, fileName):
         """Used to re-write meta info to the given file.
@@ -1041,8 +1189,16 @@ class MetaArray(object):
 
 
     def writeHDF5(self, fileName, **opts):
+        profile = opts.get('profile', None)
+        if isinstance(profile, basestring):
+            if profile not in self.writeProfiles:
+                raise Exception("Unknown write profile '%s' (options are %s)" % (profile, ', '.join(self.writeProfiles.keys())))
+            profile = self.writeProfiles[profile]
+        
         ## default options for writing datasets
         comp = self.defaultCompression
+        if profile is not None and 'compression' in profile:
+            comp = profile['compression']
         if isinstance(comp, tuple):
             comp, copts = comp
         else:
@@ -1055,10 +1211,19 @@ class MetaArray(object):
         if copts is not None:
             dsOpts['compression_opts'] = copts
         
-        ## if there is an appendable axis, then we can guess the desired chunk shape (optimized for appending)
         appAxis = opts.get('appendAxis', None)
         if appAxis is not None:
             appAxis = self._interpretAxis(appAxis)
+            
+        ## choose chunk shape from the profile's expected access pattern
+        if profile is not None:
+            colAxes = [i for i in range(self.ndim) if 'cols' in self._info[i]]
+            dsOpts['chunks'] = chunkShape(self.shape, self.dtype.itemsize, profile.get('chunkBytes', 1e6), 
+                                          access=profile.get('access', 'columns'), columnAxes=colAxes, 
+                                          appendAxis=appAxis)
+        
+        ## if there is an appendable axis, then we can guess the desired chunk shape (optimized for appending)
+        elif appAxis is not None:
             cs = [min(100000, x) for x in self.shape]
             cs[appAxis] = 1
             dsOpts['chunks'] = tuple(cs)
@@ -1247,6 +1412,280 @@ class MetaArray(object):
         
 
 
+class MetaArrayStackWriter(object):
+    """Append to a MetaArray file along one axis, keeping the file open between calls.
+    
+    MetaArray.write(fileName, appendAxis=...) reopens and resizes the file for every
+    block that is appended. This class instead keeps the HDF5 file open, grows the
+    data (and axis values) in steps of at least *growStep* rows, and trims the file
+    to its final length in close(). The file must be closed before it is read 
+    elsewhere; until then it may contain unused (zero-filled) rows at the end.
+    
+    If *data* is given, the file is created with the first block; otherwise 
+    *fileName* must already be a MetaArray file with a resizable *appendAxis* 
+    (as written with MetaArray.write(fileName, appendAxis=...)).
+    
+    If the data is gzip-compressed, whole chunks are compressed by *workers*
+    threads (see ParallelChunkWriter). In that case appended arrays must not be
+    modified after append() returns.
+    
+    Without HDF5 support, each block is appended with MetaArray.write().
+    
+    Example::
+    
+        writer = MetaArrayStackWriter('video.ma', appendAxis='Time', data=firstFrames)
+        writer.append(moreFrames)
+        writer.close()
+    """
+    
+    ## minimum number of rows added whenever the file is grown
+    growStep = 256
+    
+    ## number of threads compressing gzip chunks; None uses one per CPU, and 
+    ## 1 leaves compression to HDF5
+    workers = None
+    
+    def __init__(self, fileName, appendAxis, data=None, growStep=None, workers=None, **opts):
+        self.fileName = fileName
+        self.appendAxis = appendAxis
+        if growStep is not None:
+            self.growStep = growStep
+        if workers is None:
+            workers = self.workers
+        if workers is None:
+            workers = ParallelChunkWriter.cpuCount()
+        self.file = None
+        self.chunkWriter = None
+        self.length = 0
+        
+        if data is not None:
+            if not (hasattr(data, 'implements') and data.implements('MetaArray')):
+                data = MetaArray(data)
+            data.write(fileName, appendAxis=appendAxis, **opts)
+            self.length = data.shape[data._interpretAxis(appendAxis)]
+        
+        if not (USE_HDF5 and HAVE_HDF5):
+            return
+        
+        self.file = h5py.File(fileName, 'r+')
+        if self.file.attrs['MetaArray'] != MetaArray.version:
+            self.file.close()
+            self.file = None
+            raise Exception("The file %s was created with a different version of MetaArray. Will not modify." % fileName)
+        self.data = self.file['data']
+        info = MetaArray.readHDF5Meta(self.file['info'])
+        self.axis = appendAxis
+        if MetaArray.isNameType(appendAxis):
+            names = [ax.get('name', None) for ax in info[:-1]]
+            if appendAxis not in names:
+                self.close()
+                raise Exception("No axis named %s in %s" % (appendAxis, fileName))
+            self.axis = names.index(appendAxis)
+        if self.data.maxshape[self.axis] is not None:
+            self.close()
+            raise Exception("Axis %s of %s is not appendable." % (appendAxis, fileName))
+        axInfo = self.file['info'][str(self.axis)]
+        self.values = axInfo['values'] if 'values' in axInfo else None
+        self.length = self.data.shape[self.axis]
+        if workers > 1 and ParallelChunkWriter.supports(self.data):
+            self.chunkWriter = ParallelChunkWriter(self.data, self.axis, workers)
+        
+    def append(self, data):
+        """Append *data* (MetaArray or ndarray) to the end of the file.
+        Axis values for the append axis are taken from the MetaArray's info."""
+        if not (hasattr(data, 'implements') and data.implements('MetaArray')):
+            data = MetaArray(data)
+        if self.file is None:
+            if not (USE_HDF5 and HAVE_HDF5):
+                data.write(self.fileName, appendAxis=self.appendAxis)
+                self.length += data.shape[data._interpretAxis(self.appendAxis)]
+                return
+            raise Exception("Cannot append; %s has already been closed." % self.fileName)
+        
+        ax = self.axis
+        n = data.shape[ax]
+        end = self.length + n
+        if end > self.data.shape[ax]:
+            self._resize(end + max(self.growStep, n))
+        if self.chunkWriter is not None:
+            self.chunkWriter.write(self.length, data.view(np.ndarray))
+        else:
+            sl = [slice(None)] * self.data.ndim
+            sl[ax] = slice(self.length, end)
+            self.data[tuple(sl)] = data.view(np.ndarray)
+        if self.values is not None:
+            self.values[self.length:end] = data._info[ax]['values']
+        self.length = end
+        
+    def _resize(self, length):
+        shape = list(self.data.shape)
+        shape[self.axis] = length
+        self.data.resize(tuple(shape))
+        if self.values is not None:
+            vshape = list(self.values.shape)
+            vshape[0] = length
+            self.values.resize(tuple(vshape))
+        
+    def close(self):
+        """Trim the file to the number of rows written and close it."""
+        if self.file is None:
+            return
+        try:
+            if self.chunkWriter is not None:
+                self.chunkWriter.close()
+            if self.data.shape[self.axis] != self.length:
+                self._resize(self.length)
+        finally:
+            self.chunkWriter = None
+            self.file.close()
+            self.file = None
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *args):
+        self.close()
+
+
+class ParallelChunkWriter(object):
+    """Write rows of a gzip-compressed HDF5 dataset, compressing chunks in parallel.
+    
+    HDF5 compresses each chunk in the thread that writes it, which limits gzip
+    recording to the speed of a single core. This class instead splits the 
+    rows into whole chunks, compresses them in a pool of *workers* threads
+    (zlib releases the GIL while compressing), and writes the compressed 
+    chunks in order with HDF5 direct chunk writes. The resulting file is an 
+    ordinary compressed HDF5 dataset.
+    
+    Rows must be written contiguously along *axis*. Rows before the first 
+    chunk boundary, and rows that do not fill a whole chunk when close() is 
+    called, are written through HDF5 as usual. All HDF5 calls are made from 
+    the thread calling write() and close(). The dataset must already be large
+    enough to hold the rows written.
+    """
+    def __init__(self, dataset, axis, workers):
+        self.dataset = dataset
+        self.axis = axis
+        self.chunks = dataset.chunks
+        self.rows = self.chunks[axis]
+        ## number of chunks spanning each of the other axes
+        self.tiles = [-(-dataset.shape[i] // self.chunks[i]) if i != axis else 1 for i in range(dataset.ndim)]
+        self.level = dataset.compression_opts
+        if self.level is None:
+            self.level = 4  # HDF5 default
+        self.shuffle = dataset.shuffle
+        self.pool = ThreadPool(workers)
+        self.maxPending = 2 * workers
+        self.pending = collections.deque()  # AsyncResults in the order they must be written
+        self.buffer = []  # rows that do not yet fill a chunk
+        self.bufStart = None
+        self.bufRows = 0
+        
+    @staticmethod
+    def supports(dataset):
+        """Return True if chunks of *dataset* can be compressed by this class."""
+        return (dataset.chunks is not None and dataset.compression == 'gzip' and 
+                not dataset.fletcher32 and dataset.scaleoffset is None and 
+                hasattr(dataset.id, 'write_direct_chunk'))
+    
+    @staticmethod
+    def cpuCount():
+        try:
+            import multiprocessing
+            return multiprocessing.cpu_count()
+        except NotImplementedError:
+            return 1
+        
+    def write(self, start, data):
+        """Write *data* to the dataset beginning at row *start* along the axis."""
+        ax = self.axis
+        data = np.asarray(data, dtype=self.dataset.dtype)
+        n = data.shape[ax]
+        if self.bufRows == 0:
+            ## fill a partial chunk left by earlier writes
+            head = min(n, (-start) % self.rows)
+            if head > 0:
+                self._writeRows(start, self._take(data, 0, head))
+                start += head
+                data = self._take(data, head, n)
+                n -= head
+            if n == 0:
+                return
+            self.bufStart = start
+        self.bufRows += n
+        if self.bufRows < self.rows:
+            ## the caller may reuse its array once write() returns
+            self.buffer.append(data.copy())
+            return
+        self.buffer.append(data)
+        
+        if len(self.buffer) == 1:
+            ## rows are compressed after write() returns; don't keep views of the caller's array
+            buf = data.copy()
+        else:
+            buf = np.concatenate(self.buffer, axis=ax)
+        full = (self.bufRows // self.rows) * self.rows
+        for i in range(0, full, self.rows):
+            rows = self._take(buf, i, i + self.rows)
+            self.pending.append(self.pool.apply_async(self._compressRows, (self.bufStart + i, rows)))
+        rest = self._take(buf, full, self.bufRows)
+        self.bufStart += full
+        self.bufRows -= full
+        self.buffer = [rest.copy()] if self.bufRows > 0 else []
+        self._writeCompressed(self.maxPending)
+        
+    def close(self):
+        """Write all remaining data and stop the worker threads."""
+        try:
+            self._writeCompressed(0)
+            if self.bufRows > 0:
+                self._writeRows(self.bufStart, np.concatenate(self.buffer, axis=self.axis))
+                self.buffer = []
+                self.bufRows = 0
+        finally:
+            self.pool.close()
+            self.pool.join()
+        
+    def _take(self, data, start, stop):
+        sl = [slice(None)] * data.ndim
+        sl[self.axis] = slice(start, stop)
+        return data[tuple(sl)]
+        
+    def _writeRows(self, start, data):
+        sl = [slice(None)] * data.ndim
+        sl[self.axis] = slice(start, start + data.shape[self.axis])
+        self.dataset[tuple(sl)] = data
+        
+    def _writeCompressed(self, maxPending):
+        ## write finished chunks in order, waiting for the oldest until no 
+        ## more than maxPending remain
+        while len(self.pending) > 0 and (len(self.pending) > maxPending or self.pending[0].ready()):
+            for offset, chunk in self.pending.popleft().get():
+                self.dataset.id.write_direct_chunk(offset, chunk, 0)
+        
+    def _compressRows(self, start, rows):
+        ## runs in a worker thread; returns [(chunkOffset, compressedBytes), ...]
+        ## for all chunks covering *rows*. Chunks at the far edges of the other
+        ## axes are zero-padded to the full chunk shape, as HDF5 stores them.
+        chunks = self.chunks
+        ndim = len(chunks)
+        out = []
+        for index in np.ndindex(*self.tiles):
+            offset = tuple([start if i == self.axis else index[i] * chunks[i] for i in range(ndim)])
+            sl = tuple([slice(None) if i == self.axis else slice(offset[i], offset[i] + chunks[i]) for i in range(ndim)])
+            tile = rows[sl]
+            if tile.shape != chunks:
+                padded = np.zeros(chunks, dtype=rows.dtype)
+                padded[tuple([slice(0, s) for s in tile.shape])] = tile
+                tile = padded
+            tile = np.ascontiguousarray(tile)
+            if self.shuffle and tile.dtype.itemsize > 1:
+                ## HDF5 shuffle filter: group byte 0 of every element, then byte 1, ...
+                tile = np.ascontiguousarray(tile.view(np.uint8).reshape(-1, tile.dtype.itemsize).T)
+            out.append((offset, zlib.compress(tile.tostring(), self.level)))
+        return out
+
+
 #class H5MetaList():
     
 
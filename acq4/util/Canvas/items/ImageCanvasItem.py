@@ -6,8 +6,16 @@ import scipy.ndimage as ndimage
 import acq4.pyqtgraph as pg
 import acq4.util.DataManager as DataManager
 import acq4.util.debug as debug
+from acq4.util.ImagePyramid import ImagePyramid, HAVE_HDF5
+from acq4.util.imaging.video_reader import VideoReader
+
 
 class ImageCanvasItem(CanvasItem):
+    
+    ## Large images loaded from files are displayed from an image pyramid (see 
+    ## acq4.util.ImagePyramid), which is generated the first time the image is loaded.
+    usePyramids = True
+    
     def __init__(self, image=None, **opts):
         """
         CanvasItem displaying an image. 
@@ -24,6 +32,7 @@ class ImageCanvasItem(CanvasItem):
 
         item = None
         self.data = None
+        self.pyramid = None
         self.currentT = None
         
         if isinstance(image, QtGui.QGraphicsItem):
@@ -33,7 +42,7 @@ class ImageCanvasItem(CanvasItem):
         elif isinstance(image, DataManager.FileHandle):
             opts['handle'] = image
             self.handle = image
-            self.data = self.handle.read()
+            meta = self.loadImage()
 
             if 'name' not in opts:
                 opts['name'] = self.handle.shortName()
@@ -59,10 +68,10 @@ class ImageCanvasItem(CanvasItem):
                             print 'mpos: ', m['position']
                             opts['pos'] = m['position'][0:2]
                         else:
-                            info = self.data._info[-1]
+                            info = meta._info[-1]
                             opts['pos'] = info.get('imagePosition', None)
-                    elif hasattr(self.data, '_info'):
-                        info = self.data._info[-1]
+                    elif hasattr(meta, '_info'):
+                        info = meta._info[-1]
                         opts['scale'] = info.get('pixelSize', None)
                         opts['pos'] = info.get('imagePosition', None)
                     else:
@@ -70,9 +79,14 @@ class ImageCanvasItem(CanvasItem):
                         opts['scalable'] = True
             except:
                 debug.printExc('Error reading transformation for image file %s:' % image.name())
+            if meta is not self._data and hasattr(meta, 'close'):
+                meta.close()
 
         if item is None:
-            item = pg.ImageItem()
+            if self.pyramid is not None:
+                item = PyramidImageItem(self.pyramid)
+            else:
+                item = pg.ImageItem()
         CanvasItem.__init__(self, item, **opts)
 
         self.histogram = pg.PlotWidget()
@@ -136,7 +150,10 @@ class ImageCanvasItem(CanvasItem):
         self.timeControls = [self.timeSlider, self.edgeBtn, self.maxBtn, self.meanBtn, self.maxBtn2,
             self.maxMedianBtn, self.filterOrder, self.zPlanes]
 
-        if self.data is not None:
+        if self.pyramid is not None:
+            for widget in self.timeControls:
+                widget.setVisible(False)
+        elif self.data is not None:
             self.updateImage(self.data)
 
 
@@ -144,6 +161,56 @@ class ImageCanvasItem(CanvasItem):
         self.levelRgn.sigRegionChanged.connect(self.levelsChanged)
         self.levelRgn.sigRegionChangeFinished.connect(self.levelsChangeFinished)
 
+    def loadImage(self):
+        """Read the image from self.handle, or open its pyramid if it is large.
+        Image stacks are opened with VideoReader so that frames are read as needed.
+        Return an object with the file's meta-info (if any)."""
+        if self.usePyramids:
+            self.pyramid = ImagePyramid.open(self.handle.name())
+        if self.pyramid is None:
+            if self.handle.fileType() == 'MetaArray':
+                video = VideoReader(self.handle.name())
+                if video.ndim == 4 or (video.ndim == 3 and video.shape[2] > 4):
+                    self.data = video
+                    return video
+                video.close()
+            self.data = self.handle.read()
+            if self.usePyramids and HAVE_HDF5 and ImagePyramid.isLarge(self.data):
+                try:
+                    self.pyramid = ImagePyramid.build(self.data, self.handle.name())
+                except:
+                    debug.printExc('Error generating image pyramid for %s:' % self.handle.name())
+                else:
+                    meta = self.data
+                    self.data = None
+                    return meta
+            return self.data
+        elif self.handle.fileType() == 'MetaArray':
+            return self.handle.read(lazy=True)  ## only the header is needed
+        return None
+
+    @property
+    def data(self):
+        ## When the image is displayed from a pyramid, the full-resolution data 
+        ## is only read if something asks for it.
+        if self._data is None and self.pyramid is not None:
+            self._data = self.handle.read()
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        ## a replaced VideoReader would otherwise keep its file open
+        old = getattr(self, '_data', None)
+        if isinstance(old, VideoReader) and old is not data:
+            old.close()
+        self._data = data
+
+    def setCanvas(self, canvas):
+        CanvasItem.setCanvas(self, canvas)
+        if canvas is None and isinstance(self._data, VideoReader):
+            ## removed from the canvas; release the file
+            self.data = None
+
     @classmethod
     def checkFile(cls, fh):
         if not fh.isFile():
@@ -561,4 +628,105 @@ class ImageCanvasItem(CanvasItem):
             return out
 
 
-
+class PyramidImageItem(pg.ImageItem):
+    """ImageItem that displays an ImagePyramid. Only the tiles that intersect the
+    view are loaded, from the pyramid level that best matches the view scale.
+    
+    Setting a new image with setImage() replaces the pyramid, after which this
+    item behaves like a normal ImageItem.
+    """
+    def __init__(self, pyramid):
+        self.pyramid = pyramid
+        self.region = None      # (level, x0, y0, x1, y1) of the currently loaded data
+        self.regionRect = None  # area covered by the loaded data, in full-resolution pixels
+        pg.ImageItem.__init__(self)
+        
+        ## view changes come in bursts while panning / zooming
+        self.updateTimer = QtCore.QTimer()
+        self.updateTimer.setSingleShot(True)
+        self.updateTimer.timeout.connect(self.updateRegion)
+        
+        ## start with the whole image at the lowest resolution
+        self.preview = pyramid.read(len(pyramid.levels)-1)
+        self.setRegion((len(pyramid.levels)-1, 0, 0) + self.preview.shape[:2], self.preview, autoLevels=True)
+        
+    def setImage(self, image=None, autoLevels=None, **kargs):
+        if image is not None:
+            self.pyramid = None
+            self.regionRect = None
+        return pg.ImageItem.setImage(self, image, autoLevels=autoLevels, **kargs)
+        
+    def setRegion(self, region, data, autoLevels=False):
+        scale = 2 ** region[0]
+        x0, y0, x1, y1 = region[1:]
+        self.region = region
+        self.regionRect = QtCore.QRectF(x0 * scale, y0 * scale, (x1-x0) * scale, (y1-y0) * scale)
+        pg.ImageItem.setImage(self, data, autoLevels=autoLevels)
+        
+    def width(self):
+        if self.pyramid is None:
+            return pg.ImageItem.width(self)
+        return self.pyramid.shape[0]
+
+    def height(self):
+        if self.pyramid is None:
+            return pg.ImageItem.height(self)
+        return self.pyramid.shape[1]
+
+    def viewRangeChanged(self):
+        if self.pyramid is not None:
+            self.updateTimer.start(50)
+        
+    def viewTransformChanged(self):
+        self.viewRangeChanged()
+        
+    def updateRegion(self):
+        if self.pyramid is None:
+            return
+        view = self.viewRect()
+        pxv = self.pixelVectors()[0]
+        if view is None or pxv is None:
+            return
+        rect = view.intersected(self.boundingRect())
+        level = self.pyramid.chooseLevel(pxv.length())
+        region = None
+        if rect.width() > 0 and rect.height() > 0:
+            region = self.pyramid.tileRegion(level, rect.left(), rect.top(), rect.right(), rect.bottom())
+        if region is None:
+            ## not visible; keep only the preview
+            region = (len(self.pyramid.levels)-1, 0, 0) + self.preview.shape[:2]
+            data = self.preview
+        else:
+            region = (level,) + region
+            if region == self.region:
+                return
+            data = self.pyramid.read(level, region[1:])
+        if region != self.region:
+            self.setRegion(region, data)
+
+    def getHistogram(self, *args, **kargs):
+        ## histogram of the whole image rather than the visible region
+        if self.pyramid is None:
+            return pg.ImageItem.getHistogram(self, *args, **kargs)
+        image = self.image
+        self.image = self.preview
+        try:
+            return pg.ImageItem.getHistogram(self, *args, **kargs)
+        finally:
+            self.image = image
+
+    def paint(self, p, *args):
+        if self.pyramid is None:
+            return pg.ImageItem.paint(self, p, *args)
+        if self.image is None:
+            return
+        if self.qimage is None:
+            self.render()
+            if self.qimage is None:
+                return
+        if self.paintMode is not None:
+            p.setCompositionMode(self.paintMode)
+        p.drawImage(self.regionRect, self.qimage)
+        if self.border is not None:
+            p.setPen(self.border)
+            p.drawRect(self.boundingRect())
@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+DataCatalog.py -  SQLite catalog of the meta-info stored in a data storage tree
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+The catalog holds one record per managed directory and per indexed file,
+containing its info() dict and a flattened copy of its fields that can be
+queried without walking the directory tree or parsing .index files.
+The .index files remain the authoritative copy of all meta-info.
+
+The catalog is kept current in two ways:
+  - When attached to the DataManager (DataManager.setCatalog), every change
+    made through DirHandles is queued and applied in the background.
+  - rescan(baseDir) re-reads every .index whose mtime has changed since it
+    was last catalogued (for data written by other processes).
+
+From the command line:
+    python -m acq4.util.DataCatalog catalog.sqlite rescan /path/to/storage
+"""
+
+import os, sys, time, threading, sqlite3
+import cPickle as pickle
+from acq4.util.debug import printExc
+
+## comparison operators accepted in query field conditions
+OPERATORS = ['=', '!=', '<', '<=', '>', '>=', 'like', 'glob']
+
+
+def entryType(info):
+    """Return the type string recorded for an entry with the given info dict."""
+    typ = info.get('dirType', None)
+    if typ is None:
+        typ = info.get('__object_type__', None)
+    if typ is None and 'protocol' in info:
+        typ = 'ProtocolSequence' if 'sequenceParams' in info else 'Protocol'
+    return typ
+
+
+def flattenInfo(info, prefix=''):
+    """Yield (key, value) pairs for all fields in info, with nested dicts and
+    tuple keys joined by '.', and non-scalar values converted to their repr."""
+    for k, v in info.items():
+        if isinstance(k, tuple):
+            k = '.'.join(map(str, k))
+        key = prefix + str(k)
+        if isinstance(v, dict):
+            for item in flattenInfo(v, key + '.'):
+                yield item
+        elif isinstance(v, bool):
+            yield key, int(v)
+        elif isinstance(v, (int, long, float, basestring)) or v is None:
+            yield key, v
+        else:
+            yield key, repr(v)
+
+
+class DataCatalog(object):
+    """SQLite catalog of directory and file meta-info. See module docstring.
+
+    All paths are absolute and normalized with DataManager.abspath(). Methods
+    accepting a path also accept a FileHandle or DirHandle.
+    """
+
+    def __init__(self, fileName, dataManager=None):
+        self.fileName = fileName
+        self.dm = dataManager
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(fileName, check_same_thread=False)
+        self.db.text_factory = unicode
+        ## Changes are queued under a separate lock: they are reported by DirHandles
+        ## holding their own lock, while flush() must lock DirHandles to read them.
+        self.queueLock = threading.Lock()
+        ## Serializes flushes so that queued changes are applied in order. Indexes
+        ## are read (which locks the DataManager) holding only this lock, never
+        ## self.lock, so the DataManager may use the catalog while it is locked.
+        self.flushLock = threading.Lock()
+        self.pending = []  # queued ('update', dir, names) / ('move', old, new) / ('delete', path)
+        self.flushInterval = 2.0
+        self._flushThread = None
+        self._createTables()
+
+    def _createTables(self):
+        with self.lock:
+            self.db.executescript("""
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY, indexMTime REAL, journalMTime REAL);
+                CREATE TABLE IF NOT EXISTS entries (
+                    path TEXT PRIMARY KEY, dir TEXT, name TEXT, isDir INTEGER,
+                    type TEXT, timestamp REAL, info BLOB);
+                CREATE INDEX IF NOT EXISTS entries_dir ON entries (dir);
+                CREATE INDEX IF NOT EXISTS entries_type ON entries (type);
+                CREATE TABLE IF NOT EXISTS fields (path TEXT, key TEXT, value);
+                CREATE INDEX IF NOT EXISTS fields_path ON fields (path);
+                CREATE INDEX IF NOT EXISTS fields_key_value ON fields (key, value);
+            """)
+            self.db.commit()
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+            self.db = None
+
+    ## Queueing changes reported by the DataManager
+
+    def indexChanged(self, dirPath, names=None):
+        """Queue an update for entries *names* in the index of dirPath (all entries if names is None)."""
+        self._queue(('update', dirPath, None if names is None else set(names)))
+
+    def pathMoved(self, oldPath, newPath):
+        self._queue(('move', oldPath, newPath))
+
+    def pathDeleted(self, path):
+        self._queue(('delete', path))
+
+    def _queue(self, op):
+        with self.queueLock:
+            ## merge consecutive updates to the same directory
+            if op[0] == 'update' and len(self.pending) > 0:
+                last = self.pending[-1]
+                if last[0] == 'update' and last[1] == op[1]:
+                    if last[2] is None or op[2] is None:
+                        names = None
+                    else:
+                        names = last[2] | op[2]
+                    self.pending[-1] = ('update', op[1], names)
+                    return
+            self.pending.append(op)
+            if self._flushThread is None:
+                self._flushThread = threading.Thread(target=self._flushLoop)
+                self._flushThread.daemon = True
+                self._flushThread.start()
+
+    def _flushLoop(self):
+        while self.db is not None:
+            time.sleep(self.flushInterval)
+            try:
+                self.flush()
+            except:
+                printExc("Error updating data catalog:")
+
+    def flush(self):
+        """Apply all queued changes to the database."""
+        with self.flushLock:
+            with self.queueLock:
+                pending = self.pending
+                self.pending = []
+            if len(pending) == 0:
+                return
+            ## read the indexes before locking the database (see flushLock)
+            reads = {}
+            for op in pending:
+                if op[0] == 'update' and op[1] not in reads:
+                    reads[op[1]] = self._readDir(op[1])
+            with self.lock:
+                if self.db is None:
+                    return
+                for op in pending:
+                    if op[0] == 'update':
+                        self._updateDir(op[1], op[2], *reads[op[1]])
+                    elif op[0] == 'move':
+                        self._movePath(op[1], op[2])
+                    elif op[0] == 'delete':
+                        self._deletePath(op[1])
+                self.db.commit()
+
+    ## Reading data from disk
+
+    def rescan(self, baseDir, force=False):
+        """Re-catalog every managed directory beneath baseDir whose index has
+        changed since it was last catalogued (or all of them if force is True).
+        Returns the number of directories that were re-read."""
+        baseDir = self._abspath(baseDir)
+        self.flush()
+        with self.lock:
+            known = dict([(r[0], (r[1], r[2])) for r in self.db.execute(
+                "SELECT path, indexMTime, journalMTime FROM dirs WHERE path=? OR substr(path, 1, ?)=?",
+                (baseDir, len(baseDir)+1, os.path.join(baseDir, '')))])
+        count = 0
+        for dirPath, subDirs, files in os.walk(baseDir):
+            dirPath = self._abspath(dirPath)
+            if '.index' not in files:
+                continue
+            mtimes = self._indexMTimes(dirPath)
+            lastMTimes = known.pop(dirPath, None)
+            if force or lastMTimes != mtimes:
+                index, mtimes = self._readDir(dirPath)
+                with self.lock:
+                    self._updateDir(dirPath, None, index, mtimes)
+                    self.db.commit()
+                count += 1
+        ## remove directories that have disappeared
+        with self.lock:
+            for dirPath in known:
+                self._deletePath(dirPath)
+            self.db.commit()
+        return count
+
+    def _abspath(self, path):
+        if not isinstance(path, basestring):
+            path = path.name()  # FileHandle or DirHandle
+        return os.path.normcase(os.path.abspath(path))
+
+    def _indexMTimes(self, dirPath):
+        mtimes = []
+        for f in ('.index', '.index.journal'):
+            try:
+                mtimes.append(os.path.getmtime(os.path.join(dirPath, f)))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _readIndex(self, dirPath):
+        if self.dm is None:
+            import acq4.util.DataManager as DataManager
+            self.dm = DataManager.getDataManager()
+        dh = self.dm.getDirHandle(dirPath)
+        return dh._readIndex(unmanagedOk=True)
+
+    def _readDir(self, dirPath):
+        """Return (index, index mtimes) for dirPath; index is None if the
+        directory is gone or unmanaged. Must not be called with self.lock held."""
+        dirPath = self._abspath(dirPath)
+        mtimes = self._indexMTimes(dirPath)
+        index = None
+        if os.path.isdir(dirPath):
+            index = self._readIndex(dirPath)
+        return index, mtimes
+
+    def _updateDir(self, dirPath, names, index, mtimes):
+        """Update the catalog records for *names* (or for all entries if names
+        is None) from the index of dirPath, as returned by _readDir."""
+        dirPath = self._abspath(dirPath)
+        if index is None:
+            self._deletePath(dirPath, recursive=False)
+            return
+
+        if names is None:
+            self._deleteRows("dir=?", (dirPath,))
+            names = index.keys()
+            ## record index mtimes only when the entire index was catalogued
+            self.db.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", (dirPath,) + mtimes)
+
+        for name in names:
+            if name == '.':
+                path = dirPath
+            else:
+                path = os.path.join(dirPath, name)
+                if os.path.isdir(path):
+                    ## subdirectories are catalogued from their own index
+                    continue
+            ## directory records are only removed by moves/deletes of the directory itself
+            self._deleteRows("path=? AND (isDir=0 OR dir=?)", (path, dirPath))
+            if name not in index:
+                continue
+            info = index[name]
+            self.db.execute("INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)", (
+                path, dirPath, os.path.basename(path), int(name == '.'), entryType(info),
+                info.get('__timestamp__', None),
+                sqlite3.Binary(pickle.dumps(dict(info), pickle.HIGHEST_PROTOCOL))))
+            self.db.executemany("INSERT INTO fields VALUES (?, ?, ?)",
+                                [(path, k, v) for k, v in flattenInfo(info)])
+
+    def _deleteRows(self, where, args):
+        self.db.execute("DELETE FROM fields WHERE path IN (SELECT path FROM entries WHERE %s)" % where, args)
+        self.db.execute("DELETE FROM entries WHERE %s" % where, args)
+
+    def _deletePath(self, path, recursive=True):
+        path = self._abspath(path)
+        prefix = os.path.join(path, '')
+        if recursive:
+            self._deleteRows("path=? OR substr(path, 1, ?)=?", (path, len(prefix), prefix))
+            self.db.execute("DELETE FROM dirs WHERE path=? OR substr(path, 1, ?)=?", (path, len(prefix), prefix))
+        else:
+            self._deleteRows("dir=?", (path,))
+            self.db.execute("DELETE FROM dirs WHERE path=?", (path,))
+        self._deleteRows("path=?", (path,))
+
+    def _movePath(self, oldPath, newPath):
+        oldPath = self._abspath(oldPath)
+        newPath = self._abspath(newPath)
+        prefix = os.path.join(oldPath, '')
+        n = len(oldPath)
+        args = (newPath, n+1, oldPath, len(prefix), prefix)
+        ## rewrite the leading oldPath in all affected paths
+        self.db.execute("UPDATE fields SET path=?||substr(path, ?) WHERE path=? OR substr(path, 1, ?)=?", args)
+        self.db.execute("UPDATE dirs SET path=?||substr(path, ?) WHERE path=? OR substr(path, 1, ?)=?", args)
+        self.db.execute("UPDATE entries SET dir=?||substr(dir, ?) WHERE dir=? OR substr(dir, 1, ?)=?", args)
+        self.db.execute("UPDATE entries SET path=?||substr(path, ?) WHERE path=? OR substr(path, 1, ?)=?", args)
+        self.db.execute("UPDATE entries SET name=? WHERE path=?", (os.path.basename(newPath), newPath))
+
+    ## Queries
+
+    def find(self, type=None, name=None, under=None, fields=None, ancestors=None):
+        """Return a sorted list of the paths of all catalogued entries matching all criteria:
+
+        ==========  ==============================================================
+        type        The entry type (info 'dirType' or '__object_type__', or
+                    'Protocol'/'ProtocolSequence' for task runner output)
+        name        Glob pattern matched against the file or directory name
+        under       Only entries beneath this directory
+        fields      {key: value} conditions on info fields. Nested keys and
+                    tuple keys are joined with '.'. Values may be given as
+                    (operator, value) using any of OPERATORS.
+        ancestors   {type: fields} -- the entry must have an ancestor directory
+                    of each given type whose info matches the given fields.
+        ==========  ==============================================================
+
+        Example: all IV curves recorded at 34 degrees from cells of type 'pyramidal'::
+
+            catalog.find(type='Protocol', name='cciv*',
+                         ancestors={'Cell': {'type': 'pyramidal'},
+                                    'Day': {'temperature': 34}})
+        """
+        where, args = self._conditions('e', type, name, under, fields)
+        for i, (ancType, ancFields) in enumerate((ancestors or {}).items()):
+            a = 'a%d' % i
+            cond, cargs = self._conditions(a, ancType, None, None, ancFields)
+            cond.append("substr(e.path, 1, length(%s.path)+1) = %s.path||?" % (a, a))
+            cargs.append(os.sep)
+            where.append("EXISTS (SELECT 1 FROM entries %s WHERE %s)" % (a, ' AND '.join(cond)))
+            args.extend(cargs)
+
+        query = "SELECT e.path FROM entries e"
+        if len(where) > 0:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY e.path"
+        self.flush()
+        with self.lock:
+            return [r[0] for r in self.db.execute(query, args)]
+
+    def _conditions(self, table, type, name, under, fields):
+        where = []
+        args = []
+        if type is not None:
+            where.append("%s.type=?" % table)
+            args.append(type)
+        if name is not None:
+            where.append("%s.name GLOB ?" % table)
+            args.append(name)
+        if under is not None:
+            prefix = os.path.join(self._abspath(under), '')
+            where.append("substr(%s.path, 1, ?)=?" % table)
+            args.extend([len(prefix), prefix])
+        for key, val in (fields or {}).items():
+            if isinstance(val, tuple) and len(val) == 2 and val[0] in OPERATORS:
+                op, val = val
+            else:
+                op = '='
+            if isinstance(val, bool):
+                val = int(val)
+            where.append("EXISTS (SELECT 1 FROM fields f WHERE f.path=%s.path AND f.key=? AND f.value %s ?)" % (table, op))
+            args.extend([key, val])
+        return where, args
+
+    def info(self, path):
+        """Return the catalogued info dict for path, or None if it is not catalogued."""
+        self.flush()
+        with self.lock:
+            row = self.db.execute("SELECT info FROM entries WHERE path=?", (self._abspath(path),)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(str(row[0]))
+
+    def parentInfo(self, path, type):
+        """Return (path, info) for the nearest directory of the given type
+        containing path (or path itself), or None if there is none."""
+        path = self._abspath(path)
+        self.flush()
+        with self.lock:
+            row = self.db.execute(
+                "SELECT path, info FROM entries WHERE type=? AND isDir=1 AND "
+                "(path=? OR substr(?, 1, length(path)+1) = path||?) "
+                "ORDER BY length(path) DESC LIMIT 1", (type, path, path, os.sep)).fetchone()
+        if row is None:
+            return None
+        return row[0], pickle.loads(str(row[1]))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[2] != 'rescan':
+        print "Usage: python -m acq4.util.DataCatalog catalog.sqlite rescan /path/to/storage"
+        sys.exit(1)
+    import acq4.util.DataManager as DataManager
+    catalog = DataCatalog(sys.argv[1], DataManager.getDataManager())
+    start = time.time()
+    n = catalog.rescan(sys.argv[3])
+    catalog.close()
+    print "Catalogued %d directories in %0.1f s." % (n, time.time() - start)
@@ -14,11 +14,13 @@ if __name__ == '__main__':
     path = os.path.dirname(os.path.abspath(__file__))
     sys.path.append(os.path.join(path, '..', '..'))
 
-import threading, os, re, sys, shutil
+import threading, os, re, sys, shutil, struct, atexit, bisect, weakref, gc
+import cPickle as pickle
 from acq4.util.functions import strncmp
 from acq4.util.configfile import *
 import time
 from acq4.util.Mutex import Mutex
+from acq4.util import DirWatcher
 from acq4.pyqtgraph import SignalProxy, ProgressDialog
 from PyQt4 import QtCore, QtGui
 if not hasattr(QtCore, 'Signal'):
@@ -29,6 +31,14 @@ from acq4.util.debug import *
 import copy
 import acq4.util.advancedTypes as advancedTypes
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir  ## backport for python 2
+    except ImportError:
+        scandir = None
+
 
 def abspath(fileName):
     """Return an absolute path string which is guaranteed to uniquely identify a file."""
@@ -54,6 +64,107 @@ def getFileHandle(fileName):
     return getDataManager().getFileHandle(fileName)
 
 
+## Binary sidecar cache for .index files. The text .index file is always the
+## authoritative copy; the sidecar holds a pickled copy of the parsed index
+## together with the path, size, and mtime of the .index it was built from.
+## If any of these differ, the cache is ignored and rebuilt after the next parse.
+INDEX_CACHE_NAME = '.index.cache'
+INDEX_CACHE_MAGIC = 'ACQ4IDXC'
+INDEX_CACHE_VERSION = 1
+_indexCacheHeader = struct.Struct('<8sIQd')
+
+
+def _indexCacheFile(indexFile):
+    return os.path.join(os.path.dirname(indexFile), INDEX_CACHE_NAME)
+
+
+def readIndexCache(indexFile, stat=None):
+    """Return the cached index for *indexFile*, or None if there is no cache
+    or the cache does not match the current size and mtime of the index file.
+    """
+    if stat is None:
+        stat = os.stat(indexFile)
+    try:
+        fd = open(_indexCacheFile(indexFile), 'rb')
+    except IOError:
+        return None
+    try:
+        try:
+            header = fd.read(_indexCacheHeader.size)
+            if len(header) != _indexCacheHeader.size:
+                return None
+            magic, version, size, mtime = _indexCacheHeader.unpack(header)
+            if (magic != INDEX_CACHE_MAGIC or version != INDEX_CACHE_VERSION or 
+                size != stat.st_size or mtime != stat.st_mtime):
+                return None
+            if pickle.load(fd) != abspath(indexFile):
+                return None
+            return pickle.load(fd)
+        except Exception:
+            ## A corrupt or unreadable cache is never fatal; fall back to parsing.
+            return None
+    finally:
+        fd.close()
+
+
+def writeIndexCache(indexFile, index, stat=None):
+    """Write a sidecar cache for *indexFile* containing *index*. 
+    Returns True if the cache was written successfully.
+    """
+    if stat is None:
+        stat = os.stat(indexFile)
+    cacheFile = _indexCacheFile(indexFile)
+    tmpFile = cacheFile + '.tmp'
+    try:
+        fd = open(tmpFile, 'wb')
+        try:
+            fd.write(_indexCacheHeader.pack(INDEX_CACHE_MAGIC, INDEX_CACHE_VERSION, stat.st_size, stat.st_mtime))
+            pickle.dump(abspath(indexFile), fd, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(index, fd, pickle.HIGHEST_PROTOCOL)
+        finally:
+            fd.close()
+        if sys.platform == 'win32' and os.path.exists(cacheFile):
+            os.remove(cacheFile)
+        os.rename(tmpFile, cacheFile)
+        return True
+    except Exception:
+        ## read-only storage, unpicklable values, etc. The cache is optional.
+        try:
+            if os.path.exists(tmpFile):
+                os.remove(tmpFile)
+        except OSError:
+            pass
+        return False
+
+
+## Journal of metadata updates to existing .index entries. Each record is a
+## configfile block for a single file; records are merged into the index in 
+## order when it is read, and folded into the .index by compactIndex().
+INDEX_JOURNAL_NAME = '.index.journal'
+
+## Hidden directory holding image pyramids (see acq4.util.ImagePyramid)
+PYRAMID_DIR_NAME = '.pyramids'
+
+
+def parseIndexJournal(text):
+    """Parse journal text into a list of (fileName, info) records, in order."""
+    records = []
+    block = []
+    for line in text.split('\n') + ['']:
+        if line[:1] not in ('', ' ', '#') or line == '':
+            if len(block) > 0:
+                records.extend(parseStringFast('\n'.join(block)).items())
+                block = []
+        if line != '':
+            block.append(line)
+    return records
+
+
+def compactIndexes(idleTime=0):
+    """Fold all pending index journals into their .index files."""
+    getDataManager().compactIndexes(idleTime=idleTime)
+
+
 def cleanup():
     """
     Free memory by deleting cached handles that are not in use elsewhere.
@@ -70,27 +181,166 @@ class DataManager(QtCore.QObject):
     
     INSTANCE = None
     
+    ## Emitted from the watcher thread to deliver change notifications in the GUI thread
+    sigExternalChange = QtCore.Signal(object, object)  # (DirHandle, change)
+    
+    ## If True, DirHandles load and maintain binary sidecar caches of their .index files
+    useIndexCache = True
+    
+    ## If True, metadata changes to existing index entries are appended to a journal
+    ## rather than rewriting the whole .index file (for indexes with at least 
+    ## journalMinEntries entries; smaller ones are cheap to rewrite). Journals are 
+    ## compacted once a directory has been idle for compactDelay seconds, and at exit.
+    journalIndex = True
+    journalMinEntries = 10
+    compactDelay = 5.0
+    
+    ## Handle cache policy: the most recently used handles are held strongly, up to
+    ## maxCachedHandles handles and maxCachedIndexEntries index entries in total. 
+    ## All other handles are held weakly; they stay cached (with their index and 
+    ## listing caches) only as long as something else, such as a GUI widget, 
+    ## references them.
+    maxCachedHandles = 5000
+    maxCachedIndexEntries = 1000000
+    
+    ## Directory watching: None (disabled), 'auto', 'inotify', or 'poll'. While a 
+    ## directory is watched, its listing and index caches are invalidated when 
+    ## another process changes it, so they can be used without re-checking the disk.
+    ## 'auto' polls directories on network filesystems, where inotify does not see
+    ## changes made by other machines.
+    watchMode = None
+    watchInterval = 2.0
+    
     def __init__(self):
         QtCore.QObject.__init__(self)
         if DataManager.INSTANCE is not None:
             raise Exception("Attempted to create more than one DataManager!")
         DataManager.INSTANCE = self
-        self.cache = {}
+        self.cache = weakref.WeakValueDictionary()  # path: handle, for all live handles
+        self.recent = OrderedDict()  # path: handle, strongly held in least- to most-recently used order
+        self.cacheStats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._lookupsSinceBudgetCheck = 0
         self.lock = Mutex(QtCore.QMutex.Recursive)
+        self._journaled = {}   # path: (DirHandle, time of last journal write)
+        self._compactThread = None
+        self.watcher = None
+        self.catalog = None
+        self.sigExternalChange.connect(self._emitExternalChange, QtCore.Qt.QueuedConnection)
+        atexit.register(self.compactIndexes)
+        
+    def configure(self, **kwds):
+        """Set DataManager options. Accepted keyword arguments are useIndexCache, 
+        journalIndex, journalMinEntries, compactDelay, maxCachedHandles, 
+        maxCachedIndexEntries, watchMode, and watchInterval (see class attributes),
+        and catalogFile, which attaches a DataCatalog stored in the given file."""
+        opts = ['useIndexCache', 'journalIndex', 'journalMinEntries', 'compactDelay', 
+                'maxCachedHandles', 'maxCachedIndexEntries', 'watchMode', 'watchInterval',
+                'catalogFile']
+        for k, v in kwds.items():
+            if k not in opts:
+                raise TypeError("Invalid DataManager option '%s'. Options are: %s" % (k, ', '.join(opts)))
+            if k == 'catalogFile':
+                from acq4.util.DataCatalog import DataCatalog
+                self.setCatalog(None if v is None else DataCatalog(v, self))
+            else:
+                setattr(self, k, v)
+        with self.lock:
+            self._enforceCacheBudget(checkEntries=True)
+        if 'watchMode' in kwds or 'watchInterval' in kwds:
+            self.stopWatching()
+            if self.watchMode is not None:
+                self.startWatching(self.watchMode, self.watchInterval)
+                
+    def setCatalog(self, catalog):
+        """Attach a DataCatalog that will be informed of all meta-info changes made
+        through this DataManager (or None to detach the current catalog)."""
+        with self.lock:
+            old = self.catalog
+            self.catalog = catalog
+        ## closing flushes the old catalog, which reads indexes through this
+        ## DataManager; self.lock must not be held here.
+        if old is not None and old is not catalog:
+            old.close()
+            
+    def getCatalog(self):
+        """Return the attached DataCatalog, or None."""
+        return self.catalog
+        
+    def _indexChanged(self, handle, names=None):
+        """Called by DirHandles when entries in their index have changed."""
+        catalog = self.catalog
+        if catalog is not None:
+            catalog.indexChanged(abspath(handle.name()), names)
+            
+    def startWatching(self, mode='auto', interval=2.0):
+        """Start watching cached directories for changes made by other processes.
+        
+        *mode* may be 'inotify' (Linux only), 'poll', or 'auto' (inotify, except
+        for directories on network filesystems). See DirWatcher.
+        """
+        with self.lock:
+            if self.watcher is not None:
+                return
+            self.watchMode = mode
+            self.watchInterval = interval
+            self.watcher = DirWatcher.createWatcher(self._dirChanged, mode=mode, interval=interval)
+            
+    def stopWatching(self):
+        with self.lock:
+            watcher = self.watcher
+            self.watcher = None
+            if watcher is None:
+                return
+            watcher.stop()
+            for h in self.cache.values():
+                if isinstance(h, DirHandle):
+                    h._watched = False
+    
+    def _watchDir(self, handle):
+        """Called by DirHandles when they begin caching data about their contents."""
+        watcher = self.watcher
+        if watcher is None:
+            return False
+        return watcher.watch(abspath(handle.name()))
+        
+    def _unwatchDir(self, path):
+        watcher = self.watcher
+        if watcher is not None:
+            watcher.unwatch(abspath(path))
+        
+    def _dirChanged(self, path, name):
+        """Called from the watcher thread when the contents of a watched directory change."""
+        with self.lock:
+            handle = self.cache.get(path)
+        if handle is None or not isinstance(handle, DirHandle):
+            ## handle was collected; no need to keep watching.
+            self._unwatchDir(path)
+            return
+        ## caches are invalidated immediately; signals are emitted from the GUI thread
+        change = handle._externalChange(name)
+        if change is not None:
+            self.sigExternalChange.emit(handle, change)
+        
+    def _emitExternalChange(self, handle, change):
+        handle.emitChanged(change)
         
     def getDirHandle(self, dirName, create=False):
         with self.lock:
             dirName = os.path.abspath(dirName)
-            if not self._cacheHasName(dirName):
-                self._addHandle(dirName, DirHandle(dirName, self, create=create))
-            return self._getCache(dirName)
+            handle = self._lookupHandle(dirName)
+            if handle is None:
+                handle = DirHandle(dirName, self, create=create)
+                self._addHandle(dirName, handle)
+            return handle
         
     def getFileHandle(self, fileName):
         with self.lock:
             fileName = os.path.abspath(fileName)
-            if not self._cacheHasName(fileName):
-                self._addHandle(fileName, FileHandle(fileName, self))
-            return self._getCache(fileName)
+            handle = self._lookupHandle(fileName)
+            if handle is None:
+                handle = FileHandle(fileName, self)
+                self._addHandle(fileName, handle)
+            return handle
         
     def getHandle(self, fileName):
         """Return a FileHandle or DirHandle for the given fileName. 
@@ -104,16 +354,90 @@ class DataManager(QtCore.QObject):
         
     def cleanup(self):
         """Attempt to free memory by allowing python to collect any unused handles."""
-        import gc
         with self.lock:
-            tmp = weakref.WeakValueDictionary(self.cache)
-            self.cache = None
+            self.cacheStats['evictions'] += len(self.recent)
+            self.recent.clear()
             gc.collect()
-            self.cache = dict(tmp)
+            
+    def getCacheStats(self):
+        """Return a dict describing the state of the handle cache: hit/miss/eviction
+        counts, the number of live and strongly held handles, and the number of 
+        index entries cached by strongly held handles."""
+        with self.lock:
+            stats = self.cacheStats.copy()
+            stats['handles'] = len(self.cache)
+            stats['strongHandles'] = len(self.recent)
+            stats['indexEntries'] = self._cachedIndexEntries()
+            return stats
+
+    def compactIndexes(self, idleTime=0):
+        """Fold pending index journals into their .index files. 
+        
+        Only directories whose journal has not been written for at least 
+        *idleTime* seconds are compacted.
+        """
+        now = time.time()
+        with self.lock:
+            pending = [(k, h, t) for k, (h, t) in self._journaled.items() if now - t >= idleTime]
+        for key, handle, t in pending:
+            try:
+                handle.compactIndex()
+            except:
+                printExc("Error while compacting index for %s:" % key)
+            with self.lock:
+                ## leave the entry in place if the journal was written again during compaction
+                if self._journaled.get(key, (None, None))[1] == t:
+                    del self._journaled[key]
+
+    def _journalWritten(self, handle):
+        """Called by DirHandles after appending to their index journal."""
+        with self.lock:
+            self._journaled[abspath(handle.name())] = (handle, time.time())
+            if self._compactThread is None:
+                self._compactThread = IndexCompactThread(self)
+                self._compactThread.start()
 
+    def _lookupHandle(self, name):
+        """Return the cached handle for name (marking it as recently used), or None."""
+        name = abspath(name)
+        handle = self.cache.get(name)
+        if handle is None:
+            self.cacheStats['misses'] += 1
+            return None
+        self.cacheStats['hits'] += 1
+        self.recent.pop(name, None)
+        self.recent[name] = handle
+        ## handles evicted earlier but still referenced elsewhere re-enter the list here
+        self._enforceCacheBudget()
+        return handle
+        
+    def _cachedIndexEntries(self):
+        return sum([len(h._index) for h in self.recent.values() if getattr(h, '_index', None) is not None])
+        
+    def _enforceCacheBudget(self, checkEntries=False):
+        """Drop strong references to the least recently used handles until the cache is within budget."""
+        while len(self.recent) > self.maxCachedHandles:
+            self.recent.popitem(last=False)
+            self.cacheStats['evictions'] += 1
+        
+        ## counting index entries visits every handle, so only do it occasionally
+        self._lookupsSinceBudgetCheck += 1
+        if not checkEntries and self._lookupsSinceBudgetCheck < 100:
+            return
+        self._lookupsSinceBudgetCheck = 0
+        sizes = [(k, len(h._index)) for k, h in self.recent.items() if getattr(h, '_index', None) is not None]
+        total = sum([n for k, n in sizes])
+        for k, n in sizes:
+            if total <= self.maxCachedIndexEntries:
+                break
+            del self.recent[k]
+            self.cacheStats['evictions'] += 1
+            total -= n
+        
     def _addHandle(self, fileName, handle):
         """Cache a handle and watch it for changes"""
         self._setCache(fileName, handle)
+        self._enforceCacheBudget()
         ## make sure all file handles belong to the main GUI thread
         app = QtGui.QApplication.instance()
         if app is not None:
@@ -123,20 +447,32 @@ class DataManager(QtCore.QObject):
         
     def _handleChanged(self, handle, change, *args):
         with self.lock:
+            if self.catalog is not None:
+                if change in ('renamed', 'moved'):
+                    self.catalog.pathMoved(args[0], args[1])
+                elif change == 'deleted':
+                    self.catalog.pathDeleted(args[0])
+                    
             if change == 'renamed' or change == 'moved':
                 oldName = args[0]
                 newName = args[1]
                 ## Inform all children that they have been moved and update cache
                 tree = self._getTree(oldName)
                 for h in tree:
+                    handle = self.cache.get(abspath(h))
+                    self._unwatchDir(h)
+                    if handle is None:
+                        continue
+                    if isinstance(handle, DirHandle):
+                        handle._watched = False
                     ## Update key to cached handle
                     newh = os.path.abspath(os.path.join(newName, h[len(oldName+os.path.sep):]))
-                    self._setCache(newh, self._getCache(h))
+                    self._delCache(h)
+                    self._setCache(newh, handle)
                     
                     ## If the change originated from h's parent, inform it that this change has occurred.
                     if h != oldName:
-                        self._getCache(h)._parentMoved(oldName, newName)
-                    self._delCache(h)
+                        handle._parentMoved(oldName, newName)
                 
             elif change == 'deleted':
                 oldName = args[0]
@@ -144,7 +480,11 @@ class DataManager(QtCore.QObject):
                 ## Inform all children that they have been deleted and remove from cache
                 tree = self._getTree(oldName)
                 for path in tree:
-                    self._getCache(path)._deleted()
+                    handle = self.cache.get(abspath(path))
+                    self._unwatchDir(path)
+                    if handle is None:
+                        continue
+                    handle._deleted()
                     self._delCache(path)
 
     def _getTree(self, parent):
@@ -152,10 +492,9 @@ class DataManager(QtCore.QObject):
         
         ## If handle has no children, then there is no need to search for its tree.
         tree = [parent]
-        ph = self._getCache(parent)
         prefix = os.path.normcase(os.path.join(parent, ''))
         
-        for h in self.cache:
+        for h in self.cache.keys():
             if h[:len(prefix)] == prefix:
                 tree.append(h)
         return tree
@@ -164,16 +503,38 @@ class DataManager(QtCore.QObject):
         return self.cache[abspath(name)]
         
     def _setCache(self, name, value):
-        self.cache[abspath(name)] = value
+        name = abspath(name)
+        self.cache[name] = value
+        self.recent.pop(name, None)
+        self.recent[name] = value
         
     def _delCache(self, name):
-        del self.cache[abspath(name)]
+        name = abspath(name)
+        self.cache.pop(name, None)
+        self.recent.pop(name, None)
         
     def _cacheHasName(self, name):
         return abspath(name) in self.cache
         
 
 
+class IndexCompactThread(threading.Thread):
+    """Background thread that compacts index journals for idle directories."""
+    def __init__(self, manager):
+        threading.Thread.__init__(self)
+        self.daemon = True  ## pending journals are also compacted at exit
+        self.manager = manager
+        self.interval = 1.0
+        
+    def run(self):
+        while True:
+            try:
+                time.sleep(self.interval)
+                self.manager.compactIndexes(idleTime=self.manager.compactDelay)
+            except:
+                printExc("Error in index compaction thread:")
+
+
 class FileHandle(QtCore.QObject):
     
     sigChanged = QtCore.Signal(object, object, object)  # (self, change, (args))
@@ -275,8 +636,8 @@ class FileHandle(QtCore.QObject):
                 
             self.emitChanged('moved', fn1, fn2)
                 
-            oldDir._childChanged()
-            newDir._childChanged()
+            oldDir._childChanged(name)
+            newDir._childChanged(name)
         
     def rename(self, newName):
         """Rename this file.
@@ -303,7 +664,7 @@ class FileHandle(QtCore.QObject):
                 parent.indexFile(newName, info=info)
                 
             self.emitChanged('renamed', fn1, fn2)
-            self.parent()._childChanged()
+            self.parent()._childChanged(oldName, newName)
         
     def delete(self):
         self.checkExists()
@@ -320,9 +681,15 @@ class FileHandle(QtCore.QObject):
             self.manager._handleChanged(self, 'deleted', fn1)
             self.path = None
             self.emitChanged('deleted', fn1)
-            parent._childChanged()
+            parent._childChanged(oldName)
         
     def read(self, *args, **kargs):
+        """Read and return the data in this file.
+        
+        Extra arguments are passed to the read() method of the file's type. For
+        MetaArray files, read(lazy=True) returns an array that reads only the 
+        selected parts of an HDF5 file from disk when it is indexed.
+        """
         self.checkExists()
         with self.lock:
             typ = self.fileType()
@@ -416,9 +783,15 @@ class DirHandle(FileHandle):
     def __init__(self, path, manager, create=False):
         FileHandle.__init__(self, path, manager)
         self._index = None
+        self._journalMTime = None
+        self._journalOffset = 0
+        self._journalStale = False
         self.lsCache = {}  # sortMode: [files...]
+        self.lsDirty = {}  # sortMode: set(names) of entries that changed since lsCache[sortMode] was built
         self.cTimeCache = {}
+        self.isDirCache = {}  # name: bool, from the most recent directory scan
         self._indexFileExists = False
+        self._watched = False  # True while the manager's watcher reports changes to this directory
         
         if not os.path.isdir(self.path):
             if create:
@@ -432,6 +805,9 @@ class DirHandle(FileHandle):
         """Return the name of the index file for this directory. NOT the same as indexFile()"""
         return os.path.join(self.path, '.index')
     
+    def _journalFile(self):
+        return os.path.join(self.path, INDEX_JOURNAL_NAME)
+    
     def _logFile(self):
         return os.path.join(self.path, '.log')
     
@@ -493,7 +869,7 @@ class DirHandle(FileHandle):
         """Return a list of string names for all sub-directories."""
         with self.lock:
             ls = self.ls()
-            subdirs = filter(lambda d: os.path.isdir(os.path.join(self.name(), d)), ls)
+            subdirs = filter(lambda d: self._isDirEntry(d), ls)
             return subdirs
     
     def incrementFileName(self, fileName, useExt=True):
@@ -529,7 +905,7 @@ class DirHandle(FileHandle):
             ## Create directory
             ndm = self.manager.getDirHandle(newDir, create=True)
             t = time.time()
-            self._childChanged()
+            self._childChanged(fullName)
             
             if self.isManaged():
                 ## Mark the creation time in the parent directory so it can sort its full list of files without 
@@ -565,13 +941,19 @@ class DirHandle(FileHandle):
     def dirExists(self, dirName):
         return os.path.isdir(os.path.join(self.path, dirName))
             
-    def ls(self, normcase=False, sortMode='date', useCache=False):
+    def ls(self, normcase=False, sortMode='date', useCache=None):
         """Return a list of all files in the directory.
         If normcase is True, normalize the case of all names in the list.
-        sortMode may be 'date', 'alpha', or None."""
+        sortMode may be 'date', 'alpha', or None.
+        If useCache is None, cached listings are used only while the directory
+        is being watched for changes (see DataManager.startWatching)."""
         with self.lock:
+            if useCache is None:
+                useCache = self._watched
             if (not useCache) or (sortMode not in self.lsCache):
                 self._updateLsCache(sortMode)
+            elif len(self.lsDirty.get(sortMode, ())) > 0:
+                self._updateLsCacheEntries(sortMode)
             files = self.lsCache[sortMode]
             
             if normcase:
@@ -581,48 +963,117 @@ class DirHandle(FileHandle):
                 ret = files[:]
                 return ret
     
+    def _scanDir(self):
+        """Return a dict {name: isDir} for all entries in the directory, 
+        using a single pass over the directory where possible."""
+        path = self.name()
+        entries = {}
+        if scandir is not None:
+            for entry in scandir(path):
+                try:
+                    entries[entry.name] = entry.is_dir()
+                except OSError:
+                    entries[entry.name] = False
+        else:
+            for f in os.listdir(path):
+                entries[f] = os.path.isdir(os.path.join(path, f))
+        for i in ['.index', '.index.tmp', '.log', INDEX_CACHE_NAME, INDEX_CACHE_NAME + '.tmp', INDEX_JOURNAL_NAME,
+                  PYRAMID_DIR_NAME]:
+            entries.pop(i, None)
+        return entries
+    
+    def _isDirEntry(self, fileName):
+        if fileName not in self.isDirCache:
+            self.isDirCache[fileName] = os.path.isdir(os.path.join(self.name(), fileName))
+        return self.isDirCache[fileName]
+    
+    def _lsSortKey(self, sortMode):
+        """Return a function giving the sort key of a file for the given sort mode."""
+        if sortMode == 'date':
+            return lambda f: (self.cTimeCache[f], f)  ## sort by time first, then name.
+        elif sortMode == 'alpha':
+            return lambda f: (not self._isDirEntry(f), f)  ## show directories first when sorting alphabetically.
+        elif sortMode == None:
+            return None
+        else:
+            raise Exception('Unrecognized sort mode "%s"' % str(sortMode))
+    
     def _updateLsCache(self, sortMode):
+        self._startWatching()
         try:
-            files = os.listdir(self.name())
+            self.isDirCache = self._scanDir()
         except:
             printExc("Error while listing files in %s:" % self.name())
-            files = []
-        for i in ['.index', '.log']:
-            if i in files:
-                files.remove(i)
+            self.isDirCache = {}
+        files = list(self.isDirCache.keys())
         
         if sortMode == 'date':
-            ## Sort files by creation time
-            with ProgressDialog("Reading directory data...", maximum=len(files), cancelText=None) as dlg:
-                for f in files:
-                    if f not in self.cTimeCache:
-                        self.cTimeCache[f] = self._getFileCTime(f)
-                    dlg += 1
-            files.sort(key=lambda f: (self.cTimeCache[f], f))  ## sort by time first, then name.
-        elif sortMode == 'alpha':
-            ## show directories first when sorting alphabetically.
-            files.sort(lambda a,b: 2*cmp(os.path.isdir(os.path.join(self.name(),b)), os.path.isdir(os.path.join(self.name(),a))) + cmp(a,b))
-        elif sortMode == None:
-            pass
+            self._resolveCTimes(files)
+        key = self._lsSortKey(sortMode)
+        if key is not None:
+            files.sort(key=key)
+        self.lsCache[sortMode] = files
+        self.lsDirty.pop(sortMode, None)
+    
+    def _updateLsCacheEntries(self, sortMode):
+        """Update the cached file list for sortMode with only the entries that changed."""
+        files = self.lsCache[sortMode]
+        changed = self.lsDirty.pop(sortMode)
+        files = [f for f in files if f not in changed]
+        added = [f for f in changed if os.path.lexists(os.path.join(self.name(), f))]
+        if sortMode == 'date':
+            self._resolveCTimes(added)
+        key = self._lsSortKey(sortMode)
+        if key is None:
+            files.extend(sorted(added))
         else:
-            raise Exception('Unrecognized sort mode "%s"' % str(sortMode))
-            
+            keys = map(key, files)
+            for f in added:
+                k = key(f)
+                i = bisect.bisect(keys, k)
+                keys.insert(i, k)
+                files.insert(i, f)
         self.lsCache[sortMode] = files
     
-    def _getFileCTime(self, fileName):
+    def _resolveCTimes(self, files):
+        """Fill cTimeCache for all files, reading the index at most once."""
+        missing = [f for f in files if f not in self.cTimeCache]
+        if len(missing) == 0:
+            return
+        index = None
         if self.isManaged():
             index = self._readIndex()
+        slow = []
+        for f in missing:
+            ## Most entries carry a timestamp in this directory's index
+            try:
+                self.cTimeCache[f] = index[f]['__timestamp__']
+            except (KeyError, TypeError):
+                slow.append(f)
+        if len(slow) == 0:
+            return
+        ## Remaining entries may need to read their own index
+        with ProgressDialog("Reading directory data...", maximum=len(slow), cancelText=None) as dlg:
+            for f in slow:
+                self.cTimeCache[f] = self._getFileCTime(f, index=index)
+                dlg += 1
+    
+    def _getFileCTime(self, fileName, index=None):
+        if self.isManaged():
+            if index is None:
+                index = self._readIndex()
             try:
                 t = index[fileName]['__timestamp__']
                 return t
             except KeyError:
                 pass
             
-            ## try getting time directly from file
-            try:
-                t = self[fileName].info()['__timestamp__']
-            except:
-                pass
+            ## try getting time from the subdirectory's own index
+            if self._isDirEntry(fileName):
+                try:
+                    return self[fileName].info()['__timestamp__']
+                except:
+                    pass
                     
         ## if the file has an obvious date in it, use that
         m = re.search(r'(20\d\d\.\d\d?\.\d\d?)', fileName)
@@ -682,7 +1133,7 @@ class DirHandle(FileHandle):
             ## Write file
             open(os.path.join(self.name(), fileName), 'w')
             
-            self._childChanged()
+            self._childChanged(fileName)
             
             ## Write meta-info
             if not info.has_key('__timestamp__'):
@@ -717,7 +1168,7 @@ class DirHandle(FileHandle):
             ## Write file
             fileName = fileClass.write(obj, self, fileName, **kwargs)
             
-            self._childChanged()
+            self._childChanged(fileName)
             ## Write meta-info
             if not info.has_key('__object_type__'):
                 info['__object_type__'] = fileType
@@ -760,6 +1211,7 @@ class DirHandle(FileHandle):
                     print type(index)
                     raise
                 self._writeIndex(index, lock=False)
+                self.manager._indexChanged(self, [fileName])
                 self.emitChanged('meta', fileName)
         
     def isManaged(self, fileName=None):
@@ -807,37 +1259,124 @@ class DirHandle(FileHandle):
                 
             for k in info:
                 index[fileName][k] = info[k]
+            if '__timestamp__' in info and fileName != '.':
+                self._invalidateEntries([fileName])
                 
             if append:
                 self._appendIndex({fileName: info})
-                
+            elif self.manager.journalIndex and len(index) >= self.manager.journalMinEntries:
+                self._appendJournal({fileName: info})
             else:
                 self._writeIndex(index, lock=False)
+            self.manager._indexChanged(self, [fileName])
             self.emitChanged('meta', fileName)
         
     def _readIndex(self, lock=True, unmanagedOk=False):
         with self.lock:
             indexFile = self._indexFile()
-            if self._index is None or os.path.getmtime(indexFile) != self._indexMTime:
+            ## While watched, external changes reset self._index so there is no need to stat.
+            if self._index is None or (not self._watched and os.path.getmtime(indexFile) != self._indexMTime):
                 if not os.path.isfile(indexFile):
                     if unmanagedOk:
                         return None
                     else:
                         raise Exception("Directory '%s' is not managed!" % (self.name()))
+                self._startWatching()
                 try:
-                    self._index = readConfigFile(indexFile)
-                    self._indexMTime = os.path.getmtime(indexFile)
+                    stat = os.stat(indexFile)
+                    index = None
+                    useCache = self.manager.useIndexCache
+                    if useCache:
+                        index = readIndexCache(indexFile, stat)
+                    if index is None:
+                        index = readConfigFile(indexFile, engine='fast')
+                        if useCache:
+                            writeIndexCache(indexFile, index, stat)
+                    self._index = index
+                    self._indexMTime = stat.st_mtime
+                    self._journalMTime = None
+                    self._journalOffset = 0
                 except:
                     print "***************Error while reading index file %s!*******************" % indexFile
                     raise
+            if not self._watched or self._journalStale:
+                self._readJournal()
             return self._index
+    
+    def _readJournal(self):
+        """Merge any journal records that have not yet been applied to the cached index."""
+        journalFile = self._journalFile()
+        try:
+            stat = os.stat(journalFile)
+        except OSError:
+            self._journalMTime = None
+            self._journalOffset = 0
+            self._journalStale = False
+            return
+        self._journalStale = False
+        if stat.st_mtime == self._journalMTime and stat.st_size == self._journalOffset:
+            return
+        if stat.st_size < self._journalOffset:
+            ## journal was replaced; records are idempotent so just re-apply all of them
+            self._journalOffset = 0
+        try:
+            fd = open(journalFile, 'rb')
+            try:
+                fd.seek(self._journalOffset)
+                data = fd.read()
+            finally:
+                fd.close()
+            ## ignore any partially-written record at the end of the file
+            end = data.rfind('\n') + 1
+            records = parseIndexJournal(asUnicode(data[:end]).replace('\r', ''))
+        except:
+            print "***************Error while reading index journal %s!*******************" % journalFile
+            raise
+        for fileName, info in records:
+            if fileName not in self._index:
+                self._index[fileName] = {}
+            for k in info:
+                self._index[fileName][k] = info[k]
+        self._journalOffset += end
+        self._journalMTime = stat.st_mtime
+    
+    def _appendJournal(self, info):
+        with self.lock:
+            journalFile = self._journalFile()
+            fd = open(journalFile, 'ab')
+            fd.write(genString(info))
+            fd.close()
+            stat = os.stat(journalFile)
+            self._journalMTime = stat.st_mtime
+            self._journalOffset = stat.st_size
+        self.manager._journalWritten(self)
+    
+    def compactIndex(self):
+        """Fold any journaled metadata updates into the .index file and remove the journal."""
+        with self.lock:
+            if self.path is None or not os.path.isfile(self._journalFile()):
+                return
+            self._writeIndex(self._readIndex())
         
     def _writeIndex(self, newIndex, lock=True):
         with self.lock:
-            writeConfigFile(newIndex, self._indexFile())
+            ## write to a temporary file first so a crash can never leave a truncated index
+            indexFile = self._indexFile()
+            tmpFile = indexFile + '.tmp'
+            writeConfigFile(newIndex, tmpFile)
+            if sys.platform == 'win32' and os.path.exists(indexFile):
+                os.remove(indexFile)  ## rename does not replace existing files on windows
+            os.rename(tmpFile, indexFile)
             self._index = newIndex
             self._indexMTime = os.path.getmtime(self._indexFile())
             self._indexFileExists = True
+            ## The rewritten index includes all journaled changes. (If we crash before 
+            ## the journal is removed, re-applying it is harmless.)
+            journalFile = self._journalFile()
+            if os.path.exists(journalFile):
+                os.remove(journalFile)
+            self._journalMTime = None
+            self._journalOffset = 0
 
     def _appendIndex(self, info):
         with self.lock:
@@ -860,10 +1399,71 @@ class DirHandle(FileHandle):
                 changed = True
         if changed:
             self._writeIndex(ind)
+            self.manager._indexChanged(self)
         
-    def _childChanged(self):
-        self.lsCache = {}
+    def _childChanged(self, *names):
+        """Inform this directory that its contents have changed. If file names are
+        given, only the cached listing data for those entries is invalidated."""
+        if len(names) == 0:
+            self.lsCache = {}
+            self.lsDirty = {}
+            self.isDirCache = {}
+        else:
+            self._invalidateEntries(names)
         self.emitChanged('children')
+        
+    def _startWatching(self):
+        if not self._watched and self.path is not None:
+            self._watched = self.manager._watchDir(self)
+    
+    def _externalChange(self, name):
+        """Called by the DataManager (from its watcher thread) when a change is seen
+        in this directory. *name* is the changed entry, or None if the entire
+        directory must be re-checked. Invalidates the affected caches and returns
+        the change to be signalled ('children' or 'meta'), or None."""
+        with self.lock:
+            if self.path is None:
+                return None
+            if name is None:
+                self._index = None
+                self.lsCache = {}
+                self.lsDirty = {}
+                self.isDirCache = {}
+                return 'children'
+            if name == '.index':
+                try:
+                    mtime = os.path.getmtime(self._indexFile())
+                except OSError:
+                    mtime = None
+                if self._index is not None and mtime != self._indexMTime:
+                    self._index = None
+                    return 'meta'
+                return None
+            if name == INDEX_JOURNAL_NAME:
+                ## re-read the journal on next access (a no-op if we wrote it ourselves)
+                self._journalStale = True
+                if self._index is not None:
+                    offset = self._journalOffset
+                    self._readJournal()
+                    if self._journalOffset != offset:
+                        return 'meta'
+                return None
+            if name.startswith('.'):
+                return None
+            ## ignore changes that our own cached listings already account for
+            pending = [m for m in self.lsCache if name not in self.lsDirty.get(m, ())]
+            if len(pending) == 0 and name not in self.isDirCache and name not in self.cTimeCache:
+                return None
+            self._invalidateEntries([name])
+            return 'children'
+    
+    def _invalidateEntries(self, names):
+        with self.lock:
+            for name in names:
+                self.cTimeCache.pop(name, None)
+                self.isDirCache.pop(name, None)
+                for sortMode in self.lsCache:
+                    self.lsDirty.setdefault(sortMode, set()).add(name)
 
 
 dm = DataManager()
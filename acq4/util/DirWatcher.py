@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+DirWatcher.py -  Notification of changes to the contents of directories
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Watchers report entries that were created, deleted, renamed, or (for index files)
+rewritten in a set of watched directories by invoking callback(dirPath, name)
+from a background thread. If the watcher loses track of changes (for example,
+the inotify event queue overflowed), it invokes callback(dirPath, None) for
+every watched directory.
+
+InotifyWatcher uses the Linux inotify API; PollingWatcher periodically lists
+the watched directories and works everywhere. inotify only sees changes made
+by the local machine, so it misses files written to network shares (NFS, SMB)
+by other computers. Use createWatcher() to get the best watcher available on
+this system; in 'auto' mode, directories on network filesystems are polled.
+"""
+
+import os, sys, time, struct, select, errno, threading
+import ctypes, ctypes.util
+from acq4.util.debug import printExc
+
+## Files whose contents (not just existence) are reported by watchers
+WATCHED_FILES = ('.index', '.index.journal')
+
+## Filesystem types (as listed in /proc/mounts) that may be changed by other machines
+NETWORK_FS_TYPES = ('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'ncpfs', 'afs', 'coda',
+                    '9p', 'ceph', 'glusterfs', 'lustre', 'gpfs', 'fuse.sshfs',
+                    'fuse.glusterfs', 'fuse.cephfs', 'davfs', 'fuse.davfs')
+
+
+def createWatcher(callback, mode='auto', interval=2.0):
+    """Return a started watcher.
+
+    *mode* may be 'inotify', 'poll', or 'auto' (inotify for local directories if
+    available, otherwise poll). *interval* is the polling interval in seconds.
+    """
+    if mode == 'auto':
+        watcher = AutoWatcher(callback, interval=interval)
+    elif mode == 'inotify':
+        watcher = InotifyWatcher(callback)
+    elif mode == 'poll':
+        watcher = PollingWatcher(callback, interval=interval)
+    else:
+        raise ValueError("Watch mode must be 'auto', 'inotify', or 'poll' (got %r)" % mode)
+    watcher.start()
+    return watcher
+
+
+def isNetworkPath(path):
+    """Return True if *path* is on a filesystem that other machines may change
+    (see NETWORK_FS_TYPES). Only detected on Linux; returns False elsewhere."""
+    try:
+        lines = open('/proc/mounts').read().splitlines()
+    except IOError:
+        return False
+    path = os.path.realpath(path)
+    best = ''
+    fsType = None
+    for line in lines:
+        fields = line.split()
+        if len(fields) < 3:
+            continue
+        ## spaces etc. in mount points are escaped as octal (eg. '\\040')
+        mountPoint = fields[1].decode('string_escape')
+        prefix = os.path.join(mountPoint, '')
+        if (path == mountPoint or path.startswith(prefix)) and len(mountPoint) >= len(best):
+            best = mountPoint
+            fsType = fields[2]
+    return fsType in NETWORK_FS_TYPES
+
+
+class DirWatcher(threading.Thread):
+    """Base class for directory watchers."""
+    def __init__(self, callback):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.callback = callback
+        self.lock = threading.RLock()
+        self.stopped = False
+
+    def watch(self, path):
+        """Begin watching *path*. Return True if the directory is being watched."""
+        raise NotImplementedError()
+
+    def unwatch(self, path):
+        """Stop watching *path*."""
+        raise NotImplementedError()
+
+    def watchedPaths(self):
+        raise NotImplementedError()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+
+    def _report(self, changes):
+        """Invoke the callback for a list of (path, name) changes."""
+        for path, name in changes:
+            try:
+                self.callback(path, name)
+            except:
+                printExc("Error handling change to %s in %s:" % (name, path))
+
+
+class InotifyWatcher(DirWatcher):
+    """Watcher using the Linux inotify API (via ctypes)."""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+                  IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+
+    _event = struct.Struct('iIII')  # wd, mask, cookie, len
+
+    def __init__(self, callback):
+        if not sys.platform.startswith('linux'):
+            raise OSError("inotify is only available on Linux.")
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._addWatch = libc.inotify_add_watch
+        self._addWatch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rmWatch = libc.inotify_rm_watch
+        self._rmWatch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1 failed: %s" % os.strerror(err))
+        self.wds = {}    # path: wd
+        self.paths = {}  # wd: path
+        DirWatcher.__init__(self, callback)
+
+    def watch(self, path):
+        with self.lock:
+            if path in self.wds:
+                return True
+            fsPath = path.encode(sys.getfilesystemencoding()) if isinstance(path, unicode) else path
+            wd = self._addWatch(self.fd, fsPath, self.WATCH_MASK)
+            if wd < 0:
+                ## most likely ENOSPC (out of watches) or the directory is gone
+                return False
+            self.wds[path] = wd
+            self.paths[wd] = path
+            return True
+
+    def unwatch(self, path):
+        with self.lock:
+            wd = self.wds.pop(path, None)
+            if wd is None:
+                return
+            self.paths.pop(wd, None)
+            self._rmWatch(self.fd, wd)
+
+    def watchedPaths(self):
+        with self.lock:
+            return list(self.wds.keys())
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    if self.stopped:
+                        break
+                ready = select.select([self.fd], [], [], 1.0)[0]
+                if len(ready) == 0:
+                    continue
+                try:
+                    data = os.read(self.fd, 65536)
+                except OSError as exc:
+                    if exc.errno in (errno.EAGAIN, errno.EINTR):
+                        continue
+                    raise
+                self._report(self._parseEvents(data))
+        except:
+            printExc("Error in inotify watcher thread:")
+        finally:
+            os.close(self.fd)
+
+    def _parseEvents(self, data):
+        """Convert raw inotify event data into a list of (path, name) changes."""
+        changes = []
+        offset = 0
+        with self.lock:
+            while offset < len(data):
+                wd, mask, cookie, length = self._event.unpack_from(data, offset)
+                offset += self._event.size
+                name = data[offset:offset+length].rstrip('\0')
+                offset += length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    ## events were lost; everything must be re-checked
+                    changes.extend([(p, None) for p in self.wds])
+                    continue
+                path = self.paths.get(wd)
+                if path is None:
+                    continue
+                if mask & self.IN_IGNORED:
+                    ## watch was removed by the kernel (directory deleted or unmounted)
+                    del self.paths[wd]
+                    self.wds.pop(path, None)
+                    continue
+                if mask & (self.IN_DELETE_SELF | self.IN_MOVE_SELF):
+                    changes.append((path, None))
+                    continue
+                if mask & self.IN_CLOSE_WRITE and name not in WATCHED_FILES:
+                    ## only index contents matter; data file writes are not listing changes
+                    continue
+                if isinstance(path, unicode):
+                    name = name.decode(sys.getfilesystemencoding())
+                changes.append((path, name))
+        return changes
+
+
+class AutoWatcher(DirWatcher):
+    """Watcher using inotify for local directories and polling for directories
+    on network filesystems (or for all directories if inotify is unavailable)."""
+    def __init__(self, callback, interval=2.0):
+        DirWatcher.__init__(self, callback)
+        try:
+            self.inotify = InotifyWatcher(callback)
+        except Exception:
+            self.inotify = None
+        self.poller = PollingWatcher(callback, interval=interval)
+        self.watchers = {}  # path: watcher used for path
+
+    def start(self):
+        if self.inotify is not None:
+            self.inotify.start()
+        self.poller.start()
+
+    def watch(self, path):
+        with self.lock:
+            if path in self.watchers:
+                return True
+            if self.inotify is None or isNetworkPath(path):
+                watcher = self.poller
+            else:
+                watcher = self.inotify
+            if not watcher.watch(path):
+                return False
+            self.watchers[path] = watcher
+            return True
+
+    def unwatch(self, path):
+        with self.lock:
+            watcher = self.watchers.pop(path, None)
+        if watcher is not None:
+            watcher.unwatch(path)
+
+    def watchedPaths(self):
+        with self.lock:
+            return list(self.watchers.keys())
+
+    def stop(self):
+        DirWatcher.stop(self)
+        if self.inotify is not None:
+            self.inotify.stop()
+        self.poller.stop()
+
+
+class PollingWatcher(DirWatcher):
+    """Watcher that periodically re-lists watched directories. Changes are
+    reported up to *interval* seconds after they occur."""
+    def __init__(self, callback, interval=2.0):
+        self.interval = interval
+        self.snapshots = {}  # path: (set(names), {watched file: (mtime, size)})
+        DirWatcher.__init__(self, callback)
+
+    def _snapshot(self, path):
+        names = set(os.listdir(path))
+        stats = {}
+        for f in WATCHED_FILES:
+            if f in names:
+                try:
+                    st = os.stat(os.path.join(path, f))
+                    stats[f] = (st.st_mtime, st.st_size)
+                except OSError:
+                    pass
+        return names, stats
+
+    def watch(self, path):
+        with self.lock:
+            if path in self.snapshots:
+                return True
+            try:
+                self.snapshots[path] = self._snapshot(path)
+            except OSError:
+                return False
+            return True
+
+    def unwatch(self, path):
+        with self.lock:
+            self.snapshots.pop(path, None)
+
+    def watchedPaths(self):
+        with self.lock:
+            return list(self.snapshots.keys())
+
+    def run(self):
+        while True:
+            try:
+                with self.lock:
+                    if self.stopped:
+                        break
+                    paths = list(self.snapshots.keys())
+                changes = []
+                for path in paths:
+                    changes.extend(self._poll(path))
+                self._report(changes)
+                time.sleep(self.interval)
+            except:
+                printExc("Error in polling watcher thread:")
+                time.sleep(self.interval)
+
+    def _poll(self, path):
+        with self.lock:
+            old = self.snapshots.get(path)
+        if old is None:
+            return []
+        try:
+            new = self._snapshot(path)
+        except OSError:
+            ## directory is gone
+            self.unwatch(path)
+            return [(path, None)]
+        with self.lock:
+            if path not in self.snapshots:
+                return []
+            self.snapshots[path] = new
+        oldNames, oldStats = old
+        newNames, newStats = new
+        changed = oldNames.symmetric_difference(newNames)
+        for f in WATCHED_FILES:
+            if oldStats.get(f) != newStats.get(f):
+                changed.add(f)
+        return [(path, name) for name in changed]
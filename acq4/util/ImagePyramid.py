@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+ImagePyramid.py -  Tiled, multi-resolution copies of large images
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Large images (camera frames, mosaic tiles) are slow to display at full
+resolution and use a lot of memory when many of them are shown at once. An
+ImagePyramid stores the image at full resolution (level 0) and at successive
+factors of 2 smaller, each level chunked in square tiles, so that a viewer
+can read only the tiles it needs at the resolution that matches its scale:
+
+    pyr = ImagePyramid.open(fileName)          # None if missing or out of date
+    if pyr is None:
+        pyr = ImagePyramid.build(data, fileName)
+    level = pyr.chooseLevel(imagePixelsPerScreenPixel)
+    region = pyr.tileRegion(level, x0, y0, x1, y1)
+    tiles = pyr.read(level, region)
+
+Pyramids are stored as HDF5 files in a hidden '.pyramids' directory next to
+the image they were generated from, and are regenerated when the image file
+changes. Images are indexed (x, y[, color]) like all acq4 image data.
+"""
+
+import os, sys
+import numpy as np
+try:
+    import h5py
+    HAVE_HDF5 = True
+except ImportError:
+    HAVE_HDF5 = False
+
+PYRAMID_DIR = '.pyramids'
+
+
+def pyramidFileName(fileName):
+    """Return the name of the pyramid file for the image stored in fileName."""
+    dirName, name = os.path.split(os.path.abspath(fileName))
+    return os.path.join(dirName, PYRAMID_DIR, name + '.h5')
+
+
+def downsample(img):
+    """Return img reduced by a factor of 2 along its first two axes (the mean of
+    each 2x2 block). Odd-sized axes are padded by repeating the last pixel."""
+    pad = [(0, img.shape[0] % 2), (0, img.shape[1] % 2)] + [(0, 0)] * (img.ndim - 2)
+    if pad[0][1] or pad[1][1]:
+        img = np.pad(img, pad, mode='edge')
+    acc = img[0::2, 0::2].astype(np.float64)
+    acc += img[1::2, 0::2]
+    acc += img[0::2, 1::2]
+    acc += img[1::2, 1::2]
+    acc *= 0.25
+    if img.dtype.kind in 'ui':
+        acc = np.round(acc)
+    return acc.astype(img.dtype)
+
+
+def buildPyramid(data, fileName):
+    """Generate the pyramid for the image *data*, just written to fileName, if the 
+    image is large enough to need one. Used by image file types written with pyramid=True."""
+    if HAVE_HDF5 and ImagePyramid.isLarge(data):
+        ImagePyramid.build(data, fileName).close()
+
+
+class ImagePyramid(object):
+    """Read-only access to a pyramid file. Use open() or build() to get an instance."""
+
+    version = '1'
+
+    ## Levels are chunked in tiles of tileSize x tileSize pixels; the smallest
+    ## level is the first that fits within a single tile.
+    tileSize = 256
+
+    ## Images smaller than this along both axes are displayed directly
+    minImageSize = 1024
+
+    ## Compression used for new pyramid files (see h5py create_dataset)
+    compression = None
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.file = h5py.File(fileName, 'r')
+        version = self.file.attrs['ImagePyramid']
+        if version != self.version:
+            self.file.close()
+            raise Exception("Pyramid file %s has unsupported version %s" % (fileName, version))
+        self.tileSize = int(self.file.attrs['tileSize'])
+        self.levels = [self.file['level%d' % i] for i in range(int(self.file.attrs['nLevels']))]
+        self.shape = self.levels[0].shape
+        self.dtype = self.levels[0].dtype
+
+    @classmethod
+    def isLarge(cls, data):
+        """Return True if *data* is an image large enough to be worth displaying from a pyramid."""
+        if data.ndim == 3 and data.shape[2] > 4:  ## image stack rather than color image
+            return False
+        return data.ndim in (2, 3) and max(data.shape[:2]) > cls.minImageSize
+
+    @classmethod
+    def open(cls, sourceFile):
+        """Return the pyramid for the image in sourceFile, or None if there is no
+        pyramid or the image has changed since it was generated."""
+        if not HAVE_HDF5:
+            return None
+        fileName = pyramidFileName(sourceFile)
+        if not os.path.isfile(fileName):
+            return None
+        try:
+            stat = os.stat(sourceFile)
+            pyr = cls(fileName)
+        except Exception:
+            return None
+        if pyr.file.attrs['sourceMTime'] != stat.st_mtime or pyr.file.attrs['sourceSize'] != stat.st_size:
+            pyr.close()
+            return None
+        return pyr
+
+    @classmethod
+    def build(cls, data, sourceFile, tileSize=None):
+        """Generate the pyramid for the image *data*, which was read from (or
+        written to) sourceFile, and return it opened for reading."""
+        if not HAVE_HDF5:
+            raise Exception("Image pyramids require h5py.")
+        if tileSize is None:
+            tileSize = cls.tileSize
+        data = np.asarray(data)
+        stat = os.stat(sourceFile)
+        fileName = pyramidFileName(sourceFile)
+        dirName = os.path.dirname(fileName)
+        if not os.path.isdir(dirName):
+            os.mkdir(dirName)
+
+        ## write to a temporary file so readers never see a partial pyramid
+        tmpFile = fileName + '.tmp'
+        f = h5py.File(tmpFile, 'w')
+        try:
+            level = data
+            n = 0
+            while True:
+                chunks = (min(tileSize, level.shape[0]), min(tileSize, level.shape[1])) + level.shape[2:]
+                f.create_dataset('level%d' % n, data=level, chunks=chunks, compression=cls.compression)
+                n += 1
+                if max(level.shape[:2]) <= tileSize:
+                    break
+                level = downsample(level)
+            f.attrs['ImagePyramid'] = cls.version
+            f.attrs['tileSize'] = tileSize
+            f.attrs['nLevels'] = n
+            f.attrs['sourceMTime'] = stat.st_mtime
+            f.attrs['sourceSize'] = stat.st_size
+        finally:
+            f.close()
+        if sys.platform == 'win32' and os.path.exists(fileName):
+            os.remove(fileName)  ## rename does not replace existing files on windows
+        os.rename(tmpFile, fileName)
+        return cls(fileName)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.levels = []
+
+    def chooseLevel(self, pixelSize):
+        """Return the smallest level whose resolution is at least that of the
+        display, where *pixelSize* is the number of full-resolution image pixels
+        covered by one screen pixel."""
+        if pixelSize <= 1:
+            return 0
+        return min(int(np.floor(np.log2(pixelSize))), len(self.levels) - 1)
+
+    def tileRegion(self, level, x0, y0, x1, y1):
+        """Return the region (x0, y0, x1, y1) in the coordinates of *level* covering
+        the whole tiles that contain the full-resolution region from (x0, y0) to
+        (x1, y1). Returns None if the region does not overlap the image."""
+        scale = 2 ** level
+        ts = self.tileSize
+        shape = self.levels[level].shape
+        lx0 = max(0, int(np.floor(x0 / float(scale * ts))) * ts)
+        ly0 = max(0, int(np.floor(y0 / float(scale * ts))) * ts)
+        lx1 = min(shape[0], int(np.ceil(x1 / float(scale * ts))) * ts)
+        ly1 = min(shape[1], int(np.ceil(y1 / float(scale * ts))) * ts)
+        if lx1 <= lx0 or ly1 <= ly0:
+            return None
+        return (lx0, ly0, lx1, ly1)
+
+    def read(self, level, region=None):
+        """Read the region (x0, y0, x1, y1) of *level*, or the entire level if
+        region is None. Only the tiles overlapping the region are read from disk."""
+        if region is None:
+            return self.levels[level][...]
+        x0, y0, x1, y1 = region
+        return self.levels[level][x0:x1, y0:y1]
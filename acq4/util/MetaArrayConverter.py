@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""
+MetaArrayConverter.py -  Bulk conversion of legacy .ma files to HDF5 MetaArray
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+Files written in the original MetaArray format (before HDF5 was available)
+must be parsed entirely with eval and read in full, which is slow for large
+data sets. convertTree() walks a storage tree and rewrites every such file
+as chunked HDF5 (keeping the same file name) using a pool of processes:
+
+  - Each file is written to a temporary file (.name.ma.converting), re-read
+    and compared with the source: shape, dtype, axis and extra info, and a
+    SHA-1 checksum of the data.
+  - The source is then renamed to .name.ma.legacy and the converted file is
+    moved into its place.
+  - The .index entry for the file (if it is indexed) is updated with a
+    '__converted__' record, and the .legacy file is removed (or renamed to
+    name.ma.legacy if backups were requested).
+
+Interrupted conversions are resumed from whatever state the files were left
+in, so it is always safe to run the converter again on the same tree.
+
+From the command line:
+    python -m acq4.util.MetaArrayConverter /path/to/storage [--processes N]
+                                           [--compression gzip|lzf] [--keep-backup] [--dry-run]
+"""
+
+import os, sys, time, hashlib, multiprocessing
+import numpy as np
+from acq4.util.metaarray import MetaArray
+
+HDF5_MAGIC = '\x89HDF\r\n\x1a\n'
+
+
+def isLegacyFile(fileName):
+    """Return True if fileName is a MetaArray file in the original (non-HDF5) format."""
+    with open(fileName, 'rb') as fd:
+        return fd.read(8) != HDF5_MAGIC
+
+
+def tempFileName(fileName):
+    dirName, name = os.path.split(fileName)
+    return os.path.join(dirName, '.%s.converting' % name)
+
+
+def legacyFileName(fileName):
+    dirName, name = os.path.split(fileName)
+    return os.path.join(dirName, '.%s.legacy' % name)
+
+
+def backupFileName(fileName):
+    return fileName + '.legacy'
+
+
+def findFiles(baseDir):
+    """Return a sorted list of all .ma files under baseDir that have not been
+    converted yet, including those whose conversion was interrupted."""
+    files = set()
+    for path, dirs, names in os.walk(baseDir):
+        dirs[:] = sorted([d for d in dirs if not d.startswith('.')])
+        for name in names:
+            fileName = os.path.join(path, name)
+            if name.startswith('.') and name.endswith('.ma.legacy'):
+                ## interrupted conversion
+                files.add(os.path.join(path, name[1:-len('.legacy')]))
+            elif name.endswith('.ma') and not name.startswith('.'):
+                if fileName not in files and isLegacyFile(fileName):
+                    files.add(fileName)
+    return sorted(files)
+
+
+def dataChecksum(data, blockBytes=16e6):
+    """Return the SHA-1 digest of the array (or HDF5 dataset) *data*,
+    reading it in blocks along the first axis."""
+    sha = hashlib.sha1()
+    if len(data.shape) == 0:
+        sha.update(np.ascontiguousarray(data[()]).data)
+        return sha.hexdigest()
+    rowBytes = data.dtype.itemsize * int(np.prod(data.shape[1:]))
+    step = max(1, int(blockBytes // max(1, rowBytes)))
+    for i in range(0, data.shape[0], step):
+        sha.update(np.ascontiguousarray(data[i:i+step]).data)
+    return sha.hexdigest()
+
+
+def infoEqual(a, b):
+    """Compare two MetaArray info structures, allowing for the changes in type
+    that occur when info is stored in HDF5 (dict keys become strings, etc)."""
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        a = np.asarray(a)
+        b = np.asarray(b)
+        if a.shape != b.shape or a.dtype != b.dtype:
+            return False
+        if a.dtype.kind in 'fc':
+            return bool(np.all((a == b) | (np.isnan(a) & np.isnan(b))))
+        return bool(np.all(a == b))
+    elif isinstance(a, dict):
+        if not isinstance(b, dict):
+            return False
+        a2 = dict([(str(k), v) for k, v in a.items()])
+        b2 = dict([(str(k), v) for k, v in b.items()])
+        if set(a2.keys()) != set(b2.keys()):
+            return False
+        return all([infoEqual(a2[k], b2[k]) for k in a2])
+    elif isinstance(a, (list, tuple)):
+        if not isinstance(b, (list, tuple)) or len(a) != len(b):
+            return False
+        return all([infoEqual(x, y) for x, y in zip(a, b)])
+    elif isinstance(a, float) and isinstance(b, float) and np.isnan(a) and np.isnan(b):
+        return True
+    else:
+        return a == b
+
+
+def verifyFile(fileName, source, checksum=None):
+    """Check that the MetaArray stored in fileName matches the MetaArray *source*.
+    Raises an exception describing the first difference found."""
+    import h5py
+    if checksum is None:
+        checksum = dataChecksum(source.asarray())
+    conv = MetaArray(file=fileName, lazy=True)
+    try:
+        if conv.shape != source.shape:
+            raise Exception("shape %s != %s" % (conv.shape, source.shape))
+        if conv.dtype != source.dtype:
+            raise Exception("dtype %s != %s" % (conv.dtype, source.dtype))
+        for i in range(len(source._info)):
+            if not infoEqual(conv._info[i], source._info[i]):
+                what = 'extra info' if i == source.ndim else 'axis %d info' % i
+                raise Exception("%s differs" % what)
+    finally:
+        conv.close()
+    f = h5py.File(fileName, 'r')
+    try:
+        if dataChecksum(f['data']) != checksum:
+            raise Exception("data checksum differs")
+    finally:
+        f.close()
+
+
+def convertFile(fileName, compression=None):
+    """Convert a single legacy .ma file to HDF5 and move it into place, leaving
+    the source in legacyFileName(fileName). Returns a dict describing the result;
+    'status' is 'converted', 'skipped', or 'failed'.
+
+    The caller is responsible for updating the index and removing the legacy file
+    (see finishFile). Called in worker processes by convertTree()."""
+    result = {'fileName': fileName, 'status': 'failed', 'bytes': 0, 'time': 0.0, 'version': None, 'error': None}
+    start = time.time()
+    tmpFile = tempFileName(fileName)
+    legacy = legacyFileName(fileName)
+    try:
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+
+        ## recover from an interrupted conversion
+        if os.path.exists(legacy):
+            if not os.path.exists(fileName):
+                ## interrupted before the converted file was moved into place
+                os.rename(legacy, fileName)
+            elif isLegacyFile(fileName):
+                raise Exception("Both %s and %s exist; not sure which to keep." % (fileName, legacy))
+            else:
+                ## converted file is in place; check it again before the index is updated
+                source = MetaArray(file=legacy, readAllData=True)
+                try:
+                    verifyFile(fileName, source)
+                except Exception:
+                    os.remove(fileName)
+                    os.rename(legacy, fileName)
+                else:
+                    result['bytes'] = os.stat(legacy).st_size
+                    result['version'] = readVersion(legacy)
+                    result['status'] = 'converted'
+                    return result
+
+        if not isLegacyFile(fileName):
+            result['status'] = 'skipped'
+            return result
+
+        result['bytes'] = os.stat(fileName).st_size
+        result['version'] = readVersion(fileName)
+        source = MetaArray(file=fileName, readAllData=True)
+        checksum = dataChecksum(source.asarray())
+        source.write(tmpFile, profile=guessProfile(source, compression))
+        verifyFile(tmpFile, source, checksum)
+
+        os.rename(fileName, legacy)
+        os.rename(tmpFile, fileName)
+        result['status'] = 'converted'
+    except Exception as exc:
+        result['error'] = '%s: %s' % (type(exc).__name__, str(exc))
+        if os.path.exists(tmpFile):
+            os.remove(tmpFile)
+    finally:
+        result['time'] = time.time() - start
+    return result
+
+
+def _convertJob(args):
+    return convertFile(*args)
+
+
+def readVersion(fileName):
+    with open(fileName, 'rb') as fd:
+        return str(MetaArray._readMeta(fd).get('version', 1))
+
+
+def guessProfile(arr, compression=None):
+    """Return the write profile (see MetaArray.writeProfiles) that best fits
+    the layout of arr: 'trace' for arrays with a column axis, 'video' for
+    image stacks, or None to use the default chunking."""
+    name = None
+    if any(['cols' in arr._info[i] for i in range(arr.ndim)]):
+        name = 'trace'
+    elif arr.ndim >= 3:
+        name = 'video'
+    if name is None:
+        if compression is None:
+            return None
+        return {'access': 'blocks', 'chunkBytes': 1e6, 'compression': compression}
+    profile = dict(MetaArray.writeProfiles[name])
+    if compression is not None:
+        profile['compression'] = compression
+    return profile
+
+
+def finishFile(result, keepBackup=False):
+    """Record a completed conversion in the .index of the file's directory and
+    remove (or keep a visible backup of) the legacy file. Runs in the main process."""
+    fileName = result['fileName']
+    dirName, name = os.path.split(fileName)
+    if os.path.isfile(os.path.join(dirName, '.index')):
+        import acq4.util.DataManager as DataManager
+        dh = DataManager.getDirHandle(dirName)
+        if dh.isManaged(name):
+            dh[name].setInfo({'__converted__': {'from': 'MetaArray %s' % result['version'], 'time': time.time()}})
+    legacy = legacyFileName(fileName)
+    if keepBackup:
+        os.rename(legacy, backupFileName(fileName))
+    else:
+        os.remove(legacy)
+
+
+def convertTree(baseDir, processes=None, compression=None, keepBackup=False, dryRun=False, reportInterval=10.0, log=None):
+    """Convert all legacy .ma files under baseDir to HDF5 using a pool of
+    *processes* worker processes (default is one per CPU; 0 converts in this
+    process). Progress and throughput are printed every *reportInterval* seconds.
+
+    Returns a dict of statistics: 'files', 'converted', 'failed', 'bytes', 'time',
+    'errors' (list of (fileName, message))."""
+    if log is None:
+        def log(msg):
+            print msg
+    files = findFiles(baseDir)
+    stats = {'files': len(files), 'converted': 0, 'skipped': 0, 'failed': 0, 'bytes': 0, 'time': 0.0, 'errors': []}
+    if dryRun:
+        for f in files:
+            log(f)
+        log("%d files to convert." % len(files))
+        return stats
+    if len(files) == 0:
+        return stats
+
+    start = time.time()
+    lastReport = start
+    jobs = [(f, compression) for f in files]
+    pool = None
+    if processes == 0:
+        results = (_convertJob(j) for j in jobs)
+    else:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap_unordered(_convertJob, jobs)
+    try:
+        for i, result in enumerate(results):
+            if result['status'] == 'converted':
+                try:
+                    finishFile(result, keepBackup)
+                    stats['converted'] += 1
+                    stats['bytes'] += result['bytes']
+                except Exception as exc:
+                    result['status'] = 'failed'
+                    result['error'] = 'updating index: %s' % str(exc)
+            elif result['status'] == 'skipped':
+                stats['skipped'] += 1
+            if result['status'] == 'failed':
+                stats['failed'] += 1
+                stats['errors'].append((result['fileName'], result['error']))
+                log("Failed to convert %s: %s" % (result['fileName'], result['error']))
+
+            now = time.time()
+            if now - lastReport > reportInterval:
+                lastReport = now
+                log("%d/%d files, %0.1f MB converted (%0.1f MB/s)" % (
+                    i+1, len(files), stats['bytes'] / 1e6, stats['bytes'] / 1e6 / (now - start)))
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    stats['time'] = time.time() - start
+    return stats
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert legacy .ma files to HDF5 MetaArray files.")
+    parser.add_argument('baseDir', help="storage directory to convert (searched recursively)")
+    parser.add_argument('--processes', type=int, default=None, help="number of worker processes (default is one per CPU)")
+    parser.add_argument('--compression', default=None, help="HDF5 compression filter to use, eg. gzip or lzf")
+    parser.add_argument('--keep-backup', action='store_true', help="keep each original file as name.ma.legacy")
+    parser.add_argument('--dry-run', action='store_true', help="only list the files that would be converted")
+    args = parser.parse_args()
+
+    stats = convertTree(args.baseDir, processes=args.processes, compression=args.compression,
+                        keepBackup=args.keep_backup, dryRun=args.dry_run)
+    if not args.dry_run:
+        t = max(stats['time'], 1e-6)
+        print "Converted %d files (%0.1f MB) in %0.1f s: %0.1f MB/s, %0.1f files/s. %d failed." % (
+            stats['converted'], stats['bytes'] / 1e6, stats['time'], stats['bytes'] / 1e6 / t,
+            stats['converted'] / t, stats['failed'])
+        for fileName, err in stats['errors']:
+            print "  %s: %s" % (fileName, err)
+    sys.exit(1 if stats['failed'] > 0 else 0)
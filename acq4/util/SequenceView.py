@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+SequenceView.py -  Read-only MetaArray spanning all iterations of a task sequence
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+A TaskRunner sequence directory contains one subdirectory per iteration, named
+by its parameter indexes ('000_003', ...), each holding the same set of files.
+SequenceView presents one of those files from every iteration as a single
+MetaArray with one leading axis per sequence parameter:
+
+    view = SequenceView(seqDir, 'Clamp1.ma')
+    view.shape                                  # (nAmps, nChannels, nSamples)
+    trace = view[('Clamp1', 'amp'): 3, 'Channel': 'primary', 'Time': 0.1:0.2]
+
+The layout is built from the sequence's index and the header of a single file;
+indexing reads only the selected region of each file involved. Iterations with
+no data (eg. an aborted sequence) read as *fill*.
+"""
+
+import os, itertools
+import numpy as np
+from acq4.util.metaarray import MetaArray, HAVE_HDF5
+if HAVE_HDF5:
+    import h5py
+
+
+class SequenceView(MetaArray):
+    """MetaArray of the file *fileName* from every iteration of the sequence in *dirHandle*.
+    See module docstring."""
+
+    def __init__(self, dirHandle, fileName, fill=None):
+        try:
+            params = dirHandle.info()['sequenceParams']
+        except KeyError:
+            raise Exception("Directory '%s' does not appear to be a protocol sequence." % dirHandle.name())
+        seqShape = tuple([len(v) for v in params.values()])
+        seqInfo = [{'name': k, 'values': np.array(v)} for k, v in params.items()]
+
+        ## find iteration directories containing the file
+        files = {}
+        for name in dirHandle.subDirs():
+            try:
+                inds = tuple([int(x) for x in name.split('_')])
+            except ValueError:
+                continue
+            if len(inds) != len(seqShape) or any([i >= n for i, n in zip(inds, seqShape)]):
+                continue
+            subDir = dirHandle[name]
+            if subDir.exists(fileName):
+                files[inds] = subDir[fileName]
+        if len(files) == 0:
+            raise Exception("No files named '%s' in sequence '%s'." % (fileName, dirHandle.name()))
+
+        ## get layout of each iteration's data from the first file
+        first = MetaArray(file=files[min(files)].name(), lazy=True)
+        itemInfo = first._info
+        itemShape = first.shape
+        dtype = first.dtype
+        first.close()
+
+        if fill is None:
+            fill = np.nan if dtype.kind in 'fc' else 0
+        self.dirHandle = dirHandle
+        self.fileName = fileName
+        self.files = files
+        self.fill = fill
+        data = SequenceDataset(files, seqShape, itemShape, dtype, fill)
+        MetaArray.__init__(self, data, info=seqInfo + itemInfo, lazy=True)
+
+    def writeVirtual(self, fileName):
+        """Write a MetaArray file whose data is an HDF5 virtual dataset referring to
+        the data in each iteration's file, so the entire sequence can be opened as a
+        single file. Source files are referenced by paths relative to *fileName*,
+        so the sequence directory and the new file should be moved together.
+
+        Requires h5py >= 2.9 (with HDF5 >= 1.10), and all iteration files must be
+        stored as HDF5.
+        """
+        if not HAVE_HDF5 or not hasattr(h5py, 'VirtualLayout'):
+            raise Exception("Writing virtual datasets requires h5py >= 2.9.")
+        data = self._data
+        layout = h5py.VirtualLayout(shape=data.shape, dtype=data.dtype)
+        baseDir = os.path.dirname(os.path.abspath(fileName))
+        for inds, fh in self.files.items():
+            path = os.path.relpath(fh.name(), baseDir)
+            layout[inds] = h5py.VirtualSource(path, 'data', shape=data.itemShape)
+        f = h5py.File(fileName, 'w', libver='latest')
+        try:
+            f.attrs['MetaArray'] = MetaArray.version
+            f.create_virtual_dataset('data', layout, fillvalue=self.fill)
+            self.writeHDF5Meta(f, 'info', self._info)
+        finally:
+            f.close()
+
+
+class SequenceDataset(object):
+    """Dataset-like object used by SequenceView. Supports indexing with integers
+    and increasing slices (as used by MetaArray for lazily-read data)."""
+
+    def __init__(self, files, seqShape, itemShape, dtype, fill):
+        self.files = files
+        self.seqShape = seqShape
+        self.itemShape = itemShape
+        self.shape = seqShape + itemShape
+        self.dtype = dtype
+        self.fill = fill
+
+    def __getitem__(self, ind):
+        if not isinstance(ind, tuple):
+            ind = (ind,)
+        if ind == (Ellipsis,):
+            ind = ()
+        ind = ind + (slice(None),) * (len(self.shape) - len(ind))
+        nSeq = len(self.seqShape)
+
+        ## sequence indexes to visit, and where each goes in the output
+        seqRanges = []
+        for i, n in zip(ind[:nSeq], self.seqShape):
+            if isinstance(i, slice):
+                seqRanges.append(range(*i.indices(n)))
+            else:
+                seqRanges.append([i])
+        outSeqShape = [len(r) for r, i in zip(seqRanges, ind[:nSeq]) if isinstance(i, slice)]
+
+        itemInd = ind[nSeq:]
+        itemShape = [len(range(*i.indices(n))) for i, n in zip(itemInd, self.itemShape) if isinstance(i, slice)]
+        out = np.empty(tuple([len(r) for r in seqRanges] + itemShape), dtype=self.dtype)
+
+        for pos in itertools.product(*[range(len(r)) for r in seqRanges]):
+            inds = tuple([r[p] for r, p in zip(seqRanges, pos)])
+            fh = self.files.get(inds, None)
+            if fh is None:
+                out[pos] = self.fill
+                continue
+            arr = MetaArray(file=fh.name(), lazy=True)
+            try:
+                if arr.shape != self.itemShape:
+                    raise Exception("File %s has shape %s; expected %s." % (fh.name(), arr.shape, self.itemShape))
+                out[pos] = arr._readHDF5Subset(itemInd)
+            finally:
+                arr.close()
+
+        out = out.reshape(tuple(outSeqShape + itemShape))
+        if out.ndim == 0:
+            return out[()]
+        return out
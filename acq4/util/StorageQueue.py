@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+StorageQueue.py -  Write-behind queue for storing data through DirHandles
+Distributed under MIT/X11 license. See license.txt for more infomation.
+
+A StorageQueue takes the data-writing calls made while storing task results
+(writeFile, mkdir, setInfo) and executes them on a pool of writer threads, so
+that the caller can move on to the next task while the data is written to disk:
+
+    queue = StorageQueue(threads=2, maxMemory=500e6)
+    dh = queue.handle(storageDirHandle)   ## looks like a DirHandle
+    dh.setInfo(...)                        ## returns immediately
+    dh.mkdir('Camera').writeFile(frames, 'frames')
+    queue.flush()                          ## wait until everything is on disk
+
+Data objects are queued by reference, so they must not be modified after they
+are handed to the queue. Operations on the same storage directory are always
+executed in the order they were requested; different directories are written
+in parallel. When the data waiting in the queue exceeds maxMemory bytes, new
+requests block until the writers catch up.
+"""
+
+import sys, time, threading, collections
+from acq4.util.debug import printExc
+
+
+def dataSize(obj):
+    """Return an estimate of the number of bytes of array data referenced by obj."""
+    if isinstance(obj, (list, tuple)):
+        return sum([dataSize(x) for x in obj])
+    if isinstance(obj, dict):
+        return sum([dataSize(x) for x in obj.values()])
+    data = getattr(obj, '_data', obj)  # MetaArray
+    try:
+        return int(getattr(data, 'nbytes', 0))
+    except Exception:
+        return 0
+
+
+class StorageQueue(object):
+    """Queue of storage operations executed by a pool of writer threads. See module docstring."""
+
+    def __init__(self, threads=2, maxMemory=500e6):
+        self.enabled = True
+        self.threads = threads
+        self.maxMemory = maxMemory
+        self.lock = threading.Condition(threading.RLock())
+        self.queues = collections.OrderedDict()  # key: deque of pending operations
+        self.busy = set()       # keys currently being written by a worker
+        self.workers = []
+        self.queuedBytes = 0
+        self.depth = 0          # number of operations queued or in progress
+        self.errors = []        # (description, exc_info) for failed operations not yet reported
+        self.resetStats()
+
+    def configure(self, enabled=None, threads=None, maxMemory=None):
+        """Set queue options. *threads* only affects writers started after the call."""
+        with self.lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if threads is not None:
+                self.threads = max(1, int(threads))
+            if maxMemory is not None:
+                self.maxMemory = maxMemory
+
+    def handle(self, dirHandle):
+        """Return a handle that queues data-writing operations on dirHandle."""
+        return QueuedHandle(self, dirHandle.name(), dirHandle)
+
+    def put(self, key, func, args=(), kwds=None, nbytes=0):
+        """Queue func(*args, **kwds) to be executed after all operations previously
+        queued with the same key. Blocks while the queue is over its memory budget.
+        Errors from failed operations are not raised here (the new operation must
+        still be queued); they are raised by flush()."""
+        with self.lock:
+            start = time.time()
+            while self.queuedBytes > 0 and self.queuedBytes + nbytes > self.maxMemory:
+                self.lock.wait(0.1)
+            waited = time.time() - start
+            if waited > 0:
+                self.stats['blockedTime'] += waited
+            op = (func, args, kwds or {}, nbytes, time.time())
+            self.queues.setdefault(key, collections.deque()).append(op)
+            self.queuedBytes += nbytes
+            self.depth += 1
+            self.stats['maxDepth'] = max(self.stats['maxDepth'], self.depth)
+            self.stats['maxBytes'] = max(self.stats['maxBytes'], self.queuedBytes)
+            if len(self.workers) < min(self.threads, len(self.queues)):
+                worker = threading.Thread(target=self._run)
+                worker.daemon = True
+                self.workers.append(worker)
+                worker.start()
+            self.lock.notify_all()
+
+    def flush(self, key=None, timeout=None):
+        """Wait until all queued operations (or only those for *key*) have completed.
+        Raises the first error encountered by any of the completed operations."""
+        start = time.time()
+        with self.lock:
+            while True:
+                if key is None:
+                    done = self.depth == 0
+                else:
+                    done = key not in self.queues and key not in self.busy
+                if done:
+                    break
+                if timeout is not None and time.time() - start > timeout:
+                    raise Exception("Timed out waiting for storage queue to flush.")
+                self.lock.wait(0.1)
+        self.checkErrors()
+
+    def checkErrors(self):
+        """Raise the first error from a failed operation (and forget all other errors)."""
+        with self.lock:
+            if len(self.errors) == 0:
+                return
+            desc, exc = self.errors[0]
+            self.errors = []
+        raise Exception("Error in background storage (%s): %s" % (desc, exc[1]))
+
+    def resetStats(self):
+        with self.lock:
+            self.stats = {'written': 0, 'failed': 0, 'maxDepth': 0, 'maxBytes': 0, 'blockedTime': 0.0,
+                          'totalLatency': 0.0, 'maxLatency': 0.0, 'totalWriteTime': 0.0}
+
+    def getStats(self):
+        """Return a dict describing the current queue depth and the write latency
+        (time from queueing to completion) of all operations since resetStats()."""
+        with self.lock:
+            stats = self.stats.copy()
+            stats['depth'] = self.depth
+            stats['queuedBytes'] = self.queuedBytes
+            n = max(1, stats['written'] + stats['failed'])
+            stats['meanLatency'] = stats['totalLatency'] / n
+            stats['meanWriteTime'] = stats['totalWriteTime'] / n
+            return stats
+
+    def _next(self):
+        """Return (key, op) for the next operation whose key is not being written, or None."""
+        for key, ops in self.queues.items():
+            if key in self.busy:
+                continue
+            op = ops.popleft()
+            if len(ops) == 0:
+                del self.queues[key]
+            self.busy.add(key)
+            return key, op
+        return None
+
+    def _run(self):
+        while True:
+            with self.lock:
+                job = self._next()
+                while job is None:
+                    self.lock.wait()
+                    job = self._next()
+            key, (func, args, kwds, nbytes, queueTime) = job
+            start = time.time()
+            try:
+                func(*args, **kwds)
+                failed = False
+            except:
+                printExc("Error in background storage of %s:" % key)
+                failed = True
+                exc = sys.exc_info()
+            now = time.time()
+            with self.lock:
+                self.busy.discard(key)
+                self.queuedBytes -= nbytes
+                self.depth -= 1
+                if failed:
+                    self.stats['failed'] += 1
+                    self.errors.append((key, exc))
+                else:
+                    self.stats['written'] += 1
+                latency = now - queueTime
+                self.stats['totalLatency'] += latency
+                self.stats['maxLatency'] = max(self.stats['maxLatency'], latency)
+                self.stats['totalWriteTime'] += now - start
+                self.lock.notify_all()
+
+
+class QueuedHandle(object):
+    """Stand-in for a DirHandle or FileHandle whose data-writing methods are executed
+    by a StorageQueue. mkdir() and writeFile() return QueuedHandles for the new
+    directory / file. Any other method waits for the queue to drain and is then
+    called on the real handle."""
+
+    def __init__(self, queue, key, handle=None):
+        self._queue = queue
+        self._key = key
+        self._handle = handle
+
+    def _call(self, method, args, kwds, returnsHandle):
+        if returnsHandle:
+            result = QueuedHandle(self._queue, self._key)
+        else:
+            result = None
+        def run():
+            ret = getattr(self._handle, method)(*args, **kwds)
+            if result is not None:
+                result._handle = ret
+        self._queue.put(self._key, run, nbytes=dataSize(args) + dataSize(kwds))
+        return result
+
+    def writeFile(self, *args, **kwds):
+        return self._call('writeFile', args, kwds, True)
+
+    def mkdir(self, *args, **kwds):
+        return self._call('mkdir', args, kwds, True)
+
+    def indexFile(self, *args, **kwds):
+        return self._call('indexFile', args, kwds, True)
+
+    def setInfo(self, *args, **kwds):
+        self._call('setInfo', args, kwds, False)
+
+    def handle(self):
+        """Wait for all queued operations to complete, then return the real handle."""
+        self._queue.flush(self._key)
+        return self._handle
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.handle(), attr)
@@ -7,3 +7,9 @@ from .contrast_ctrl import ContrastCtrl
 from .bg_subtract_ctrl import BgSubtractCtrl
 from .imaging_ctrl import ImagingCtrl
 from .frame import Frame
+from .video_reader import VideoReader
+from .frame_pool import FramePool
+from .telemetry import PipelineTelemetry
+from .background import BackgroundModel
+from .frame_queue import FrameQueue
+from .frame_reducer import FrameReducer
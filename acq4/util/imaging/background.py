@@ -0,0 +1,206 @@
+"""
+Background models for live background subtraction / division.
+
+A BackgroundModel accumulates frames into an estimate of the static part of
+the image. It is used by BgSubtractCtrl for live imaging and may be used to
+compute a rolling F0 for recorded image stacks:
+
+    model = BackgroundModel('median', window=5.0)
+    for t, frame in zip(times, frames):
+        model.addFrame(frame, now=t)
+    bg = model.blurredBackground()
+
+Methods:
+
+* 'mean' keeps a float32 running average that is updated in place; each new
+  frame is weighted by *weight* (or 1/n to average all frames equally).
+* 'median' and 'percentile' keep a ring of frames sampled evenly over the
+  last *window* seconds and compute the median (or percentile) of the ring
+  at most once per *updateInterval* seconds.
+
+The median and blurred background are cached and only recomputed (at most
+once per updateInterval) after the background has changed, so that frames
+can be added at full camera rate. These may be requested from a different
+thread than the one adding frames (FrameDisplay computes them in its worker
+thread); the model state is guarded by a lock, but a background read while a
+frame is being added may mix the two.
+
+The median of a large ring takes longer than a frame interval (over a second
+for 16 frames of 2048x2048), so with *threaded* set, it is computed in a
+separate thread and background() returns the most recent finished result
+(None until the first one is ready). Updates are then spaced by at least the
+time the previous one took. Without *threaded*, updates depend only on the
+frame times given, so offline results (eg. a rolling F0) are reproducible.
+"""
+from __future__ import division
+
+import threading
+import numpy as np
+import scipy.ndimage
+import acq4.util.ptime as ptime
+
+
+class BackgroundModel(object):
+    """Rolling estimate of the image background. See module docstring."""
+
+    methods = ['mean', 'median', 'percentile']
+
+    def __init__(self, method='mean', window=1.0, ringSize=16, percentile=50., blur=0., updateInterval=0.5,
+                 threaded=False):
+        if method not in self.methods:
+            raise ValueError("Unknown background method '%s'; options are %s" % (method, self.methods))
+        self.method = method
+        self.window = window
+        self.ringSize = ringSize
+        self.percentile = percentile
+        self.blur = blur
+        self.updateInterval = updateInterval
+        self.threaded = threaded
+        self.lock = threading.RLock()
+        self._generation = 0    # incremented by reset(); results computed before then are discarded
+        self._computeThread = None
+        self.reset()
+
+    def reset(self):
+        """Discard all frames collected so far."""
+        with self.lock:
+            self._generation += 1
+            self.frameCount = 0
+            self.shape = None
+            self._mean = None
+            self._scratch = None
+            self._ring = None
+            self._ringCount = 0
+            self._ringIndex = 0
+            self._lastRingTime = None
+            self._background = None
+            self._nextUpdate = None
+            self._blurred = None
+            self._blurTime = None
+            self._changed = False
+            self._blurChanged = False
+
+    def setBlur(self, sigma):
+        with self.lock:
+            if sigma != self.blur:
+                self.blur = sigma
+                self._blurTime = None
+
+    def addFrame(self, img, weight=None, now=None):
+        """Add a new frame to the model.
+
+        For the 'mean' method, *weight* is the fraction of the new background
+        contributed by this frame; None averages all frames since reset()
+        equally. Frames whose shape differs from the previous ones restart the
+        model. *now* is the frame time (defaults to the current time).
+        """
+        if now is None:
+            now = ptime.time()
+        with self.lock:
+            self._addFrame(img, weight, now)
+
+    def _addFrame(self, img, weight, now):
+        shape = img.shape
+        if self.frameCount > 0 and shape != self.shape:
+            self.reset()
+        self.shape = shape
+        self.frameCount += 1
+
+        if self.method == 'mean':
+            if self._mean is None:
+                self._mean = np.empty(shape, dtype=np.float32)
+                self._scratch = np.empty(shape, dtype=np.float32)
+                self._mean[...] = img
+            else:
+                if weight is None:
+                    weight = 1.0 / self.frameCount
+                ## mean += (img - mean) * w, without allocating new arrays. The mean is
+                ## only modified by the final addition, so readers in other threads
+                ## never see a partially updated background.
+                np.subtract(img, self._mean, out=self._scratch, casting='unsafe')
+                self._scratch *= weight
+                self._mean += self._scratch
+        else:
+            ## keep frames sampled evenly over the window
+            if self._lastRingTime is not None and now - self._lastRingTime < self.window / self.ringSize:
+                return
+            self._lastRingTime = now
+            if self._ring is None:
+                self._ring = np.empty((self.ringSize,) + shape, dtype=img.dtype)
+            self._ring[self._ringIndex] = img
+            self._ringIndex = (self._ringIndex + 1) % self.ringSize
+            self._ringCount = min(self._ringCount + 1, self.ringSize)
+        ## frames that are not sampled into the ring leave the background unchanged
+        self._changed = True
+        self._blurChanged = True
+
+    def background(self, now=None):
+        """Return the current float32 background estimate, or None if no frames
+        have been added (or, with *threaded*, none has been computed yet). The
+        'mean' background may be updated in place by later calls to addFrame();
+        copy it if it must not change."""
+        if now is None:
+            now = ptime.time()
+        with self.lock:
+            if self.frameCount == 0:
+                return None
+            if self.method == 'mean':
+                return self._mean
+            due = self._background is None or (self._changed and now >= self._nextUpdate)
+            if not due or self._computeThread is not None:
+                return self._background
+            ## the ring array is replaced (not modified) by reset(), so it can be
+            ## read outside the lock
+            args = (self._ring[:self._ringCount], self._generation, now)
+            self._changed = False
+            if self.threaded:
+                self._computeThread = threading.Thread(target=self._computeBackground, args=args)
+                self._computeThread.daemon = True
+                self._computeThread.start()
+                return self._background
+        return self._computeBackground(*args)
+
+    def _computeBackground(self, ring, generation, now):
+        start = ptime.time()
+        if self.method == 'median':
+            bg = np.median(ring, axis=0)
+        else:
+            bg = np.percentile(ring, self.percentile, axis=0)
+        bg = bg.astype(np.float32, copy=False)
+        with self.lock:
+            if self.threaded:
+                self._computeThread = None
+            if generation != self._generation:
+                return None  # model was reset while computing
+            self._background = bg
+            self._nextUpdate = now + self.updateInterval
+            if self.threaded:
+                ## leave at least as long between live updates as this one took, so 
+                ## that large rings do not keep a CPU busy. Not done otherwise, since
+                ## *now* may be a recorded frame time rather than the clock time.
+                self._nextUpdate = max(self._nextUpdate, now + ptime.time() - start)
+            self._blurChanged = True
+            return bg
+
+    def blurredBackground(self, now=None):
+        """Return background() blurred by a gaussian filter of width *blur*
+        pixels. The result is cached; while frames are being added, it is
+        recomputed at most once per updateInterval."""
+        if now is None:
+            now = ptime.time()
+        bg = self.background(now)
+        with self.lock:
+            blur = self.blur
+            if bg is None or blur <= 0:
+                return bg
+            if not (self._blurred is None or self._blurred.shape != bg.shape or self._blurTime is None or
+                    (self._blurChanged and now - self._blurTime >= self.updateInterval)):
+                return self._blurred
+            self._blurChanged = False
+            generation = self._generation
+        blurred = scipy.ndimage.gaussian_filter(bg, (blur, blur))
+        with self.lock:
+            if generation == self._generation:
+                self._blurred = blurred
+                self._blurTime = now
+        return blurred
@@ -1,9 +1,9 @@
-import scipy.ndimage
 import numpy as np
 from PyQt4 import QtCore, QtGui
 
 from acq4 import pyqtgraph as pg
 from .bg_subtract_template import Ui_Form
+from .background import BackgroundModel
 
 
 class BgSubtractCtrl(QtGui.QWidget):
@@ -14,16 +14,25 @@ class BgSubtractCtrl(QtGui.QWidget):
     * subtract / divide background
     * background blur for unsharp masking
     * continuous averaging
+    * rolling median / percentile backgrounds (see BackgroundModel)
     """
     needFrameUpdate = QtCore.Signal()
 
+    ## (label, BackgroundModel method) for each option in the method combo
+    methods = [('Mean', 'mean'), ('Median', 'median'), ('10th Percentile', 'percentile')]
+    percentile = 10.
+
     def __init__(self, parent=None):
         QtGui.QWidget.__init__(self, parent)
         self.ui = Ui_Form()
         self.ui.setupUi(self)
 
-        self.backgroundFrame = None
-        self.blurredBackgroundFrame = None
+        self.methodCombo = QtGui.QComboBox()
+        for label, method in self.methods:
+            self.methodCombo.addItem(label)
+        self.ui.horizontalLayout_2.addWidget(self.methodCombo)
+
+        self.model = BackgroundModel(percentile=self.percentile, threaded=True)
         self.lastFrameTime = None
         self.requestBgReset = False
 
@@ -33,6 +42,7 @@ class BgSubtractCtrl(QtGui.QWidget):
         self.ui.divideBgBtn.clicked.connect(self.divideClicked)
         self.ui.subtractBgBtn.clicked.connect(self.subtractClicked)
         self.ui.bgBlurSpin.valueChanged.connect(self.needFrameUpdate)
+        self.methodCombo.currentIndexChanged.connect(self.methodChanged)
 
     def divideClicked(self):
         self.needFrameUpdate.emit()
@@ -42,19 +52,18 @@ class BgSubtractCtrl(QtGui.QWidget):
         self.needFrameUpdate.emit()
         self.ui.divideBgBtn.setChecked(False)
 
+    def methodChanged(self):
+        ## collected frames can not be reused by a different method
+        self.model = BackgroundModel(method=self.methods[self.methodCombo.currentIndex()][1],
+                                     percentile=self.percentile, blur=self.ui.bgBlurSpin.value(),
+                                     threaded=True)
+        self.needFrameUpdate.emit()
+
     def getBackgroundFrame(self):
-        if self.backgroundFrame is None:
-            return None
-        if self.blurredBackgroundFrame is None:
-            self.updateBackgroundBlur()
-        return self.blurredBackgroundFrame
+        return self.model.blurredBackground()
 
     def updateBackgroundBlur(self):
-        b = self.ui.bgBlurSpin.value()
-        if b > 0.0:
-            self.blurredBackgroundFrame = scipy.ndimage.gaussian_filter(self.backgroundFrame, (b, b))
-        else:
-            self.blurredBackgroundFrame = self.backgroundFrame
+        self.model.setBlur(self.ui.bgBlurSpin.value())
 
     def collectBgClicked(self, checked):
         if checked:
@@ -79,8 +88,9 @@ class BgSubtractCtrl(QtGui.QWidget):
             return
         
         # integrate new frame into background
+        self.model.window = self.ui.bgTimeSpin.value()
         if self.ui.contAvgBgCheck.isChecked():
-            x = np.exp(-dt * 5 / max(self.ui.bgTimeSpin.value(), 0.01))
+            weight = 1.0 - np.exp(-dt * 5 / max(self.ui.bgTimeSpin.value(), 0.01))
         else:
             ## stop collecting bg frames if we are in static mode and time is up
             timeLeft = self.ui.bgTimeSpin.value() - (pg.ptime.time()-self.bgStartTime)
@@ -90,26 +100,45 @@ class BgSubtractCtrl(QtGui.QWidget):
                 self.ui.collectBgBtn.setChecked(False)
                 self.ui.collectBgBtn.setText("Collect Background")
 
-            x = float(self.bgFrameCount) / (self.bgFrameCount + 1)
+            weight = 1.0 / (self.bgFrameCount + 1)
             self.bgFrameCount += 1
     
-        img = frame.getImage().astype(np.float32)
-        if self.requestBgReset or self.backgroundFrame == None or self.backgroundFrame.shape != img.shape:
+        img = frame.getImage()
+        if self.requestBgReset or self.model.shape != img.shape:
             self.requestBgReset = False
-            self.backgroundFrame = img
+            self.model.reset()
+            self.model.addFrame(img, now=now)
             self.needFrameUpdate.emit()
         else:
-            self.backgroundFrame = x * self.backgroundFrame + (1-x) * img
-        self.blurredBackgroundFrame = None
+            self.model.addFrame(img, weight=weight, now=now)
         
     def processImage(self, data):
+        return self.applyBackground(data, *self.backgroundState())
+
+    def backgroundState(self):
+        """Return (mode, background) describing the current background
+        correction, where mode is 'divide', 'subtract', or None and background
+        is the BackgroundModel.
+        """
         if self.ui.divideBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data / bg
+            return 'divide', self.model
         elif self.ui.subtractBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data - bg
+            return 'subtract', self.model
+        return None, None
 
+    @staticmethod
+    def applyBackground(data, mode, bg):
+        """Apply the background correction returned by backgroundState() to *data*.
+        *bg* may be a BackgroundModel or a background image.
+        This does not access the user interface and may be called from any thread
+        (so that the blurred background is computed outside the GUI thread).
+        """
+        if isinstance(bg, BackgroundModel):
+            bg = bg.blurredBackground()
+        if bg is None or bg.shape != data.shape:
+            return data
+        if mode == 'divide':
+            data = data / bg
+        elif mode == 'subtract':
+            data = data - bg
         return data
@@ -85,20 +85,41 @@ class ContrastCtrl(QtGui.QWidget):
         # the final appearance of the image.
 
         if self.ui.btnAutoGain.isChecked():
-            cw = self.ui.spinAutoGainCenterWeight.value()
-            (w,h) = data.shape
-            center = data[w/2.-w/6.:w/2.+w/6., h/2.-h/6.:h/2.+h/6.]
-            minVal = data.min() * (1.0-cw) + center.min() * cw
-            maxVal = data.max() * (1.0-cw) + center.max() * cw
-
-            ## If there is inf/nan in the image, strip it out before computing min/max
-            if any([np.isnan(minVal), np.isinf(minVal),  np.isnan(minVal), np.isinf(minVal)]):
-                nanMask = np.isnan(data)
-                infMask = np.isinf(data)
-                valid = data[~nanMask * ~infMask]
-                minVal = valid.min() * (1.0-cw) + center.min() * cw
-                maxVal = valid.max() * (1.0-cw) + center.max() * cw
-            
+            self.applyLevels(self.measureImage(data, self.ui.spinAutoGainCenterWeight.value()))
+        self.imageItem.setOpacity(self.alpha)
+
+    def autoGainState(self):
+        """Return the center weight to pass to measureImage(), or None if
+        auto gain is disabled.
+        """
+        if self.ui.btnAutoGain.isChecked():
+            return self.ui.spinAutoGainCenterWeight.value()
+        return None
+
+    @staticmethod
+    def measureImage(data, cw):
+        """Return the (min, max) values of *data* used by the auto gain, with
+        the image center given the weight *cw*. This does not access the user
+        interface and may be called from any thread.
+        """
+        (w,h) = data.shape
+        center = data[int(w/2-w/6):int(w/2+w/6), int(h/2-h/6):int(h/2+h/6)]
+        minVal = data.min() * (1.0-cw) + center.min() * cw
+        maxVal = data.max() * (1.0-cw) + center.max() * cw
+
+        ## If there is inf/nan in the image, strip it out before computing min/max
+        if any([np.isnan(minVal), np.isinf(minVal),  np.isnan(maxVal), np.isinf(maxVal)]):
+            nanMask = np.isnan(data)
+            infMask = np.isinf(data)
+            valid = data[~nanMask * ~infMask]
+            minVal = valid.min() * (1.0-cw) + center.min() * cw
+            maxVal = valid.max() * (1.0-cw) + center.max() * cw
+        return minVal, maxVal
+
+    def applyLevels(self, minMax):
+        """Update the display levels from image values measured by measureImage()."""
+        minVal, maxVal = minMax
+        if self.ui.btnAutoGain.isChecked():
             ## Smooth min/max range to avoid noise
             if self.lastMinMax is None:
                 minVal = minVal
@@ -120,5 +141,3 @@ class ContrastCtrl(QtGui.QWidget):
                 self.ui.histogram.setHistogramRange(minVal, maxVal, padding=0.05)
             finally:
                 self.ignoreLevelChange = False
-
-        self.imageItem.setOpacity(self.alpha)
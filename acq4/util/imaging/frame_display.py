@@ -1,7 +1,9 @@
+import time, threading
 from PyQt4 import QtCore, QtGui
 from acq4 import pyqtgraph as pg
 from .contrast_ctrl import ContrastCtrl
 from .bg_subtract_ctrl import BgSubtractCtrl
+from acq4.util.Thread import Thread
 from acq4.util.debug import printExc
 
 
@@ -13,11 +15,19 @@ class FrameDisplay(QtCore.QObject):
     * frame rate limiting
     * contrast control widget
     * background subtraction control widget
+
+    Background correction and auto gain measurement are done in a worker
+    thread (DisplayWorker) that only ever processes the newest frame, at most
+    *maxFps* times per second. Frames that arrive while another is waiting are
+    dropped (see droppedFrames); the GUI thread only uploads finished images.
     """
     # Allow subclasses to override these:
     contrastClass = ContrastCtrl
     bgSubtractClass = BgSubtractCtrl
 
+    ## Maximum rate at which new frames are drawn
+    maxFps = 30.
+
     imageUpdated = QtCore.Signal(object)  # emits frame when the image is redrawn
 
     def __init__(self):
@@ -29,30 +39,23 @@ class FrameDisplay(QtCore.QObject):
         self.bgCtrl = self.bgSubtractClass()
         self.bgCtrl.needFrameUpdate.connect(self.updateFrame)
 
-        self.nextFrame = None
-        self._updateFrame = False
         self.currentFrame = None
         self.lastDrawTime = None
         self.displayFps = None
+        self.droppedFrames = 0
         self.hasQuit = False
+        self.telemetry = None  ## PipelineTelemetry, set by ImagingCtrl
 
-        ## Check for new frame updates every 16ms
-        ## Some checks may be skipped even if there is a new frame waiting to avoid drawing more than
-        ## 60fps.
-        self.frameTimer = QtCore.QTimer()
-        self.frameTimer.timeout.connect(self.drawFrame)
-        self.frameTimer.start(30) ## draw frames no faster than 60Hz
-        #QtCore.QTimer.singleShot(1, self.drawFrame)
-        ## avoiding possible singleShot-induced crashes
-
-    def newFrame(self, frame):
-        self.currentFrame = frame
+        self.worker = DisplayWorker(self)
+        self.worker.sigFrameReady.connect(self.drawFrame, QtCore.Qt.QueuedConnection)
+        self.worker.start()
 
     def updateFrame(self):
         """Redisplay the current frame.
         """
-        self._updateFrame = True
         self.contrastCtrl.resetAutoGain()
+        if self.currentFrame is not None:
+            self.submit(self.currentFrame, isNew=False)
 
     def imageItem(self):
         return self._imageItem
@@ -67,7 +70,9 @@ class FrameDisplay(QtCore.QObject):
         """Return the currently active background image or None if background
         subtraction is disabled.
         """
-        return self.bgCtrl.backgroundFrame()
+        if self.bgCtrl.backgroundState()[0] is None:
+            return None
+        return self.bgCtrl.getBackgroundFrame()
 
     def visibleImage(self):
         """Return a copy of the image as it is currently visible in the scene.
@@ -77,79 +82,156 @@ class FrameDisplay(QtCore.QObject):
         return self.currentFrame.getImage()
 
     def newFrame(self, frame):
-        # lf = None
-        # if self.nextFrame is not None:
-        #     lf = self.nextFrame
-        # elif self.currentFrame is not None:
-        #     lf = self.currentFrame
-        
-        ## self.nextFrame gets picked up by drawFrame() at some point
-        self.nextFrame = frame
-        
         self.bgCtrl.newFrame(frame)
+        self.submit(frame, isNew=True)
+
+    def submit(self, frame, isNew):
+        ## Hand a frame to the worker along with a snapshot of the display settings,
+        ## which may only be read from the GUI thread.
+        if self.hasQuit:
+            return
+        settings = {
+            'background': self.bgCtrl.backgroundState(),
+            'autoGain': self.contrastCtrl.autoGainState(),
+        }
+        self.worker.submit(frame, settings, isNew)
+
+    def frameDropped(self):
+        ## called by the worker (from any thread) when a frame is replaced before being drawn
+        self.droppedFrames += 1
+        if self.telemetry is not None:
+            self.telemetry.drop('display')
 
     def drawFrame(self):
         if self.hasQuit:
             return
-        #sys.stdout.write('+')
+        result = self.worker.takeResult()
+        if result is None:
+            return  ## already drawn by an earlier call
+        frame, data, minMax, isNew = result
+
         try:
-            
-            ## If we last drew a frame < 1/30s ago, return.
-            t = pg.ptime.time()
-            if (self.lastDrawTime is not None) and (t - self.lastDrawTime < .03):
-                #sys.stdout.write('-')
-                return
-            ## if there is no new frame and no controls have changed, just exit
-            if not self._updateFrame and self.nextFrame is None:
-                #sys.stdout.write('-')
-                return
-            self._updateFrame = False
-            
-            ## If there are no new frames and no previous frames, then there is nothing to draw.
-            if self.currentFrame is None and self.nextFrame is None:
-                #sys.stdout.write('-')
-                return
-            
             prof = pg.debug.Profiler()
-            ## We will now draw a new frame (even if the frame is unchanged)
-            if self.lastDrawTime is not None:
-                fps = 1.0 / (t - self.lastDrawTime)
-                self.displayFps = fps
+            t = pg.ptime.time()
+            if self.lastDrawTime is not None and t > self.lastDrawTime:
+                self.displayFps = 1.0 / (t - self.lastDrawTime)
             self.lastDrawTime = t
-            prof()
-            
-            ## Handle the next available frame, if there is one.
-            if self.nextFrame is not None:
-                self.currentFrame = self.nextFrame
-                self.nextFrame = None
-            
-            data = self.currentFrame.getImage()
-            info = self.currentFrame.info()
-            prof()
-            
-            
-            ## divide the background out of the current frame if needed
-            data = self.bgCtrl.processImage(data)
-            prof()
-            
+            self.currentFrame = frame
+
             ## Set new levels if auto gain is enabled
-            self.contrastCtrl.processImage(data)
+            if minMax is not None:
+                self.contrastCtrl.applyLevels(minMax)
+            self.contrastCtrl.imageItem.setOpacity(self.contrastCtrl.alpha)
             prof()
             
             ## update image in viewport
-            self._imageItem.updateImage(data.copy())  # using data.copy() here avoids crashes!
+            self._imageItem.updateImage(data)
             prof()
 
-            self.imageUpdated.emit(self.currentFrame)
+            if isNew and self.telemetry is not None:
+                self.telemetry.frame('display', frame)
+
+            self.imageUpdated.emit(frame)
             prof()
             
             prof.finish()
         
         except:
             printExc('Error while drawing new frames:')
-        finally:
-            pass
 
     def quit(self):
         self.imageItem = None
         self.hasQuit = True
+        self.worker.stop()
+
+
+class DisplayWorker(Thread):
+    """Prepares frames for FrameDisplay in a background thread.
+
+    Only the most recently submitted frame is processed; processed images
+    wait in a single slot until the GUI thread takes them, so neither side
+    accumulates a backlog.
+    """
+    sigFrameReady = QtCore.Signal()
+
+    def __init__(self, display):
+        Thread.__init__(self)
+        self.display = display
+        self.cond = threading.Condition()
+        self.pending = None   # (frame, settings, isNew) waiting to be processed
+        self.result = None    # (frame, data, minMax, isNew) waiting to be drawn
+        self.stopThread = False
+
+    def submit(self, frame, settings, isNew):
+        with self.cond:
+            if self.pending is not None and self.pending[2]:
+                self.display.frameDropped()
+            ## a redraw request must not hide a new frame that is still waiting
+            isNew = isNew or (self.pending is not None and self.pending[2])
+            self.pending = (frame, settings, isNew)
+            self.cond.notify()
+
+    def takeResult(self):
+        with self.cond:
+            result = self.result
+            self.result = None
+            return result
+
+    def stop(self):
+        with self.cond:
+            self.stopThread = True
+            self.cond.notify()
+        self.wait()
+
+    def run(self):
+        lastTime = None
+        while True:
+            with self.cond:
+                while self.pending is None and not self.stopThread:
+                    self.cond.wait()
+                if self.stopThread:
+                    break
+
+            ## limit the redraw rate; frames that arrive meanwhile replace the pending one
+            if lastTime is not None:
+                wait = lastTime + 1.0 / self.display.maxFps - pg.ptime.time()
+                if wait > 0:
+                    time.sleep(wait)
+            lastTime = pg.ptime.time()
+
+            with self.cond:
+                if self.pending is None:
+                    continue
+                frame, settings, isNew = self.pending
+                self.pending = None
+
+            try:
+                result = self.process(frame, settings) + (isNew,)
+            except:
+                printExc('Error while processing frame for display:')
+                continue
+
+            with self.cond:
+                if self.result is not None and self.result[3]:
+                    self.display.frameDropped()  ## GUI did not draw the previous frame in time
+                self.result = result
+            self.sigFrameReady.emit()
+
+    def process(self, frame, settings):
+        data = frame.getImage()
+        orig = data
+
+        ## divide the background out of the current frame if needed
+        data = BgSubtractCtrl.applyBackground(data, *settings['background'])
+
+        ## measure image range for auto gain
+        if settings['autoGain'] is None:
+            minMax = None
+        else:
+            minMax = ContrastCtrl.measureImage(data, settings['autoGain'])
+
+        ## the image item gets its own copy (avoids crashes, and releases
+        ## camera frame buffers as soon as the frame is no longer needed)
+        if data is orig:
+            data = data.copy()
+        return frame, data, minMax
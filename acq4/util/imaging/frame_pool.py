@@ -0,0 +1,99 @@
+"""
+Preallocated frame buffers for camera acquisition.
+
+At high frame rates, allocating a new array for every camera frame (and
+freeing it again once the display and recorder are done with it) costs a
+significant fraction of the acquisition thread's time. A FramePool keeps a
+fixed ring of arrays of the current frame shape that camera drivers fill
+directly:
+
+    buf = self.framePool.acquire(shape, dtype)
+    buf[...] = driverBuffer
+    frames.append({'id': frameId, 'time': now, 'data': buf})
+
+A buffer is leased for as long as anything refers to it: the Frame it was
+delivered in, the display, the recorder's queue, or any view of its data.
+Consumers therefore hold frames exactly as before, without copying, and the
+buffer returns to the pool once the last reference is dropped. If every
+buffer is still leased when the driver needs one, a new array is allocated
+instead and counted as an overrun.
+"""
+import sys
+import numpy as np
+from acq4.util.Mutex import Mutex
+
+
+class FramePool(object):
+    """Ring of *size* preallocated frame arrays. See module docstring.
+
+    The buffers are (re)allocated when acquire() is called with a new shape or
+    dtype, usually on the first frame after the camera region or binning changes.
+    """
+    def __init__(self, size=16):
+        self.size = size
+        self.lock = Mutex()
+        self.buffers = []
+        self.shape = None
+        self.dtype = None
+        self.next = 0
+        self.resetCounters()
+
+    def resetCounters(self):
+        """Reset the frame, overrun, and peak usage counters reported by stats()."""
+        with self.lock:
+            self.frames = 0
+            self.overruns = 0
+            self.maxInUse = 0
+
+    def acquire(self, shape, dtype):
+        """Return an array of *shape* and *dtype* that is not referenced by any
+        frame still in use. The caller must overwrite its entire contents."""
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        with self.lock:
+            if shape != self.shape or dtype != self.dtype:
+                self.shape = shape
+                self.dtype = dtype
+                self.buffers = [np.empty(shape, dtype=dtype) for i in range(self.size)]
+                self.next = 0
+            self.frames += 1
+
+            n = len(self.buffers)
+            for i in range(n):
+                j = (self.next + i) % n
+                if not self._leased(j):
+                    self.next = (j + 1) % n
+                    self.maxInUse = max(self.maxInUse, self._inUse() + 1)
+                    return self.buffers[j]
+
+            self.overruns += 1
+            self.maxInUse = n
+        return np.empty(shape, dtype=dtype)
+
+    def _leased(self, i):
+        ## the only references to a free buffer are self.buffers and the
+        ## argument to getrefcount; frames and array views add their own
+        return sys.getrefcount(self.buffers[i]) > 2
+
+    def _inUse(self):
+        return len([i for i in range(len(self.buffers)) if self._leased(i)])
+
+    def stats(self):
+        """Return a dict describing pool usage since the last resetCounters():
+
+        * size, inUse: number of buffers in the pool and currently leased
+        * pressure: inUse / size
+        * maxInUse: largest number of buffers leased at once
+        * frames: number of buffers handed out, including overruns
+        * overruns: number of frames that could not use a pool buffer
+        """
+        with self.lock:
+            inUse = self._inUse()
+            return {
+                'size': len(self.buffers),
+                'inUse': inUse,
+                'pressure': inUse / float(max(1, len(self.buffers))),
+                'maxInUse': self.maxInUse,
+                'frames': self.frames,
+                'overruns': self.overruns,
+            }
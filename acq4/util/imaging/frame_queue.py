@@ -0,0 +1,238 @@
+"""
+Bounded queue of frames waiting to be written to disk.
+
+RecordThread receives frames from the GUI thread faster than it can write
+them whenever the disk stalls. A FrameQueue limits the memory held by these
+frames to *maxBytes* and applies a policy once the limit is reached:
+
+    block  - the producer calls waitForRoom() (up to *blockTimeout* seconds,
+             or until it is told to stop) before it creates the next frame,
+             so that acquisition slows to the speed of the writer; frames that
+             still do not fit are dropped
+    drop   - new frames are dropped immediately
+    spill  - image data of new frames is moved to a scratch file (in *spillDir*,
+             or the system temporary directory) and read back when the frame
+             is taken from the queue
+
+Items are frame records (dicts with a 'frame' key holding an imaging.Frame)
+or markers such as False that are passed through without counting against
+the budget. put() never waits, so it is safe to call from the GUI thread.
+The consumer waits on the queue instead of polling:
+
+    queue.put({'frame': frame, ...})
+    ...
+    items = queue.get(maxBytes=batchBytes)   # None once the queue is closed
+"""
+from __future__ import division
+
+import collections
+import tempfile
+import threading
+import time
+import numpy as np
+
+
+class FrameQueue(object):
+    """Thread-safe FIFO of frame records with a memory budget. See module docstring."""
+
+    policies = ['block', 'drop', 'spill']
+    pollInterval = 0.1  # see waitForRoom()
+
+    def __init__(self, maxBytes=500e6, policy='drop', spillDir=None, blockTimeout=5.0):
+        if policy not in self.policies:
+            raise ValueError("Unknown record queue policy '%s'; options are %s" % (policy, self.policies))
+        self.maxBytes = maxBytes
+        self.policy = policy
+        self.spillDir = spillDir
+        self.blockTimeout = blockTimeout
+
+        self.cond = threading.Condition()
+        self.items = collections.deque()  # (item, nbytes, inMemory)
+        self.bytes = 0          # bytes of image data held in memory
+        self.spilled = 0        # number of queued frames whose data is in the spill file
+        self.dropped = 0        # frames rejected since the queue was created
+        self.closed = False
+        self.spillFile = None
+
+    def __len__(self):
+        with self.cond:
+            return len(self.items)
+
+    def put(self, item, force=False):
+        """Add *item* to the end of the queue.
+
+        Frame records are subject to the queue policy unless *force* is True.
+        Returns False if the frame was dropped. This method does not wait for
+        room in the queue; see waitForRoom().
+        """
+        if not isinstance(item, dict):
+            nbytes = 0
+        else:
+            nbytes = item['frame'].getImage().nbytes
+
+        with self.cond:
+            if self.closed:
+                return False
+            if not force and nbytes > 0 and not self._hasRoom(nbytes):
+                if self.policy == 'spill':
+                    item = self._spill(item)
+                    self.items.append((item, nbytes, False))
+                    self.spilled += 1
+                    self.cond.notify_all()
+                    return True
+                self.dropped += 1
+                return False
+
+            self.items.append((item, nbytes, True))
+            self.bytes += nbytes
+            self.cond.notify_all()
+            return True
+
+    def get(self, maxBytes=None, timeout=None):
+        """Remove and return a list of items from the front of the queue.
+
+        Waits until at least one item is available, then returns as many items
+        as fit in *maxBytes* (always at least one). Returns an empty list if
+        *timeout* expires first, and None once the queue has been closed.
+        """
+        with self.cond:
+            if len(self.items) == 0 and not self.closed:
+                self.cond.wait(timeout)
+            if self.closed:
+                return None
+            items = []
+            total = 0
+            while len(self.items) > 0:
+                item, nbytes, inMemory = self.items[0]
+                if len(items) > 0 and maxBytes is not None and total + nbytes > maxBytes:
+                    break
+                self.items.popleft()
+                items.append(item)
+                total += nbytes
+                if inMemory:
+                    self.bytes -= nbytes
+                else:
+                    self.spilled -= 1
+            self.cond.notify_all()
+            return items
+
+    def waitForRoom(self, nbytes, timeout=-1, until=None):
+        """Wait until a frame of *nbytes* would fit in the queue, for at most
+        *timeout* seconds (default is *blockTimeout*; None waits indefinitely).
+        Returns True if there is room.
+
+        If *until* is given, the wait also ends as soon as until() returns True.
+        It is checked whenever the queue changes and at least every
+        *pollInterval* seconds.
+
+        Used by producers of the 'block' policy. Do not call this from the GUI
+        thread; frames already emitted to it keep arriving while it waits.
+        """
+        if timeout == -1:
+            timeout = self.blockTimeout
+        if timeout is None:
+            deadline = None
+        else:
+            deadline = time.time() + timeout
+        with self.cond:
+            while not self.closed and not self._hasRoom(nbytes):
+                if until is not None and until():
+                    break
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.time()
+                    if wait <= 0:
+                        break
+                if until is not None:
+                    wait = self.pollInterval if wait is None else min(wait, self.pollInterval)
+                self.cond.wait(wait)
+            return not self.closed and self._hasRoom(nbytes)
+
+    def close(self):
+        """Wake all waiting threads and discard the remaining items, which are returned."""
+        with self.cond:
+            self.closed = True
+            items = [i[0] for i in self.items]
+            self.items.clear()
+            self.bytes = 0
+            self.spilled = 0
+            ## spilled frames already taken by the consumer may still need the file;
+            ## it is deleted once the last of them is released
+            self.spillFile = None
+            self.cond.notify_all()
+            return items
+
+    def stats(self):
+        """Return a dict with the number of queued *frames*, the *bytes* of image
+        data held in memory, the number of frames *spilled* to disk, and the
+        number of frames *dropped*."""
+        with self.cond:
+            return {'frames': len(self.items), 'bytes': self.bytes, 'spilled': self.spilled, 'dropped': self.dropped}
+
+    def _hasRoom(self, nbytes):
+        ## a frame larger than the whole budget is accepted when nothing else is queued
+        return self.bytes + nbytes <= self.maxBytes or self.bytes == 0
+
+    def _spill(self, item):
+        if self.spillFile is None:
+            self.spillFile = SpillFile(self.spillDir)
+        item = item.copy()
+        item['frame'] = self.spillFile.store(item['frame'])
+        return item
+
+
+class SpillFile(object):
+    """Temporary file holding the image data of spilled frames. The file is
+    truncated whenever every frame written to it has been read back."""
+
+    def __init__(self, dirName=None):
+        self.fh = tempfile.TemporaryFile(dir=dirName, prefix='acq4_spill_')
+        self.lock = threading.Lock()
+        self.size = 0
+        self.count = 0
+
+    def store(self, frame):
+        """Write the image of *frame* to the file and return a SpilledFrame to replace it."""
+        data = np.ascontiguousarray(frame.getImage())
+        with self.lock:
+            offset = self.size
+            self.fh.seek(offset)
+            data.tofile(self.fh)
+            self.size += data.nbytes
+            self.count += 1
+        return SpilledFrame(self, offset, data.shape, data.dtype, frame.info())
+
+    def read(self, offset, shape, dtype):
+        with self.lock:
+            self.fh.seek(offset)
+            data = np.fromfile(self.fh, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            self.count -= 1
+            if self.count == 0:
+                self.fh.seek(0)
+                self.fh.truncate()
+                self.size = 0
+        return data
+
+
+class SpilledFrame(object):
+    """Stands in for a frame whose image data has been moved to a SpillFile.
+    The data is read back the first time it is requested."""
+
+    def __init__(self, spillFile, offset, shape, dtype, info):
+        self._spillFile = spillFile
+        self._offset = offset
+        self._shape = shape
+        self._dtype = dtype
+        self._info = info
+        self._data = None
+
+    def info(self):
+        return self._info
+
+    def data(self):
+        if self._data is None:
+            self._data = self._spillFile.read(self._offset, self._shape, self._dtype)
+        return self._data
+
+    def getImage(self):
+        return self.data()
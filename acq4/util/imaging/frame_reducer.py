@@ -0,0 +1,142 @@
+"""
+Data reduction applied to frames before they are recorded.
+
+Long recordings often only need averaged, binned, or cropped frames. A
+FrameReducer applies, in order:
+
+    region   - (x, y, w, h) crop, in image pixels
+    binning  - mean over bin x bin pixel blocks (incomplete blocks at the
+               right / bottom edges are discarded)
+    average  - mean of every *average* consecutive frames
+    dtype    - output data type; values are multiplied by *scale*, rounded
+               (for integer types) and clipped to the range of the type.
+               Defaults to the dtype of the incoming frames.
+
+    reducer = FrameReducer(average=4, binning=2)
+    for data, info in frames:
+        for data, info in reducer.process(data, info):
+            write(data, info)
+
+The info of each output frame is that of the first frame it includes, with
+'time' set to the mean time of its frames, the frame transform updated for
+the crop and binning, and a 'reduction' entry giving the parameters used.
+"""
+from __future__ import division
+
+import numpy as np
+from acq4.pyqtgraph import SRTTransform3D
+
+
+class FrameReducer(object):
+    """Crop, bin, average, and narrow the dtype of a sequence of frames. See module docstring."""
+
+    def __init__(self, average=1, binning=1, region=None, dtype=None, scale=1.0):
+        self.average = int(average)
+        self.binning = int(binning)
+        self.region = None if region is None else tuple([int(x) for x in region])
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.scale = scale
+        if self.average < 1 or self.binning < 1:
+            raise ValueError("Frame averaging and binning must be >= 1.")
+        self.reset()
+
+    def isIdentity(self):
+        """Return True if frames pass through unchanged."""
+        return self.average == 1 and self.binning == 1 and self.region is None and self.dtype is None
+
+    def reset(self):
+        """Discard any partially averaged frame."""
+        self._sum = None
+        self._times = []
+        self._info = None
+
+    def params(self):
+        """Return a dict of the reduction parameters for storing with recorded data."""
+        return {
+            'average': self.average,
+            'binning': self.binning,
+            'region': self.region,
+            'dtype': None if self.dtype is None else self.dtype.name,
+            'scale': self.scale,
+        }
+
+    def process(self, data, info):
+        """Add a frame and return a list of (data, info) for the frames that are complete."""
+        if self.isIdentity():
+            return [(data, info)]
+        outType = data.dtype if self.dtype is None else self.dtype
+
+        if self.region is not None:
+            x, y, w, h = self.region
+            data = data[x:x+w, y:y+h]
+        if self.binning > 1:
+            data = binFrame(data, self.binning)
+        elif self.average > 1:
+            data = data.astype(np.float32)
+
+        if self.average > 1:
+            if self._sum is None or self._sum.shape != data.shape:
+                self._sum = data
+                self._times = []
+                self._info = info
+            else:
+                self._sum += data
+            self._times.append(info['time'])
+            if len(self._times) < self.average:
+                return []
+            data = self._sum
+            data /= self.average
+            info = self._info
+            time = np.mean(self._times)
+            self.reset()
+        else:
+            time = info['time']
+
+        return [(self.convert(data, outType), self.reduceInfo(info, time))]
+
+    def convert(self, data, dtype):
+        """Scale *data* and convert to *dtype*, rounding and clipping integer types."""
+        if self.scale != 1:
+            data = data * self.scale
+        if dtype.kind in 'ui':
+            if data.dtype.kind == 'f':
+                data = np.round(data)
+            lim = np.iinfo(dtype)
+            if data.dtype != dtype:
+                data = np.clip(data, lim.min, lim.max)
+        return data.astype(dtype, copy=False)
+
+    def reduceInfo(self, info, time):
+        info = info.copy()
+        info['time'] = time
+        info['reduction'] = self.params()
+        x0, y0 = (0, 0) if self.region is None else self.region[:2]
+        b = self.binning
+        if 'region' in info and 'binning' in info:
+            rb = info['binning']
+            r = info['region']
+            info['binning'] = [rb[0] * b, rb[1] * b]
+            if self.region is not None:
+                info['region'] = [r[0] + x0 * rb[0], r[1] + y0 * rb[1], self.region[2] * rb[0], self.region[3] * rb[1]]
+        if (x0, y0, b) != (0, 0, 1) and 'frameTransform' in info:
+            ## map from reduced image pixels to the original image pixels
+            tr = SRTTransform3D()
+            tr.translate(x0, y0)
+            tr.scale(b, b, 1)
+            info['frameTransform'] = SRTTransform3D(SRTTransform3D(info['frameTransform']) * tr)
+            if 'transform' in info:
+                info['transform'] = SRTTransform3D(SRTTransform3D(info['transform']) * tr)
+        return info
+
+
+def binFrame(data, b):
+    """Return the float32 mean of *data* over b x b pixel blocks along its first two axes."""
+    nx = data.shape[0] // b
+    ny = data.shape[1] // b
+    data = data[:nx*b, :ny*b]
+    out = np.zeros((nx, ny) + data.shape[2:], dtype=np.float32)
+    for i in range(b):
+        for j in range(b):
+            out += data[i::b, j::b]
+    out /= b * b
+    return out
@@ -4,6 +4,7 @@ from acq4 import pyqtgraph as pg
 from .frame_display import FrameDisplay
 from .imaging_template import Ui_Form
 from .record_thread import RecordThread
+from .telemetry import PipelineTelemetry
 from acq4.util.debug import printExc
 
 
@@ -16,6 +17,7 @@ class ImagingCtrl(QtGui.QWidget):
     * Save frame, pin frame
     * Record stack
     * FPS display
+    * Pipeline latency / dropped frame display (see PipelineTelemetry)
     * Internal FrameDisplay that handles image display, contrast, and
       background subtraction.
 
@@ -42,10 +44,16 @@ class ImagingCtrl(QtGui.QWidget):
     frameDisplayClass = FrameDisplay  # let subclasses override this class
 
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, telemetry=None, recordQueue=None, recordReduction=None):
         QtGui.QWidget.__init__(self, parent)
 
+        ## timing and drop statistics are shared with the imaging device if it provides them
+        if telemetry is None:
+            telemetry = PipelineTelemetry()
+        self.telemetry = telemetry
+
         self.frameDisplay = self.frameDisplayClass()
+        self.frameDisplay.telemetry = telemetry
 
         self.pinnedFrames = []
         self.stackShape = None
@@ -66,12 +74,22 @@ class ImagingCtrl(QtGui.QWidget):
         self.ui.displayPercentLabel.setFormatStr('({avgValue:.1f}%)')
         self.ui.displayPercentLabel.setAverageTime(4.0)
 
+        ## pipeline summary; full statistics are in the tooltip
+        self.pipelineLabel = QtGui.QLabel()
+        self.ui.gridLayout.addWidget(self.pipelineLabel, 8, 0, 1, 3)
+        self.telemetryTimer = QtCore.QTimer()
+        self.telemetryTimer.timeout.connect(self.updateTelemetry)
+        self.telemetryTimer.start(1000)
+
         # disabled until first frame arrives
         self.ui.saveFrameBtn.setEnabled(False)
         self.ui.pinFrameBtn.setEnabled(False)
 
-        ## set up recording thread
-        self.recordThread = RecordThread(self)
+        ## set up recording thread; *recordQueue* sets its queue budget and policy,
+        ## *recordReduction* the averaging / binning applied to recorded stacks
+        self.recordThread = RecordThread(self, telemetry=telemetry, queueOpts=recordQueue)
+        if recordReduction is not None:
+            self.recordThread.setReduction(**recordReduction)
         self.recordThread.start()
         # self.recordThread.sigShowMessage.connect(self.showMessage)
         self.recordThread.finished.connect(self.recordThreadStopped)
@@ -115,17 +133,20 @@ class ImagingCtrl(QtGui.QWidget):
 
         # update acquisition frame rate
         now = frame.info()['time']
+        acqFps = None
         if self.lastFrameTime is not None:
             dt = now - self.lastFrameTime
             if dt > 0:
-                fps = 1.0 / dt
-                self.ui.fpsLabel.setValue(fps)
+                acqFps = 1.0 / dt
+                self.ui.fpsLabel.setValue(acqFps)
         self.lastFrameTime = now
 
-        # update display frame rate
+        # update display frame rate and the fraction of frames displayed
         fps = self.frameDisplay.displayFps
         if fps is not None:
             self.ui.displayFpsLabel.setValue(fps)
+            if acqFps is not None:
+                self.ui.displayPercentLabel.setValue(min(100., 100. * fps / acqFps))
 
         if self.recordingStack():
             frameShape = frame.getImage().shape
@@ -141,6 +162,22 @@ class ImagingCtrl(QtGui.QWidget):
 
         self.frameDisplay.newFrame(frame)
 
+    def updateTelemetry(self):
+        stats = self.telemetry.stats()
+        if sum(stats['frames'].values()) == 0:
+            return
+        ## frames skipped by the display are not counted as dropped
+        text = 'dropped: %d' % self.telemetry.lostFrames(stats)
+        skipped = stats['drops'].get('display', 0)
+        if skipped > 0:
+            text += '   display skipped: %d' % skipped
+        if 'display' in stats['latency']:
+            text += '   display latency: %0.0f ms' % (stats['latency']['display']['mean'] * 1e3)
+        if 'record' in stats['queues']:
+            text += '   rec. queue: %d' % stats['queues']['record']['current']
+        self.pipelineLabel.setText(text)
+        self.pipelineLabel.setToolTip('<pre>%s</pre>' % self.telemetry.summary(stats))
+
     def saveFrameClicked(self):
         if self.ui.linkSavePinBtn.isChecked():
             self.addPinnedFrame()
@@ -217,6 +254,7 @@ class ImagingCtrl(QtGui.QWidget):
         except TypeError:
             pass
 
+        self.telemetryTimer.stop()
         self.recordThread.quit()
         self.frameDisplay.quit()
         if not self.recordThread.wait(10000):
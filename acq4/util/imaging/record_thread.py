@@ -1,13 +1,14 @@
-import time
-from acq4.util.Mutex import Mutex
 from acq4.util.Thread import Thread
 from PyQt4 import QtGui, QtCore
 import acq4.util.debug as debug
-from acq4.util.metaarray import MetaArray
+from acq4.util.metaarray import MetaArray, MetaArrayStackWriter
 import numpy as np
 import acq4.util.ptime as ptime
 import acq4.Manager
 from acq4.util.DataManager import FileHandle, DirHandle
+from .telemetry import PipelineTelemetry
+from .frame_queue import FrameQueue
+from .frame_reducer import FrameReducer
 try:
     from acq4.filetypes.ImageFile import *
     HAVE_IMAGEFILE = True
@@ -17,15 +18,43 @@ except ImportError:
 
 class RecordThread(Thread):
     """Class for offloading image recording to a worker thread.
+
+    Frames wait for the thread in a FrameQueue that holds at most
+    *queueBytes* of image data. When it is full, *queuePolicy* decides whether
+    the frame is dropped (counted as a 'record' drop in the pipeline telemetry),
+    spilled to a scratch file in *spillDir*, or whether acquisition is held
+    back ('block'; see waitForRoom). These can be set by the *queueOpts* dict
+    (the 'recordQueue' option in the camera configuration). newFrame() is
+    called from the GUI thread and never waits.
+
+    The thread writes whatever is waiting each time it wakes, up to a batch
+    size that is adjusted so that each write takes about *batchTime* seconds
+    at the throughput measured for previous writes.
+
+    Stack frames may be cropped, binned, averaged, and converted to a smaller
+    dtype before they are written (see setReduction and FrameReducer).
     """
     # sigShowMessage = QtCore.Signal(object)
     sigRecordingFailed = QtCore.Signal()
     sigRecordingFinished = QtCore.Signal(object, object)  # file handle, num frames
     sigSavedFrame = QtCore.Signal(object)
+
+    ## Defaults for the frame queue (see FrameQueue)
+    queueBytes = 500e6
+    queuePolicy = 'drop'
+    spillDir = None
+
+    ## Target duration of each write and limits on the size of write batches
+    batchTime = 0.2
+    minBatchBytes = 1e6
+    maxBatchBytes = 100e6
     
-    def __init__(self, ui):
+    def __init__(self, ui, telemetry=None, queueOpts=None):
         Thread.__init__(self)
         self.m = acq4.Manager.getManager()
+        if telemetry is None:
+            telemetry = PipelineTelemetry()
+        self.telemetry = telemetry
         
         self._stackSize = 0  # size of currently recorded stack
         self._recording = False
@@ -33,14 +62,22 @@ class RecordThread(Thread):
         self.frameLimit = None
         
         # Interaction with worker thread:
-        self.lock = Mutex(QtCore.QMutex.Recursive)
-        self.newFrames = []  # list of frames and the files they should be sored / appended to.
+        # queue of frames and the files they should be stored / appended to
+        opts = {'maxBytes': self.queueBytes, 'policy': self.queuePolicy, 'spillDir': self.spillDir}
+        opts.update(queueOpts or {})
+        self.queue = FrameQueue(**opts)
 
         # Attributes private to worker thread:
         self.currentStack = None  # file handle of currently recorded stack
+        self.stackWriter = None  # keeps the current stack file open while recording
         self.startFrameTime = None
         self.lastFrameTime = None
         self.currentFrameNum = 0
+        self.stackTelemetry = None  # telemetry stats at the start of the current stack
+        self.reduction = {}  # FrameReducer options for new stacks
+        self.reducer = None  # FrameReducer for the current stack
+        self.batchBytes = self.minBatchBytes
+        self.writeRate = None  # bytes/sec, averaged over recent writes
 
     def startRecording(self, frameLimit=None):
         """Ask the recording thread to begin recording a new image stack.
@@ -55,6 +92,14 @@ class RecordThread(Thread):
         self._stackSize = 0
         self._recording = True
 
+    def setReduction(self, **opts):
+        """Set the reduction applied to frames of stacks recorded from now on.
+        Options are *average*, *binning*, *region*, *dtype*, and *scale*; see
+        FrameReducer. With no options, frames are recorded unchanged.
+        """
+        FrameReducer(**opts)  # raise on invalid options here rather than in the worker thread
+        self.reduction = opts
+
     def stopRecording(self):
         """Ask the recording thread to stop recording new images to the image
         stack.
@@ -62,8 +107,7 @@ class RecordThread(Thread):
         self.frameLimit = None
         self._stackSize = 0
         self._recording = False
-        with self.lock:
-            self.newFrames.append(False)
+        self.queue.put(False)
 
     @property
     def recording(self):
@@ -75,8 +119,7 @@ class RecordThread(Thread):
     def saveFrame(self):
         """Ask the recording thread to save the most recently acquired frame.
         """
-        with self.lock:
-            self.newFrames.append({'frame': self.currentFrame, 'dir': self.m.getCurrentDir(), 'stack': False})
+        self.queue.put({'frame': self.currentFrame, 'dir': self.m.getCurrentDir(), 'stack': False}, force=True)
 
     def newFrame(self, frame=None):
         """Inform the recording thread that a new frame has arrived.
@@ -87,17 +130,32 @@ class RecordThread(Thread):
             return
 
         self.currentFrame = frame
-        with self.lock:
-            if self.recording:
-                self.newFrames.append({'frame': self.currentFrame, 'dir': self.m.getCurrentDir(), 'stack': True})
-                self._stackSize += 1
-            framesLeft = len(self.newFrames)
+        if self.recording:
+            if not self.queue.put({'frame': self.currentFrame, 'dir': self.m.getCurrentDir(), 'stack': True}):
+                self.telemetry.drop('record')
+            self._stackSize += 1
+        framesLeft = len(self.queue)
+        self.telemetry.queueDepth('record', framesLeft)
         if self.recording:
             if self.frameLimit is not None and self._stackSize >= self.frameLimit:
                 self.frameLimit = None
                 self.stopRecording()
         return framesLeft
 
+    def waitForRoom(self, frame, until=None):
+        """With the 'block' queue policy, wait while recording until the queue
+        has room for *frame*. The wait ends early when recording stops, or when
+        the optional function *until* returns True.
+
+        This must be called from the acquisition thread before the frame is
+        emitted (see AcquireThread.connectCallback), so that the camera driver's
+        buffer absorbs a slow disk instead of the GUI event queue.
+        """
+        if self.recording and self.queue.policy == 'block':
+            ## stopRecording() wakes the wait by queueing its marker
+            stop = lambda: not self._recording or (until is not None and until())
+            self.queue.waitForRoom(frame.getImage().nbytes, until=stop)
+
     @property
     def stackSize(self):
         """The total number of frames requested for storage in the current
@@ -110,52 +168,56 @@ class RecordThread(Thread):
 
         No new frames will be written after the thread exits.
         """
-        with self.lock:
-            self.stopThread = True
-            self.newFrames = []
-            self.currentFrame = None
+        lost = len([f for f in self.queue.close() if f is not False and f['stack']])
+        if lost > 0:
+            self.telemetry.drop('record', lost)
+        self.currentFrame = None
     
     def run(self):
         # run is invoked in the worker thread automatically after calling start()
-        self.stopThread = False
-        
         while True:
-            with self.lock:
-                if self.stopThread:
-                    break
-                newFrames = self.newFrames[:]
-                self.newFrames = []
+            newFrames = self.queue.get(maxBytes=self.batchBytes)
+            if newFrames is None:
+                break
             
             try:
                 self.handleFrames(newFrames)
             except:
                 debug.printExc('Error in image recording thread:')
                 self.sigRecordingFailed.emit()
-                
-            time.sleep(100e-3)
+        
+        self.closeStack()
 
     def handleFrames(self, frames):
         # Write as many frames into the stack as possible.
         # If False appears in the list of frames, it indicates the end of a stack
         # and any further frames are written to a new stack.
 
+        self.telemetry.frames('record', [f['frame'] for f in frames if f is not False])
         recFrames = []
         for frame in frames:
 
             if frame is False:
-                # stop current recording
+                # stop current recording; frames of an incomplete average are discarded
                 if len(recFrames) > 0:
                     ## write prior frames now
                     self.writeFrames(recFrames, dh)
                     recFrames = []
+                reducer = self.reducer
+                self.reducer = None
 
                 if self.currentStack is not None:
+                    self.closeStack()
                     dur = self.lastFrameTime - self.startFrameTime
                     if dur > 0:
                         fps = (self.currentFrameNum+1) / dur
                     else:
                         fps = 0
-                    self.currentStack.setInfo({'frames': self.currentFrameNum, 'duration': dur, 'averageFPS': fps})
+                    telemetry = self.telemetry.stats(since=self.stackTelemetry)
+                    info = {'frames': self.currentFrameNum, 'duration': dur, 'averageFPS': fps, 'telemetry': telemetry}
+                    if not reducer.isIdentity():
+                        info['reduction'] = reducer.params()
+                    self.currentStack.setInfo(info)
                     # self.showMessage('Finished recording %s - %d frames, %02f sec' % (self.currentStack.name(), self.currentFrameNum, dur)) 
                     self.sigRecordingFinished.emit(self.currentStack, self.currentFrameNum)
                     self.currentStack = None
@@ -173,11 +235,12 @@ class RecordThread(Thread):
                 try:
                     if HAVE_IMAGEFILE:
                         fileName = 'image.tif'
-                        fh = dh.writeFile(data, fileName, info, fileType="ImageFile", autoIncrement=True)
+                        fh = dh.writeFile(data, fileName, info, fileType="ImageFile", autoIncrement=True, pyramid=True)
                     else:
                         fileName = 'image.ma'
-                        fh = dh.writeFile(data, fileName, info, fileType="MetaArray", autoIncrement=True)
+                        fh = dh.writeFile(data, fileName, info, fileType="MetaArray", autoIncrement=True, pyramid=True)
 
+                    self.telemetry.frame('disk', frame['frame'])
                     self.sigSavedFrame.emit(fh.name())
                 except:
                     self.sigSavedFrame.emit(False)
@@ -185,18 +248,21 @@ class RecordThread(Thread):
                 continue
 
             # Store frame to current (or new) stack
-            recFrames.append((data, info))
+            if self.reducer is None:
+                self.reducer = FrameReducer(**self.reduction)
             self.lastFrameTime = info['time']
+            for data, info in self.reducer.process(data, info):
+                recFrames.append((data, info, frame['frame']))
             
         if len(recFrames) > 0:
             self.writeFrames(recFrames, dh)
-            self.currentFrameNum += len(recFrames)
 
     def writeFrames(self, frames, dh):
         newRec = self.currentStack is None
 
         if newRec:
             self.startFrameTime = frames[0][1]['time']
+            self.stackTelemetry = self.telemetry.stats()
 
         times = [f[1]['time'] for f in frames]
         arrayInfo = [
@@ -207,7 +273,34 @@ class RecordThread(Thread):
         imgs = [f[0][np.newaxis,...] for f in frames]
         
         data = MetaArray(np.concatenate(imgs, axis=0), info=arrayInfo)
+        start = ptime.time()
         if newRec:
-            self.currentStack = dh.writeFile(data, 'video', autoIncrement=True, info=frames[0][1], appendAxis='Time')
+            self.currentStack = dh.writeFile(data, 'video', autoIncrement=True, info=frames[0][1], appendAxis='Time', profile='video')
+            self.stackWriter = MetaArrayStackWriter(self.currentStack.name(), appendAxis='Time')
+        else:
+            self.stackWriter.append(data)
+            self.updateBatchSize(data.nbytes, ptime.time() - start)
+        self.currentFrameNum += len(frames)
+        self.telemetry.frames('disk', [f[2] for f in frames])
+
+    def updateBatchSize(self, nbytes, dt):
+        """Size the next write batch to take about batchTime seconds at the recent
+        write throughput. Larger batches amortize the per-write overhead when the
+        disk falls behind; small batches keep latency low when it keeps up."""
+        if dt <= 0:
+            return
+        rate = nbytes / dt
+        if self.writeRate is None:
+            self.writeRate = rate
         else:
-            data.write(self.currentStack.name(), appendAxis='Time')
+            self.writeRate = 0.8 * self.writeRate + 0.2 * rate
+        self.batchBytes = float(np.clip(self.writeRate * self.batchTime, self.minBatchBytes, self.maxBatchBytes))
+
+    def closeStack(self):
+        """Finish writing the current stack file (the file is not complete until this is called).
+        """
+        if self.stackWriter is not None:
+            try:
+                self.stackWriter.close()
+            finally:
+                self.stackWriter = None
@@ -0,0 +1,146 @@
+"""
+Timing and drop statistics for the live imaging pipeline.
+
+Frames pass through several stages between the camera driver and the disk:
+
+    acquire  - delivered by the device's acquisition thread
+    display  - drawn by FrameDisplay
+    record   - picked up by the RecordThread
+    disk     - written to the current stack file
+
+Each stage reports the frames it handles to a PipelineTelemetry object, which
+keeps the latency of each frame at each stage (measured from the frame's
+'time' as reported by the driver), the effective frame rate of each stage,
+the depth of the queues between stages and the number of dropped frames by
+cause. Frames the display skips on purpose to keep up with the camera are
+counted as 'display' drops; these are not lost data (see lostFrames()).
+Camera devices own one (Camera.telemetry) that is shared with the
+display and recorder in the camera module:
+
+    >>> print man.getDevice('Camera').telemetry.summary()
+"""
+from __future__ import division
+
+import collections
+import acq4.util.ptime as ptime
+from acq4.util.Mutex import Mutex
+
+
+class PipelineTelemetry(object):
+    """Collects per-stage latency, frame rate, queue depth, and drop counts.
+    See module docstring.
+
+    Latency and frame rate are computed over the last *window* seconds; drop
+    counts and maximum queue depths accumulate until reset().
+    """
+
+    stages = ['acquire', 'display', 'record', 'disk']
+
+    ## drop causes that are frames skipped on purpose rather than lost
+    skipCauses = ['display']
+
+    def __init__(self, window=5.0):
+        self.window = window
+        self.lock = Mutex()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.events = dict([(s, collections.deque(maxlen=10000)) for s in self.stages])
+            self.counts = dict([(s, 0) for s in self.stages])
+            self.drops = {}
+            self.queues = {}
+
+    def frame(self, stage, frame, now=None):
+        """Record that *frame* has reached *stage*."""
+        self.frames(stage, [frame], now)
+
+    def frames(self, stage, frames, now=None):
+        """Record that all of *frames* have reached *stage* at the same time."""
+        if now is None:
+            now = ptime.time()
+        with self.lock:
+            events = self.events[stage]
+            for f in frames:
+                events.append((now, now - f.info()['time']))
+            self.counts[stage] += len(frames)
+
+    def drop(self, cause, n=1):
+        """Record that *n* frames were dropped for the reason *cause*
+        (eg. 'camera', 'display', 'record')."""
+        with self.lock:
+            self.drops[cause] = self.drops.get(cause, 0) + n
+
+    def queueDepth(self, queue, depth):
+        """Record the current number of frames waiting in *queue*."""
+        with self.lock:
+            q = self.queues.setdefault(queue, {'current': 0, 'max': 0})
+            q['current'] = depth
+            q['max'] = max(q['max'], depth)
+
+    def stats(self, since=None):
+        """Return a dict of pipeline statistics::
+
+            {'latency': {stage: {'mean': s, 'max': s}, ...},   # over the last *window* seconds
+             'fps': {stage: fps, ...},                         # over the last *window* seconds
+             'frames': {stage: n, ...},
+             'drops': {cause: n, ...},
+             'queues': {queue: {'current': n, 'max': n}, ...}}
+
+        If *since* is a dict previously returned by stats(), frame and drop
+        counts are reported relative to it.
+        """
+        now = ptime.time()
+        with self.lock:
+            latency = {}
+            fps = {}
+            for stage in self.stages:
+                events = self.events[stage]
+                while len(events) > 0 and events[0][0] < now - self.window:
+                    events.popleft()
+                if len(events) == 0:
+                    continue
+                lat = [e[1] for e in events]
+                latency[stage] = {'mean': sum(lat) / len(lat), 'max': max(lat)}
+                if len(events) > 1 and events[-1][0] > events[0][0]:
+                    fps[stage] = (len(events) - 1) / (events[-1][0] - events[0][0])
+            frames = dict(self.counts)
+            drops = dict(self.drops)
+            queues = dict([(k, dict(v)) for k, v in self.queues.items()])
+
+        if since is not None:
+            for k in frames:
+                frames[k] -= since['frames'].get(k, 0)
+            for k in drops:
+                drops[k] -= since['drops'].get(k, 0)
+        return {'latency': latency, 'fps': fps, 'frames': frames, 'drops': drops, 'queues': queues}
+
+    def lostFrames(self, stats=None):
+        """Return the number of frames lost by the camera or recorder (drops
+        other than those in skipCauses)."""
+        if stats is None:
+            stats = self.stats()
+        return sum([n for k, n in stats['drops'].items() if k not in self.skipCauses])
+
+    def summary(self, stats=None):
+        """Return a human-readable, multi-line description of stats()."""
+        if stats is None:
+            stats = self.stats()
+        lines = []
+        for stage in self.stages:
+            line = '%-8s %7d frames' % (stage, stats['frames'].get(stage, 0))
+            if stage in stats['fps']:
+                line += '  %6.1f fps' % stats['fps'][stage]
+            if stage in stats['latency']:
+                lat = stats['latency'][stage]
+                line += '  latency %6.1f ms (max %.1f ms)' % (lat['mean'] * 1e3, lat['max'] * 1e3)
+            lines.append(line)
+        drops = sorted(stats['drops'].items())
+        lost = ', '.join(['%s: %d' % d for d in drops if d[0] not in self.skipCauses])
+        lines.append('dropped  ' + (lost or 'none'))
+        skipped = ', '.join(['%s: %d' % d for d in drops if d[0] in self.skipCauses])
+        if skipped:
+            lines.append('skipped  ' + skipped)
+        queues = ', '.join(['%s: %d (max %d)' % (k, v['current'], v['max']) for k, v in sorted(stats['queues'].items())])
+        lines.append('queues   ' + (queues or 'none'))
+        return '\n'.join(lines)
@@ -0,0 +1,217 @@
+"""
+Random access to recorded camera videos without reading the whole stack.
+
+VideoReader opens a MetaArray video (frames along the first axis, usually
+'Time') and reads frames only as they are indexed:
+
+    video = VideoReader(fileName)
+    frame = video[1000]                     # single frame
+    preview = video[::10]                   # strided playback
+    clip = video.timeRange(2.0, 3.5)        # frames recorded between 2 and 3.5 s
+    for i, frame in video.iterFrames(step=5):
+        ...
+
+Uncompressed stacks (contiguous HDF5 datasets, and old-style .ma files even
+when they were appended in many blocks) are memory-mapped. Chunked or
+compressed HDF5 stacks are decoded one chunk row at a time, keeping the most
+recently used rows so that sequential playback decodes each chunk only once.
+"""
+from __future__ import division
+
+import bisect
+from collections import OrderedDict
+import numpy as np
+from acq4.util.metaarray import MetaArray, HAVE_HDF5
+
+
+class VideoReader(MetaArray):
+    """MetaArray giving frame-indexed access to the video stored in *fileName*.
+    See module docstring.
+
+    *cacheBytes* limits the memory used to cache decoded chunks of compressed files.
+    The *storage* attribute is 'mmap', 'chunked', or 'memory' (for files that can
+    not be read incrementally, which are read entirely).
+    """
+    def __init__(self, fileName, cacheBytes=100e6):
+        self.fileName = fileName
+        with open(fileName, 'rb') as fd:
+            isHDF = fd.read(8) == '\x89HDF\r\n\x1a\n'
+
+        openFile = None
+        if isHDF and HAVE_HDF5:
+            ma = MetaArray(file=fileName, lazy=True)
+            info = ma._info
+            ds = ma._data
+            if ds.chunks is None and ds.dtype != object and ds.id.get_offset() is not None:
+                data = MetaArray.mapHDF5Array(ds)
+                ma.close()
+                self.storage = 'mmap'
+            else:
+                data = FrameCache(ds, cacheBytes)
+                openFile = ma._openFile
+                self.storage = 'chunked'
+        else:
+            layout = None
+            if not isHDF:
+                layout = readLegacyLayout(fileName)
+            if layout is None:
+                ma = MetaArray(file=fileName, readAllData=True)
+                info = ma._info
+                data = ma.asarray()
+                self.storage = 'memory'
+            else:
+                info, dtype, frameShape, blocks = layout
+                data = mapLegacyBlocks(fileName, dtype, frameShape, blocks)
+                self.storage = 'mmap'
+
+        MetaArray.__init__(self, data, info=info, lazy=not isinstance(data, np.ndarray))
+        self._openFile = openFile
+        if self.axisHasValues(0):
+            self.times = self.xvals(0)
+        else:
+            self.times = None
+
+    def frameAt(self, t):
+        """Return the index of the frame being displayed at time *t* (the last
+        frame that started at or before t)."""
+        if self.times is None:
+            raise Exception("Video %s has no frame times." % self.fileName)
+        return int(np.clip(np.searchsorted(self.times, t, side='right') - 1, 0, self.shape[0]-1))
+
+    def timeRange(self, start, stop, step=1):
+        """Return a MetaArray of the frames recorded from *start* up to (but not
+        including) *stop*, in seconds, taking every *step*th frame."""
+        if self.times is None:
+            raise Exception("Video %s has no frame times." % self.fileName)
+        i0 = np.searchsorted(self.times, start, side='left')
+        i1 = np.searchsorted(self.times, stop, side='left')
+        return self[i0:i1:step]
+
+    def iterFrames(self, start=0, stop=None, step=1, blockFrames=32):
+        """Iterate over (index, frame) for frames start:stop:step, reading
+        *blockFrames* frames from disk at a time."""
+        start, stop, step = slice(start, stop, step).indices(self.shape[0])
+        span = blockFrames * step
+        for i in range(start, stop, span):
+            block = self[i:min(i + span, stop):step].asarray()
+            for j in range(block.shape[0]):
+                yield i + j * step, block[j]
+
+
+class FrameCache(object):
+    """Dataset-like wrapper around a chunked HDF5 dataset for use by VideoReader.
+    Single frames are read by decoding the whole row of chunks containing them;
+    the most recently used rows are kept up to a total of *maxBytes*. Other
+    selections are read from the dataset directly."""
+    def __init__(self, dataset, maxBytes):
+        self.dataset = dataset
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.rowFrames = dataset.chunks[0]
+        rowBytes = self.rowFrames * dataset.dtype.itemsize * int(np.prod(dataset.shape[1:]))
+        self.maxRows = max(2, int(maxBytes // max(1, rowBytes)))
+        self.rows = OrderedDict()
+
+    def __getitem__(self, ind):
+        if not isinstance(ind, tuple):
+            ind = (ind,)
+        if len(ind) == 0 or not isinstance(ind[0], (int, long, np.integer)):
+            return self.dataset[ind]
+        row, i = divmod(int(ind[0]), self.rowFrames)
+        data = self.rows.pop(row, None)
+        if data is None:
+            data = self.dataset[row * self.rowFrames:(row+1) * self.rowFrames]
+            if len(self.rows) >= self.maxRows:
+                self.rows.popitem(last=False)
+        self.rows[row] = data
+        return data[(i,) + ind[1:]]
+
+
+class FrameBlocks(object):
+    """Dataset-like object presenting a list of memory-mapped blocks of frames
+    (as written by appending to an old-style .ma file) as a single array."""
+    def __init__(self, blocks, dtype, frameShape):
+        self.blocks = blocks
+        self.starts = []
+        n = 0
+        for b in blocks:
+            self.starts.append(n)
+            n += b.shape[0]
+        self.shape = (n,) + tuple(frameShape)
+        self.dtype = dtype
+
+    def frame(self, i):
+        b = bisect.bisect_right(self.starts, i) - 1
+        return self.blocks[b][i - self.starts[b]]
+
+    def __getitem__(self, ind):
+        if not isinstance(ind, tuple):
+            ind = (ind,)
+        if ind == (Ellipsis,):
+            ind = ()
+        ind = ind + (slice(None),) * (len(self.shape) - len(ind))
+        if isinstance(ind[0], slice):
+            frames = [self.frame(i)[ind[1:]] for i in range(*ind[0].indices(self.shape[0]))]
+            if len(frames) == 0:
+                return np.empty((0,) + np.empty(self.shape[1:])[ind[1:]].shape, dtype=self.dtype)
+            return np.concatenate([f[np.newaxis] for f in frames])
+        return self.frame(int(ind[0]))[ind[1:]]
+
+
+def readLegacyLayout(fileName):
+    """Return (info, dtype, frameShape, blocks) describing the data in an old-style
+    (version 2) .ma file, where blocks is a list of (numFrames, fileOffset) for each
+    contiguous run of frames. Returns None if the file can not be memory-mapped."""
+    with open(fileName, 'rb') as fd:
+        meta = MetaArray._readMeta(fd)
+        if str(meta.get('version', 1)) != '2' or meta['type'] == 'object':
+            return None
+        info = meta['info']
+        dtype = np.dtype(meta['type'])
+        dynAxis = None
+        for i, ax in enumerate(info):
+            if 'values_len' in ax:
+                if ax['values_len'] == 'dynamic':
+                    dynAxis = i
+                else:
+                    ax['values'] = np.fromstring(fd.read(ax['values_len']), dtype=ax['values_type'])
+                    del ax['values_len']
+                    del ax['values_type']
+        if dynAxis is None:
+            shape = tuple(meta['shape'])
+            return info, dtype, shape[1:], [(shape[0], fd.tell())]
+        if dynAxis != 0:
+            return None
+
+        ## frames were appended in blocks, each preceded by a line of block info
+        blocks = []
+        xVals = []
+        while True:
+            line = fd.readline()
+            while line == '\n':
+                line = fd.readline()
+            if line == '':
+                break
+            frameInfo = eval(line)
+            blocks.append((frameInfo['numFrames'], fd.tell()))
+            xVals.extend(frameInfo.get('xVals', []))
+            fd.seek(frameInfo['len'], 1)
+        ax = info[0]
+        if len(xVals) > 0:
+            ax['values'] = np.array(xVals, dtype=ax['values_type'])
+        del ax['values_len']
+        ax.pop('values_type', None)
+        return info, dtype, tuple(meta['shape'][1:]), blocks
+
+
+def mapLegacyBlocks(fileName, dtype, frameShape, blocks):
+    """Memory-map the blocks of frames described by readLegacyLayout."""
+    raw = np.memmap(fileName, dtype=np.uint8, mode='r')
+    frameBytes = dtype.itemsize * int(np.prod(frameShape))
+    arrays = []
+    for nFrames, offset in blocks:
+        arr = raw[offset:offset + nFrames * frameBytes].view(dtype)
+        arrays.append(arr.reshape((nFrames,) + tuple(frameShape)))
+    if len(arrays) == 1:
+        return arrays[0]
+    return FrameBlocks(arrays, dtype, frameShape)
@@ -1,4 +1,4 @@
-import tempfile, shutil, atexit, os
+import tempfile, shutil, atexit, os, sys, time, threading
 import acq4.util.DataManager as dm
 from acq4.util.DirTreeWidget import DirTreeWidget
 import acq4.pyqtgraph as pg
@@ -59,3 +59,239 @@ def test_datamanager():
 
 
 
+
+def test_index_cache():
+    rh = dm.getDirHandle(root)
+    d1 = rh.mkdir('cache_test', info={'x': 1})
+    d1.createFile('file1', info={'y': [1, 2, 3]})
+    indexFile = d1._indexFile()
+    
+    # parsing the index writes a sidecar cache that matches the text index
+    d1._index = None
+    ind = d1._readIndex()
+    cached = dm.readIndexCache(indexFile)
+    assert cached is not None
+    assert cached['file1']['y'] == [1, 2, 3]
+    assert cached['.']['x'] == 1
+    assert dm.INDEX_CACHE_NAME not in d1.ls()
+    
+    # modifying the index invalidates the cache
+    d1.setInfo(x=200)
+    assert dm.readIndexCache(indexFile) is None
+    d1._index = None
+    assert d1.info()['x'] == 200
+    assert dm.readIndexCache(indexFile)['.']['x'] == 200
+
+
+def test_index_journal():
+    rh = dm.getDirHandle(root)
+    d1 = rh.mkdir('journal_test', info={'x': 1})
+    f1 = d1.createFile('file1', info={'y': 1})
+    for i in range(dm.DataManager.journalMinEntries):
+        d1.createFile('file_%d' % i)
+    indexFile = d1._indexFile()
+    indexText = open(indexFile).read()
+
+    # updates to existing entries are journaled rather than rewriting the index
+    f1.setInfo(y=2, z='z')
+    d1.setInfo(x=3)
+    assert open(indexFile).read() == indexText
+    assert os.path.isfile(d1._journalFile())
+    assert dm.INDEX_JOURNAL_NAME not in d1.ls()
+
+    # journal is merged when the index is re-read
+    d1._index = None
+    assert f1.info()['y'] == 2
+    assert f1.info()['z'] == 'z'
+    assert d1.info()['x'] == 3
+    # the index cache still matches the unchanged text index; journal 
+    # records are applied on top of it
+    assert dm.readIndexCache(indexFile)['file1']['y'] == 1
+
+    # compaction folds the journal into the index
+    dm.compactIndexes()
+    assert not os.path.exists(d1._journalFile())
+    d1._index = None
+    assert f1.info()['y'] == 2
+    assert d1.info()['x'] == 3
+    assert dm.readIndexCache(indexFile)['file1']['y'] == 2
+
+
+def test_ls_cache():
+    rh = dm.getDirHandle(root)
+    d1 = rh.mkdir('ls_test')
+    f1 = d1.createFile('b_file', info={'__timestamp__': 10})
+    s1 = d1.mkdir('c_dir')
+    f2 = d1.createFile('a_file', info={'__timestamp__': 5})
+    open(os.path.join(d1.name(), 'unmanaged'), 'w').close()
+    open(os.path.join(d1.name(), '.index.tmp'), 'w').close()  # left by an interrupted index write
+    assert d1.ls(sortMode='date') == ['a_file', 'b_file', 'c_dir', 'unmanaged']
+    assert d1.ls(sortMode='alpha') == ['c_dir', 'a_file', 'b_file', 'unmanaged']
+    assert d1.subDirs() == ['c_dir']
+
+    # cached listings are updated per entry
+    f3 = d1.createFile('d_file', info={'__timestamp__': 7})
+    assert d1.ls(sortMode='date', useCache=True) == ['a_file', 'd_file', 'b_file', 'c_dir', 'unmanaged']
+    assert d1.ls(sortMode='alpha', useCache=True) == ['c_dir', 'a_file', 'b_file', 'd_file', 'unmanaged']
+    f2.rename('e_file')
+    assert d1.ls(sortMode='date', useCache=True) == ['e_file', 'd_file', 'b_file', 'c_dir', 'unmanaged']
+    assert d1.ls(sortMode='alpha', useCache=True) == ['c_dir', 'b_file', 'd_file', 'e_file', 'unmanaged']
+    s1.delete()
+    assert d1.ls(sortMode='date', useCache=True) == ['e_file', 'd_file', 'b_file', 'unmanaged']
+    assert d1.ls(sortMode='date', useCache=True) == d1.ls(sortMode='date')
+
+
+def test_handle_cache():
+    mgr = dm.getDataManager()
+    maxHandles = mgr.maxCachedHandles
+    try:
+        rh = dm.getDirHandle(root)
+        d1 = rh.mkdir('handle_cache_test')
+        for i in range(20):
+            d1.createFile('file_%02d' % i)
+        mgr.configure(maxCachedHandles=5)
+        
+        # only the most recently used handles are held strongly
+        held = dm.getFileHandle(os.path.join(d1.name(), 'file_00'))
+        for i in range(1, 20):
+            dm.getFileHandle(os.path.join(d1.name(), 'file_%02d' % i))
+        stats = mgr.getCacheStats()
+        assert stats['strongHandles'] <= 5
+        assert stats['evictions'] > 0
+        
+        # evicted handles that are still referenced elsewhere are reused
+        hits = stats['hits']
+        assert dm.getFileHandle(os.path.join(d1.name(), 'file_00')) is held
+        assert mgr.getCacheStats()['hits'] == hits + 1
+
+        # hits on handles referenced elsewhere do not grow the cache past its budget
+        held = [dm.getFileHandle(os.path.join(d1.name(), 'file_%02d' % i)) for i in range(20)]
+        for h in held:
+            dm.getFileHandle(h.name())
+        assert mgr.getCacheStats()['strongHandles'] <= 5
+    finally:
+        mgr.configure(maxCachedHandles=maxHandles)
+
+
+def test_watcher():
+    mgr = dm.getDataManager()
+    for mode in ['poll', 'inotify', 'auto']:
+        if mode == 'inotify' and not sys.platform.startswith('linux'):
+            continue
+        mgr.startWatching(mode=mode, interval=0.1)
+        try:
+            rh = dm.getDirHandle(root)
+            d1 = rh.mkdir('watch_test_' + mode)
+            d1.createFile('file1', info={'a': 1})
+            assert d1.ls() == ['file1']
+            assert d1._watched
+
+            # changes made behind the DataManager's back are noticed
+            open(os.path.join(d1.name(), 'file2'), 'w').close()
+            idx = open(d1._indexFile()).read()
+            open(d1._indexFile(), 'w').write(idx.replace('a: 1', 'a: 222'))
+            start = time.time()
+            while time.time() - start < 5:
+                if 'file2' in d1.ls() and d1['file1'].info()['a'] == 222:
+                    break
+                time.sleep(0.05)
+            assert sorted(d1.ls()) == ['file1', 'file2']
+            assert d1['file1'].info()['a'] == 222
+        finally:
+            mgr.stopWatching()
+
+
+def test_watch_network_dirs():
+    # in 'auto' mode, directories on network shares are polled because inotify
+    # does not see changes made by other machines
+    from acq4.util import DirWatcher
+    isNetworkPath = DirWatcher.isNetworkPath
+    watcher = DirWatcher.AutoWatcher(lambda path, name: None)
+    try:
+        DirWatcher.isNetworkPath = lambda path: True
+        assert watcher.watch(root)
+        assert watcher.watchers[root] is watcher.poller
+        assert watcher.watchedPaths() == [root]
+        watcher.unwatch(root)
+        assert watcher.poller.watchedPaths() == []
+    finally:
+        DirWatcher.isNetworkPath = isNetworkPath
+
+
+def test_catalog():
+    from acq4.util.DataCatalog import DataCatalog
+    mgr = dm.getDataManager()
+    catalog = DataCatalog(':memory:', mgr)
+    mgr.setCatalog(catalog)
+    try:
+        rh = dm.getDirHandle(root)
+        day = rh.mkdir('catalog_day', info={'dirType': 'Day', 'temperature': 34})
+        cell1 = day.mkdir('cell_000', info={'dirType': 'Cell', 'type': 'pyramidal'})
+        cell2 = day.mkdir('cell_001', info={'dirType': 'Cell', 'type': 'stellate'})
+        for cell in (cell1, cell2):
+            cell.mkdir('cciv_000', info={'protocol': {}, 'sequenceParams': {}})
+            cell.mkdir('vcss_000', info={'protocol': {}})
+            cell.createFile('notes', info={'rating': 3})
+        
+        found = catalog.find(type='ProtocolSequence', name='cciv*',
+                             ancestors={'Cell': {'type': 'pyramidal'}, 'Day': {'temperature': 34}})
+        assert found == [dm.abspath(os.path.join(cell1.name(), 'cciv_000'))]
+        assert len(catalog.find(type='Protocol', under=day)) == 2
+        assert len(catalog.find(fields={'rating': ('>=', 3)}, under=day)) == 2
+        assert catalog.info(cell2['notes'].name())['rating'] == 3
+        path, info = catalog.parentInfo(os.path.join(cell1.name(), 'vcss_000'), 'Cell')
+        assert path == dm.abspath(cell1.name())
+        assert info['type'] == 'pyramidal'
+        
+        # changes made through handles are propagated
+        cell2['notes'].setInfo(rating=1)
+        assert len(catalog.find(fields={'rating': 3}, under=day)) == 1
+        cell2.rename('cell_002')
+        assert catalog.info(os.path.join(day.name(), 'cell_001')) is None
+        assert catalog.info(os.path.join(day.name(), 'cell_002'))['type'] == 'stellate'
+        assert catalog.find(name='cciv*', ancestors={'Cell': {'type': 'stellate'}}) == [
+            dm.abspath(os.path.join(day.name(), 'cell_002', 'cciv_000'))]
+        cell1['notes'].delete()
+        assert catalog.info(os.path.join(cell1.name(), 'notes')) is None
+        
+        # a fresh catalog can be built by scanning the tree
+        catalog2 = DataCatalog(':memory:', mgr)
+        assert catalog2.rescan(day.name()) == 7
+        assert catalog2.rescan(day.name()) == 0
+        assert catalog2.find(under=day) == catalog.find(under=day)
+        catalog2.close()
+    finally:
+        mgr.setCatalog(None)
+
+
+def test_catalog_swap():
+    # detaching a catalog while it is reading indexes for a flush must not deadlock
+    from acq4.util.DataCatalog import DataCatalog
+    mgr = dm.getDataManager()
+    catalog = DataCatalog(':memory:', mgr)
+    mgr.setCatalog(catalog)
+    rh = dm.getDirHandle(root)
+    rh.mkdir('catalog_swap', info={'a': 1})
+
+    reading = threading.Event()
+    proceed = threading.Event()
+    readIndex = catalog._readIndex
+    def slowRead(dirPath):
+        reading.set()
+        proceed.wait()
+        return readIndex(dirPath)
+    catalog._readIndex = slowRead
+
+    threads = [threading.Thread(target=catalog.flush),
+               threading.Thread(target=mgr.setCatalog, args=(None,))]
+    for t in threads:
+        t.daemon = True
+    threads[0].start()
+    assert reading.wait(5)
+    threads[1].start()
+    time.sleep(0.1)  # setCatalog is now waiting to close the catalog
+    proceed.set()
+    for t in threads:
+        t.join(5)
+        assert not t.is_alive()
+    assert mgr.getCatalog() is None
@@ -0,0 +1,58 @@
+import tempfile, shutil, os, time
+import numpy as np
+from acq4.util.ImagePyramid import ImagePyramid, pyramidFileName, downsample, HAVE_HDF5
+
+root = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(root)
+
+
+def test_downsample():
+    img = np.arange(30, dtype=np.uint16).reshape(5, 6)
+    ds = downsample(img)
+    assert ds.shape == (3, 3)
+    assert ds.dtype == np.uint16
+    assert ds[0, 0] == np.round(img[:2, :2].mean())
+    assert ds[2, 1] == np.round(img[4, 2:4].mean())   # odd edge repeats the last row
+    rgb = np.ones((4, 4, 3), dtype=np.float32)
+    assert downsample(rgb).shape == (2, 2, 3)
+
+
+def test_pyramid():
+    if not HAVE_HDF5:
+        return
+    img = (np.arange(1500)[:, None] + np.arange(1000)[None, :]).astype(np.uint16)
+    fileName = os.path.join(root, 'image.npy')
+    np.save(open(fileName, 'wb'), img)
+    assert ImagePyramid.isLarge(img)
+    assert not ImagePyramid.isLarge(img[:500, :500])
+    assert not ImagePyramid.isLarge(np.zeros((10, 2000, 2000)))
+    assert ImagePyramid.open(fileName) is None
+
+    pyr = ImagePyramid.build(img, fileName)
+    assert os.path.isfile(pyramidFileName(fileName))
+    assert [l.shape for l in pyr.levels] == [(1500, 1000), (750, 500), (375, 250), (188, 125)]
+    assert pyr.levels[0].chunks == (256, 256)
+    assert np.all(pyr.read(0) == img)
+    assert np.all(pyr.read(1) == downsample(img))
+    pyr.close()
+
+    pyr = ImagePyramid.open(fileName)
+    assert pyr.chooseLevel(0.3) == 0
+    assert pyr.chooseLevel(2.5) == 1
+    assert pyr.chooseLevel(100) == 3
+
+    # regions are expanded to whole tiles and clipped to the image
+    assert pyr.tileRegion(0, 300, 10, 600, 20) == (256, 0, 768, 256)
+    assert pyr.tileRegion(1, 1400, 900, 3000, 3000) == (512, 256, 750, 500)
+    assert pyr.tileRegion(0, 2000, 0, 2500, 100) is None
+    region = pyr.tileRegion(2, 0, 0, 1500, 1000)
+    assert np.all(pyr.read(2, region) == pyr.read(2))
+    pyr.close()
+
+    # pyramid is out of date after the image changes
+    time.sleep(0.01)
+    np.save(open(fileName, 'wb'), img[:1200])
+    assert ImagePyramid.open(fileName) is None
@@ -0,0 +1,74 @@
+import tempfile, shutil, os
+import numpy as np
+import acq4.util.DataManager as dm
+from acq4.util.metaarray import MetaArray
+from acq4.util import MetaArrayConverter as conv
+
+root = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(root)
+
+
+def makeData(i):
+    data = np.empty((2, 500), dtype=np.float32)
+    data[0] = np.sin(np.arange(500) * 0.01 * (i+1))
+    data[1] = np.nan if i == 0 else i
+    info = [{'name': 'Channel', 'cols': [{'name': 'primary', 'units': 'A'}, {'name': 'secondary', 'units': 'V'}]},
+            {'name': 'Time', 'values': np.arange(500) * 1e-4, 'units': 's'},
+            {'iteration': i, 'params': {'amp': 1e-12 * i, 'count': i}, 'tags': ('a', 'b')}]
+    return MetaArray(data, info=info)
+
+
+def test_convert_tree():
+    base = dm.getDirHandle(root)
+    d1 = base.mkdir('cell_000', info={'dirType': 'Cell'})
+    d2 = d1.mkdir('protocol_000')
+    for i in range(4):
+        makeData(i).writeMa(os.path.join(d2.name(), 'Clamp%d.ma' % i))
+        d2.indexFile('Clamp%d.ma' % i, info={'note': 'trace %d' % i})
+    makeData(4).writeMa(os.path.join(d1.name(), 'unindexed.ma'))
+    makeData(5).write(os.path.join(d1.name(), 'already.ma'))
+
+    ## simulate conversions interrupted at different stages
+    os.rename(os.path.join(d2.name(), 'Clamp1.ma'), conv.legacyFileName(os.path.join(d2.name(), 'Clamp1.ma')))
+    assert conv.convertFile(os.path.join(d2.name(), 'Clamp2.ma'))['status'] == 'converted'
+    open(conv.tempFileName(os.path.join(d2.name(), 'Clamp3.ma')), 'w').write('partial')
+
+    files = conv.findFiles(root)
+    assert [os.path.relpath(f, root) for f in files] == [
+        os.path.join('cell_000', 'protocol_000', 'Clamp%d.ma' % i) for i in range(4)] + [
+        os.path.join('cell_000', 'unindexed.ma')]
+
+    stats = conv.convertTree(root, processes=2, keepBackup=False)
+    assert stats['converted'] == 5 and stats['failed'] == 0
+    assert stats['bytes'] > 0
+
+    for i in range(4):
+        fileName = os.path.join(d2.name(), 'Clamp%d.ma' % i)
+        assert not conv.isLegacyFile(fileName)
+        ma = MetaArray(file=fileName)
+        assert conv.infoEqual(ma._info, makeData(i)._info)
+        assert np.all((ma.asarray() == makeData(i).asarray()) | np.isnan(ma.asarray()))
+        info = d2['Clamp%d.ma' % i].info()
+        assert info['note'] == 'trace %d' % i
+        assert info['__converted__']['from'] == 'MetaArray 2'
+    assert not conv.isLegacyFile(os.path.join(d1.name(), 'unindexed.ma'))
+    assert [f for f in os.listdir(d2.name()) if f.startswith('.') and f not in ('.index', '.index.journal')] == []
+
+    ## nothing left to do
+    assert conv.findFiles(root) == []
+    assert conv.convertTree(root, processes=0)['converted'] == 0
+
+
+def test_verify():
+    fileName = os.path.join(root, 'verify.ma')
+    makeData(1).write(fileName)
+    conv.verifyFile(fileName, makeData(1))
+    for other in [makeData(2), makeData(1)['Time': 0:0.01]]:
+        try:
+            conv.verifyFile(fileName, other)
+            raise AssertionError("verifyFile() should have raised an exception.")
+        except Exception as exc:
+            assert 'differs' in str(exc) or 'shape' in str(exc)
@@ -0,0 +1,60 @@
+import tempfile, shutil, os
+from collections import OrderedDict
+import numpy as np
+import acq4.util.DataManager as dm
+from acq4.util.metaarray import MetaArray, HAVE_HDF5
+from acq4.util.SequenceView import SequenceView
+
+root = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(root)
+
+
+def makeData(i, j):
+    data = np.empty((2, 100), dtype=np.float32)
+    data[0] = i * 1000 + j * 100 + np.arange(100)
+    data[1] = -data[0]
+    info = [{'name': 'Channel', 'cols': [{'name': 'primary'}, {'name': 'secondary'}]},
+            {'name': 'Time', 'values': np.arange(100) * 1e-3, 'units': 's'},
+            {'iteration': (i, j)}]
+    return MetaArray(data, info=info)
+
+
+def test_sequence_view():
+    params = OrderedDict([(('Clamp1', 'amp'), [-10e-12, 0, 10e-12]), (('Laser', 'power'), [1, 2])])
+    seq = dm.getDirHandle(root).mkdir('seq_000', info={'dirType': 'ProtocolSequence', 'sequenceParams': params})
+    for i in range(3):
+        for j in range(2):
+            if (i, j) == (2, 1):
+                continue  # sequence aborted before the last iteration
+            sub = seq.mkdir('%03d_%03d' % (i, j), info={'dirType': 'Protocol'})
+            makeData(i, j).write(os.path.join(sub.name(), 'Clamp1.ma'))
+            sub.indexFile('Clamp1.ma')
+
+    view = SequenceView(seq, 'Clamp1.ma')
+    assert view.shape == (3, 2, 2, 100)
+    assert np.all(view.xvals(('Clamp1', 'amp')) == params[('Clamp1', 'amp')])
+
+    trace = view[('Clamp1', 'amp'): 1, ('Laser', 'power'): 0, 'Channel': 'primary']
+    assert np.all(trace.asarray() == makeData(1, 0)['primary'].asarray())
+    assert np.all(trace.xvals('Time') == np.arange(100) * 1e-3)
+
+    window = view['Channel': 'secondary', 'Time': 0.01:0.02]
+    assert window.shape == (3, 2, 10)
+    assert window[0, 1, 0] == -(100 + 10)
+    assert np.all(np.isnan(window[2, 1]))
+
+    full = view.asarray()
+    assert full.shape == (3, 2, 2, 100)
+    assert full[1, 1, 0, 5] == 1105
+
+    if HAVE_HDF5 and hasattr(__import__('h5py'), 'VirtualLayout'):
+        vfile = os.path.join(root, 'seq_000_virtual.ma')
+        SequenceView(seq, 'Clamp1.ma').writeVirtual(vfile)
+        virt = MetaArray(file=vfile)
+        assert virt.shape == (3, 2, 2, 100)
+        assert np.all(virt.asarray()[:2] == full[:2])
+        assert np.all(np.isnan(virt.asarray()[2, 1]))
+        assert virt.listColumns('Channel') == ['primary', 'secondary']
@@ -0,0 +1,107 @@
+import time, threading
+import numpy as np
+from acq4.util.StorageQueue import StorageQueue
+
+
+class FakeHandle(object):
+    """Records the calls made to it; writes take *delay* seconds. If *gate* is
+    given, failing writes wait for it to be set before raising."""
+    def __init__(self, name, log, delay=0.0, gate=None):
+        self._name = name
+        self.log = log
+        self.delay = delay
+        self.gate = gate
+
+    def name(self):
+        return self._name
+
+    def writeFile(self, data, fileName, info=None):
+        time.sleep(self.delay)
+        if data is None:
+            if self.gate is not None:
+                self.gate.wait()
+            raise Exception("no data")
+        self.log.append((self._name, 'writeFile', fileName))
+        return FakeHandle(self._name + '/' + fileName, self.log, self.delay)
+
+    def mkdir(self, dirName):
+        self.log.append((self._name, 'mkdir', dirName))
+        return FakeHandle(self._name + '/' + dirName, self.log, self.delay)
+
+    def setInfo(self, *args, **kwds):
+        self.log.append((self._name, 'setInfo', kwds))
+
+
+def test_ordering():
+    log = []
+    q = StorageQueue(threads=3)
+    for i in range(5):
+        dh = q.handle(FakeHandle('dir%d' % i, log, delay=0.01))
+        dh.setInfo(iteration=i)
+        sub = dh.mkdir('Camera')
+        sub.writeFile(np.zeros(10), 'frames').setInfo(written=True)
+        dh.writeFile(np.zeros(10), 'Clamp1.ma')
+    q.flush()
+    assert len(log) == 25
+    for i in range(5):
+        ops = [l for l in log if l[0].startswith('dir%d' % i)]
+        assert ops == [
+            ('dir%d' % i, 'setInfo', {'iteration': i}),
+            ('dir%d' % i, 'mkdir', 'Camera'),
+            ('dir%d/Camera' % i, 'writeFile', 'frames'),
+            ('dir%d/Camera/frames' % i, 'setInfo', {'written': True}),
+            ('dir%d' % i, 'writeFile', 'Clamp1.ma'),
+        ]
+    stats = q.getStats()
+    assert stats['depth'] == 0
+    assert stats['written'] == 25
+    assert stats['meanLatency'] > 0
+
+
+def test_backpressure():
+    log = []
+    q = StorageQueue(threads=1, maxMemory=2500)
+    data = np.zeros(1000, dtype=np.uint8)
+    for i in range(6):
+        q.handle(FakeHandle('dir%d' % i, log, delay=0.05)).writeFile(data, 'data')
+        assert q.getStats()['queuedBytes'] <= 2500
+    q.flush()
+    stats = q.getStats()
+    assert stats['maxBytes'] <= 2500
+    assert stats['blockedTime'] > 0
+    assert len(log) == 6
+
+
+def test_errors():
+    log = []
+    q = StorageQueue()
+    gate = threading.Event()
+    dh = q.handle(FakeHandle('dir', log, gate=gate))
+    dh.writeFile(None, 'bad')
+    dh.writeFile(np.zeros(3), 'good')
+    gate.set()
+    try:
+        q.flush()
+        raise AssertionError("flush() should have raised an exception.")
+    except Exception as exc:
+        assert 'no data' in str(exc)
+    assert log == [('dir', 'writeFile', 'good')]
+    assert q.getStats()['failed'] == 1
+    q.flush()  # error is only reported once
+
+    # a failed write does not prevent later writes from being queued
+    dh.writeFile(None, 'bad2')
+    while q.getStats()['failed'] < 2:
+        time.sleep(0.01)
+    dh.writeFile(np.zeros(3), 'good2')
+    try:
+        q.flush()
+        raise AssertionError("flush() should have raised an exception.")
+    except Exception as exc:
+        assert 'no data' in str(exc)
+    assert log[-1] == ('dir', 'writeFile', 'good2')
+
+    # other methods wait for queued writes, then go to the real handle
+    dh.writeFile(np.zeros(3), 'later')
+    assert dh.name() == 'dir'
+    assert log[-1] == ('dir', 'writeFile', 'later')
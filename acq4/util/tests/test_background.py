@@ -0,0 +1,107 @@
+import time
+import numpy as np
+from acq4.util.imaging.background import BackgroundModel
+
+
+def test_mean():
+    frames = np.random.randint(0, 1000, size=(5, 20, 30)).astype(np.uint16)
+    model = BackgroundModel('mean')
+    assert model.background() is None
+    for f in frames:
+        model.addFrame(f)
+    bg = model.background()
+    assert bg.dtype == np.float32
+    assert np.allclose(bg, frames.mean(axis=0), rtol=1e-5)
+
+    ## updates happen in place
+    model.addFrame(frames[0], weight=0.5)
+    assert model.background() is bg
+    assert np.allclose(bg, 0.5 * frames.mean(axis=0) + 0.5 * frames[0], rtol=1e-5)
+
+    ## new shape restarts the model
+    model.addFrame(np.ones((4, 4)))
+    assert model.frameCount == 1 and np.all(model.background() == 1)
+
+
+def test_rolling():
+    frames = np.random.normal(size=(20, 10, 12)).astype(np.float32)
+    model = BackgroundModel('median', window=1.0, ringSize=8, updateInterval=0.5)
+    for i, f in enumerate(frames):
+        model.addFrame(f, now=i * 0.0625)  # two frames per ring slot
+    bg = model.background(now=10.0)
+    assert np.allclose(bg, np.median(frames[4::2], axis=0))
+
+    ## not recomputed until updateInterval has passed
+    model.addFrame(frames[0] + 100, now=10.0)
+    assert model.background(now=10.1) is bg
+    assert model.background(now=10.6) is not bg
+
+    model = BackgroundModel('percentile', window=1.0, ringSize=4, percentile=10.)
+    for i, f in enumerate(frames[:4]):
+        model.addFrame(f, now=i)
+    assert np.allclose(model.background(now=0), np.percentile(frames[:4], 10, axis=0))
+
+
+def test_rolling_offline():
+    ## with updateInterval=0 (eg. rollingF0Image), the background is recomputed
+    ## exactly when the ring changes, however long the computation takes
+    frames = np.random.normal(size=(100, 8, 8)).astype(np.float32)
+    model = BackgroundModel('percentile', window=1.0, ringSize=16, percentile=10., updateInterval=0.)
+    bg = None
+    for i, f in enumerate(frames):
+        lastRingTime = model._lastRingTime
+        model.addFrame(f, now=i * 0.01)
+        newBg = model.background(now=i * 0.01)
+        if model._lastRingTime != lastRingTime:
+            assert newBg is not bg
+            assert np.allclose(newBg, np.percentile(model._ring[:model._ringCount], 10, axis=0))
+        else:
+            assert newBg is bg
+        bg = newBg
+
+
+def waitForCompute(model):
+    start = time.time()
+    while model._computeThread is not None and time.time() - start < 5:
+        time.sleep(0.01)
+    assert model._computeThread is None
+
+
+def test_threaded():
+    frames = np.random.normal(size=(4, 10, 12)).astype(np.float32)
+    model = BackgroundModel('median', window=1.0, ringSize=4, updateInterval=0., threaded=True)
+    for i, f in enumerate(frames):
+        model.addFrame(f, now=i)
+    ## the median is computed in another thread; nothing is available until it finishes
+    assert model.background(now=4) is None
+    waitForCompute(model)
+    bg = model.background(now=4)
+    assert np.allclose(bg, np.median(frames, axis=0))
+
+    ## results of a computation started before reset() are discarded
+    model.addFrame(frames[0] + 100, now=5)
+    assert model.background(now=5) is bg
+    model.reset()
+    model.addFrame(np.ones((3, 3), dtype=np.float32), now=6)
+    waitForCompute(model)
+    assert model.background(now=6) is None
+    waitForCompute(model)
+    assert np.all(model.background(now=6) == 1)
+
+
+def test_blur():
+    img = np.zeros((40, 40), dtype=np.float32)
+    img[20, 20] = 100
+    model = BackgroundModel('mean', blur=2.0, updateInterval=0.5)
+    model.addFrame(img, now=0)
+    b1 = model.blurredBackground(now=0)
+    assert b1[20, 20] < 100 and abs(b1.sum() - 100) < 1e-3
+    first = b1.copy()
+
+    ## cached until updateInterval has passed
+    model.addFrame(img * 3, weight=0.5, now=0.1)
+    assert np.all(model.blurredBackground(now=0.1) == first)
+    assert np.allclose(model.blurredBackground(now=0.7).sum(), 200, rtol=1e-4)
+
+    model.setBlur(0)
+    assert model.blurredBackground() is model.background()
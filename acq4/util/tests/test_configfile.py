@@ -0,0 +1,49 @@
+import numpy as np
+from acq4.util import configfile
+
+
+text = """
+key: 'value'
+key2:              ##comment
+                   ##comment
+    key21: 'value' ## comment
+    key22: [1,2,3]
+    key23: 234  #comment
+    empty:
+    key24: (1, -2.5e-3, u'x\\'y', "q")
+(1, 2): 10*mV
+neg: -3
+unit: -5*pA
+t: ()
+t1: (1,)
+d: {'a': [1, {'b': None}], 2: True}
+arr: array([1, 2], dtype=int32)
+expr: 2**3 * ms
+last:
+    x: 1e5
+    sub:
+        y: OrderedDict([('a', 1)])
+"""
+
+
+def test_fast_parser():
+    a = configfile.parseString(text)[1]
+    b = configfile.parseStringFast(text)
+    assert list(a.keys()) == list(b.keys())
+    for k in a:
+        if k == 'arr':
+            assert b[k].dtype == np.int32
+            assert np.all(a[k] == b[k])
+        else:
+            assert a[k] == b[k]
+            assert type(a[k]) is type(b[k])
+            
+
+def test_fast_parser_errors():
+    for bad in ["a: 1\n  b: 2", "a 1", ": 1", "a: (1,"]:
+        try:
+            configfile.parseStringFast(bad)
+        except configfile.ParseError:
+            pass
+        else:
+            raise AssertionError("Expected ParseError for %r" % bad)
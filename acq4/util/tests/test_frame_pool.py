@@ -0,0 +1,38 @@
+import numpy as np
+from acq4.util.imaging.frame_pool import FramePool
+
+
+def test_frame_pool():
+    pool = FramePool(size=3)
+    held = []
+    for i in range(3):
+        buf = pool.acquire((4, 5), np.uint16)
+        assert buf.shape == (4, 5) and buf.dtype == np.uint16
+        held.append(buf)
+    ids = map(id, held)
+    assert len(set(ids)) == 3
+    assert pool.stats()['inUse'] == 3
+    assert pool.stats()['pressure'] == 1.0
+
+    ## pool exhausted; frame is allocated separately
+    extra = pool.acquire((4, 5), np.uint16)
+    assert id(extra) not in ids
+    assert pool.stats()['overruns'] == 1
+
+    ## views keep the lease, copies do not
+    view = held[1][1:3]
+    copy = held[2].copy()
+    del held[1:], buf
+    assert pool.stats()['inUse'] == 2
+    assert id(pool.acquire((4, 5), np.uint16)) == ids[2]
+    del view
+    assert id(pool.acquire((4, 5), np.uint16)) == ids[1]
+
+    stats = pool.stats()
+    assert stats['frames'] == 6 and stats['overruns'] == 1 and stats['maxInUse'] == 3
+
+    ## new shape reallocates the pool
+    buf = pool.acquire((2, 2), np.float32)
+    assert buf.shape == (2, 2) and buf.dtype == np.float32
+    pool.resetCounters()
+    assert pool.stats()['frames'] == 0 and pool.stats()['overruns'] == 0
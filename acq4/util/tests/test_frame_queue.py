@@ -0,0 +1,104 @@
+import threading, time
+import numpy as np
+from acq4.util.imaging.frame_queue import FrameQueue
+
+
+class MockFrame(object):
+    def __init__(self, i, shape=(10, 10)):
+        self._data = np.empty(shape, dtype=np.uint16)
+        self._data[:] = i
+        self._info = {'time': i}
+
+    def info(self):
+        return self._info
+
+    def getImage(self):
+        return self._data
+
+
+def rec(i):
+    return {'frame': MockFrame(i), 'stack': True}
+
+
+def test_drop():
+    ## each frame is 200 bytes; the budget holds 2
+    q = FrameQueue(maxBytes=400, policy='drop')
+    assert [q.put(rec(i)) for i in range(4)] == [True, True, False, False]
+    assert q.put(False)  # markers are never dropped
+    assert q.put(rec(4), force=True)
+    assert q.stats() == {'frames': 4, 'bytes': 600, 'spilled': 0, 'dropped': 2}
+
+    items = q.get(maxBytes=400)
+    assert [f['frame'].info()['time'] for f in items[:2]] == [0, 1]
+    assert items[2] is False  # takes no space in the batch
+    items = q.get(maxBytes=400)
+    assert len(items) == 1 and items[0]['frame'].info()['time'] == 4
+    assert q.get(timeout=0.01) == []
+    assert q.stats()['bytes'] == 0
+
+    ## a single frame is returned even if it exceeds maxBytes
+    q.put(rec(5))
+    assert len(q.get(maxBytes=10)) == 1
+
+
+def test_spill():
+    q = FrameQueue(maxBytes=400, policy='spill')
+    for i in range(6):
+        assert q.put(rec(i))
+    assert q.stats()['spilled'] == 4
+    assert q.stats()['bytes'] == 400
+    items = q.get()
+    assert len(items) == 6
+    for i, item in enumerate(items):
+        data = item['frame'].getImage()
+        assert data.shape == (10, 10) and data.dtype == np.uint16
+        assert np.all(data == i)
+        assert item['frame'].info()['time'] == i
+    assert q.spillFile.size == 0  # truncated after all spilled frames were read
+
+    ## the spill file is reused for later frames
+    for i in range(3):
+        q.put(rec(i))
+    assert q.stats()['spilled'] == 1
+    assert np.all(q.get()[2]['frame'].getImage() == 2)
+
+
+def test_block():
+    q = FrameQueue(maxBytes=400, policy='block', blockTimeout=None)
+    q.put(rec(0))
+    q.put(rec(1))
+    got = []
+    def consume():
+        time.sleep(0.05)
+        got.extend(q.get(maxBytes=200))
+    t = threading.Thread(target=consume)
+    t.start()
+    ## put() never waits; producers wait for room before creating the next frame
+    start = time.time()
+    assert q.waitForRoom(200)
+    assert time.time() - start > 0.03
+    assert q.put(rec(2))
+    t.join()
+    assert [f['frame'].info()['time'] for f in got] == [0]
+
+    ## frames that do not fit are dropped
+    assert not q.waitForRoom(200, timeout=0.01)
+    assert not q.put(rec(3))
+    assert q.stats()['dropped'] == 1
+
+    ## waiting also ends when the producer is told to stop
+    stop = threading.Event()
+    threading.Timer(0.05, stop.set).start()
+    start = time.time()
+    assert not q.waitForRoom(200, timeout=None, until=stop.is_set)
+    assert 0.04 < time.time() - start < 1.0
+
+    ## closing wakes the consumer and returns the frames that were waiting
+    t = threading.Thread(target=lambda: got.append(q.get()))
+    left = q.close()
+    assert len(left) == 2
+    t.start()
+    t.join()
+    assert got[-1] is None
+    assert not q.put(rec(4))
+    assert not q.waitForRoom(200)
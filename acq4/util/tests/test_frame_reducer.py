@@ -0,0 +1,54 @@
+import numpy as np
+from acq4.util.imaging.frame_reducer import FrameReducer, binFrame
+
+
+def frames(n, shape=(8, 6)):
+    for i in range(n):
+        data = np.arange(np.prod(shape), dtype=np.uint16).reshape(shape) + i
+        yield data, {'time': i * 0.1, 'region': [10, 20, 8, 6], 'binning': [1, 1]}
+
+
+def test_identity():
+    r = FrameReducer()
+    assert r.isIdentity()
+    data, info = next(frames(1))
+    out = r.process(data, info)
+    assert out[0][0] is data and out[0][1] is info
+
+
+def test_bin():
+    data = np.arange(30, dtype=np.uint16).reshape(5, 6)
+    b = binFrame(data, 2)
+    assert b.shape == (2, 3) and b.dtype == np.float32
+    assert b[0, 0] == (0 + 1 + 6 + 7) / 4.
+    assert b[1, 2] == (16 + 17 + 22 + 23) / 4.
+
+
+def test_reduce():
+    r = FrameReducer(average=3, binning=2, region=(2, 0, 4, 6))
+    out = []
+    for data, info in frames(7):
+        out.extend(r.process(data, info))
+    assert len(out) == 2  # the 7th frame waits for two more
+
+    raw = [d for d, i in frames(6)]
+    for k, (data, info) in enumerate(out):
+        assert data.shape == (2, 3) and data.dtype == np.uint16
+        expect = binFrame(np.mean(raw[k*3:k*3+3], axis=0)[2:6], 2)
+        assert np.all(data == np.round(expect))
+        assert abs(info['time'] - (k * 3 + 1) * 0.1) < 1e-9
+        assert info['region'] == [12, 20, 4, 6]
+        assert info['binning'] == [2, 2]
+        assert info['reduction'] == {'average': 3, 'binning': 2, 'region': (2, 0, 4, 6), 'dtype': None, 'scale': 1.0}
+
+    ## reset discards the partial average
+    r.reset()
+    assert r.process(*next(frames(1))) == []
+
+
+def test_dtype():
+    r = FrameReducer(dtype='uint8', scale=0.5)
+    data = np.array([[0, 101, 600]], dtype=np.uint16)
+    out = r.process(data, {'time': 0})[0][0]
+    assert out.dtype == np.uint8
+    assert list(out[0]) == [0, 50, 255]  # 50.5 rounds to even
@@ -0,0 +1,148 @@
+import tempfile, shutil, os
+import numpy as np
+from acq4.util.metaarray import MetaArray, MetaArrayStackWriter, HAVE_HDF5, chunkShape
+
+root = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(root)
+
+
+def makeFrames(start, n):
+    data = np.arange(start*12, (start+n)*12, dtype=np.uint16).reshape(n, 3, 4)
+    info = [{'name': 'Time', 'values': np.arange(start, start+n) * 0.1, 'units': 's'},
+            {'name': 'X'}, {'name': 'Y'}, {'exposure': 0.01}]
+    return MetaArray(data, info=info)
+
+
+def test_stack_writer():
+    fileName = os.path.join(root, 'stack.ma')
+    writer = MetaArrayStackWriter(fileName, appendAxis='Time', data=makeFrames(0, 3), growStep=4)
+    for i in range(3, 20, 2):
+        writer.append(makeFrames(i, 2))
+    writer.close()
+
+    ma = MetaArray(file=fileName)
+    assert ma.shape == (21, 3, 4)
+    assert np.all(ma.asarray() == makeFrames(0, 21).asarray())
+    assert np.allclose(ma.xvals('Time'), np.arange(21) * 0.1)
+    assert ma._info[-1]['exposure'] == 0.01
+
+    # reopen an existing file and continue appending
+    with MetaArrayStackWriter(fileName, appendAxis='Time') as writer:
+        writer.append(makeFrames(21, 5))
+    ma = MetaArray(file=fileName)
+    assert ma.shape == (26, 3, 4)
+    assert np.allclose(ma.xvals('Time'), np.arange(26) * 0.1)
+
+
+def test_lazy():
+    fileName = os.path.join(root, 'lazy.ma')
+    data = np.random.normal(size=(2, 1000)).astype(np.float32)
+    info = [{'name': 'Channel', 'cols': [{'name': 'primary', 'units': 'A'}, {'name': 'secondary', 'units': 'V'}]},
+            {'name': 'Time', 'values': np.arange(1000) * 1e-3, 'units': 's'},
+            {'rate': 1000.}]
+    MetaArray(data, info=info).write(fileName)
+    full = MetaArray(file=fileName)
+    lazy = MetaArray(file=fileName, lazy=True)
+    assert lazy.shape == full.shape
+    
+    for sl in [slice('Channel', 'primary'), slice('Time', 0.1, 0.25), slice('Time', None, 0.05),
+               slice(1, 500), slice('Time', [3, 1, 900])]:
+        a = full[sl]
+        b = lazy[sl]
+        assert np.all(a.asarray() == b.asarray())
+        assert a.listColumns() == b.listColumns()
+        if a.axisHasValues('Time'):
+            assert np.all(a.xvals('Time') == b.xvals('Time'))
+    
+    assert np.all(lazy[:, ::-3].asarray() == full[:, ::-3].asarray())
+    assert np.all(lazy[:, np.arange(1000) % 7 == 0].asarray() == full[:, np.arange(1000) % 7 == 0].asarray())
+    assert lazy[1, -1] == full[1, -1]
+    assert lazy['Channel': 'secondary']['Time': 0.5:0.6].shape == (100,)
+    
+    # reductions read the data they need without loading the whole array
+    assert np.allclose(lazy.mean(axis='Time').asarray(), full.mean(axis='Time').asarray())
+    assert np.all(lazy.max(axis=0).asarray() == full.max(axis=0).asarray())
+    assert lazy.min() == full.min()
+
+    # the whole array is loaded only when needed
+    if HAVE_HDF5:
+        assert not isinstance(lazy._data, np.ndarray)
+    assert np.all((lazy * 2).asarray() == full.asarray() * 2)
+    assert isinstance(lazy._data, np.ndarray)
+
+
+def test_chunk_shape():
+    # whole frames, as many as fit
+    assert chunkShape((100, 512, 512), 2, 4e6, access='frames') == (7, 512, 512)
+    assert chunkShape((5, 512, 512), 2, 4e6, access='frames', appendAxis=0) == (7, 512, 512)
+    # large frames are split along rows
+    assert chunkShape((100, 4096, 4096), 2, 4e6, access='frames') == (1, 488, 4096)
+    # one column, long runs of samples
+    assert chunkShape((2, 200000), 4, 256e3, access='columns', columnAxes=[0]) == (1, 64000)
+    assert chunkShape((2, 1000), 4, 256e3, access='columns', columnAxes=[0]) == (1, 1000)
+    # roughly cubical blocks
+    assert chunkShape((20, 256, 256), 4, 1e6, access='blocks') == (20, 112, 111)
+
+    fileName = os.path.join(root, 'profile.ma')
+    makeFrames(0, 10).write(fileName, profile='video')
+    ma = MetaArray(file=fileName)
+    assert np.all(ma.asarray() == makeFrames(0, 10).asarray())
+    if HAVE_HDF5:
+        import h5py
+        f = h5py.File(fileName, 'r')
+        assert f['data'].chunks == (10, 3, 4)
+        f.close()
+
+
+def test_parallel_chunk_writer():
+    if not HAVE_HDF5:
+        return
+    import h5py
+    from acq4.util.metaarray import ParallelChunkWriter
+    data = np.random.randint(0, 1000, size=(23, 10, 7)).astype(np.uint16)
+    
+    fileName = os.path.join(root, 'parallel.ma')
+    info = [{'name': 'Time', 'values': np.arange(3) * 0.1}, {'name': 'X'}, {'name': 'Y'}, {}]
+    ## chunks do not evenly divide the frame, and the first block ends mid-chunk
+    MetaArray(data[:3], info=info).write(fileName, appendAxis='Time', compression='gzip', chunks=(4, 4, 5))
+    writer = MetaArrayStackWriter(fileName, appendAxis='Time', workers=3, growStep=4)
+    assert writer.chunkWriter is not None
+    for i in range(3, 23, 3):
+        info[0]['values'] = np.arange(i, min(i+3, 23)) * 0.1
+        writer.append(MetaArray(data[i:i+3], info=info))
+    writer.close()
+
+    ma = MetaArray(file=fileName)
+    assert ma.shape == data.shape
+    assert np.all(ma.asarray() == data)
+    assert np.allclose(ma.xvals('Time'), np.arange(23) * 0.1)
+    
+    ## byte shuffling, appending along another axis
+    f = h5py.File(os.path.join(root, 'shuffle.h5'), 'w')
+    ds = f.create_dataset('data', shape=(10, 23, 7), dtype=np.float32, chunks=(3, 4, 7), 
+                          compression='gzip', shuffle=True, maxshape=(10, None, 7))
+    writer = ParallelChunkWriter(ds, 1, 2)
+    data = np.random.normal(size=(10, 23, 7)).astype(np.float32)
+    for i in range(0, 23, 5):
+        writer.write(i, data[:, i:i+5])
+    writer.close()
+    assert np.all(ds[:] == data)
+    f.close()
+
+    ## the caller may reuse its array as soon as write() returns
+    f = h5py.File(os.path.join(root, 'reuse.h5'), 'w')
+    ds = f.create_dataset('data', shape=(23, 10, 7), dtype=np.uint16, chunks=(4, 4, 7), compression='gzip')
+    writer = ParallelChunkWriter(ds, 0, 2)
+    data = np.random.randint(0, 1000, size=(23, 10, 7)).astype(np.uint16)
+    buf = np.empty((5, 10, 7), dtype=np.uint16)
+    for i in range(0, 23, 5):
+        n = min(5, 23 - i)
+        buf[:n] = data[i:i+n]
+        writer.write(i, buf[:n])
+        buf[:] = 0
+    writer.close()
+    assert np.all(ds[:] == data)
+    f.close()
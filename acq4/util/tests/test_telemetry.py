@@ -0,0 +1,54 @@
+from acq4.util.imaging.telemetry import PipelineTelemetry
+
+
+class MockFrame(object):
+    def __init__(self, t):
+        self._info = {'time': t}
+
+    def info(self):
+        return self._info
+
+
+def test_telemetry():
+    tel = PipelineTelemetry(window=10.0)
+    frames = [MockFrame(100.0 + i * 0.1) for i in range(10)]
+    for i, f in enumerate(frames):
+        tel.frame('acquire', f, now=f.info()['time'] + 0.01)
+        if i % 2 == 0:
+            tel.frame('display', f, now=f.info()['time'] + 0.03)
+    tel.frames('disk', frames[:5], now=101.5)
+    tel.drop('camera', 3)
+    tel.drop('display', 5)
+    tel.queueDepth('record', 4)
+    tel.queueDepth('record', 1)
+
+    ## ptime.time() is far later than the frame times above; use a long window
+    tel.window = 1e12
+    stats = tel.stats()
+    assert stats['frames'] == {'acquire': 10, 'display': 5, 'record': 0, 'disk': 5}
+    assert abs(stats['latency']['acquire']['mean'] - 0.01) < 1e-9
+    assert abs(stats['latency']['display']['max'] - 0.03) < 1e-9
+    assert abs(stats['latency']['disk']['max'] - 1.5) < 1e-9
+    assert abs(stats['fps']['acquire'] - 10) < 1e-6
+    assert abs(stats['fps']['display'] - 5) < 1e-6
+    assert 'disk' not in stats['fps']  # all at the same time
+    assert stats['drops'] == {'camera': 3, 'display': 5}
+    assert stats['queues'] == {'record': {'current': 1, 'max': 4}}
+
+    tel.drop('camera', 2)
+    tel.frame('acquire', frames[0])
+    since = tel.stats(since=stats)
+    assert since['drops'] == {'camera': 2, 'display': 0}
+    assert since['frames']['acquire'] == 1
+
+    ## display drops are skipped frames, not lost ones
+    assert tel.lostFrames() == 5
+    text = tel.summary()
+    assert 'dropped  camera: 5\n' in text and 'skipped  display: 5' in text
+    assert 'record: 1 (max 4)' in text
+
+    ## old events fall out of the window
+    tel.window = 5.0
+    assert list(tel.stats()['latency']) == ['acquire']
+    tel.reset()
+    assert tel.stats()['drops'] == {} and tel.stats()['frames']['acquire'] == 0
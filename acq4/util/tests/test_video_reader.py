@@ -0,0 +1,79 @@
+import tempfile, shutil, os
+import numpy as np
+from acq4.util.metaarray import MetaArray, MetaArrayStackWriter, HAVE_HDF5
+from acq4.util.imaging.video_reader import VideoReader
+
+root = tempfile.mkdtemp()
+
+
+def teardown_module():
+    shutil.rmtree(root)
+
+
+def makeFrames(start, n):
+    data = np.arange(start*20, (start+n)*20, dtype=np.uint16).reshape(n, 4, 5)
+    info = [{'name': 'Time', 'values': np.arange(start, start+n) * 0.1, 'units': 's'},
+            {'name': 'X'}, {'name': 'Y'}, {'exposure': 0.01}]
+    return MetaArray(data, info=info)
+
+
+def checkVideo(video, n):
+    full = makeFrames(0, n).asarray()
+    assert video.shape == (n, 4, 5)
+    assert np.all(video[7].asarray() == full[7])
+    assert np.all(video[n-1].asarray() == full[-1])
+    assert np.all(video[3].asarray() == full[3])    # out of order access
+    assert np.all(video[2:n:3].asarray() == full[2::3])
+    assert np.all(video[::-1].asarray() == full[::-1])
+    assert np.all(video.max(axis=0).asarray() == full.max(axis=0))
+    assert np.allclose(video.mean(axis='Time').asarray(), full.mean(axis=0))
+    assert np.allclose(video.xvals('Time'), np.arange(n) * 0.1)
+    assert video._info[-1]['exposure'] == 0.01
+
+    assert video.frameAt(0.55) == 5
+    assert video.frameAt(100) == n - 1
+    clip = video.timeRange(0.5, 1.0)
+    assert np.all(clip.asarray() == full[5:10])
+    assert np.allclose(clip.xvals('Time'), np.arange(5, 10) * 0.1)
+
+    frames = list(video.iterFrames(1, 20, 4, blockFrames=2))
+    assert [i for i, f in frames] == list(range(1, 20, 4))
+    assert all([np.all(f == full[i]) for i, f in frames])
+
+
+def test_legacy():
+    # one block
+    fileName = os.path.join(root, 'legacy.ma')
+    makeFrames(0, 30).writeMa(fileName)
+    video = VideoReader(fileName)
+    assert video.storage == 'mmap'
+    checkVideo(video, 30)
+
+    # appended in many blocks
+    fileName = os.path.join(root, 'legacy_appended.ma')
+    for i in range(0, 30, 4):
+        makeFrames(i, min(4, 30-i)).writeMa(fileName, appendAxis='Time')
+    video = VideoReader(fileName)
+    assert video.storage == 'mmap'
+    checkVideo(video, 30)
+
+
+def test_hdf5():
+    if not HAVE_HDF5:
+        return
+    fileName = os.path.join(root, 'contiguous.ma')
+    makeFrames(0, 30).write(fileName, mappable=True)
+    video = VideoReader(fileName)
+    assert video.storage == 'mmap'
+    checkVideo(video, 30)
+
+    fileName = os.path.join(root, 'recorded.ma')
+    writer = MetaArrayStackWriter(fileName, appendAxis='Time', data=makeFrames(0, 3), compression='gzip', chunks=(4, 4, 5))
+    for i in range(3, 30, 3):
+        writer.append(makeFrames(i, 3))
+    writer.close()
+    video = VideoReader(fileName, cacheBytes=500)
+    assert video.storage == 'chunked'
+    checkVideo(video, 30)
+    assert len(video._data.rows) <= video._data.maxRows
+    video.close()
@@ -0,0 +1,55 @@
+"""
+Benchmark the 'eval' and 'fast' configfile parser engines on a synthetic
+.index file resembling a large TaskRunner day folder.
+
+Usage:  python tools/benchmarkConfigFile.py [nEntries] [nRepeats]
+"""
+import os, sys, time, tempfile, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from acq4.util import configfile
+
+
+def makeIndex(nEntries):
+    """Return the text of a synthetic .index file with nEntries file entries."""
+    rand = random.Random(0)
+    lines = [".:",
+             "    __timestamp__: %r" % 1.4e9,
+             "    description: 'synthetic day folder'"]
+    for i in range(nEntries):
+        lines.extend([
+            "cell_%05d:" % i,
+            "    __timestamp__: %r" % (1.4e9 + i * 0.123456),
+            "    __object_type__: 'MetaArray'",
+            "    pos: (%r, %r)" % (rand.random(), rand.random()),
+            "    holding: %d*mV" % rand.randint(-80, 0),
+            "    sequence: [%d, %d, %d]" % (i, i+1, i+2),
+            "    params:",
+            "        ('Clamp1', 'Pulse', 'amp'): %r" % (rand.random() * 1e-9),
+            "        notes: ''",
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def benchmark(nEntries=10000, nRepeats=3):
+    fn = tempfile.mktemp()
+    fd = open(fn, 'w')
+    fd.write(makeIndex(nEntries))
+    fd.close()
+    try:
+        results = {}
+        for engine in ['eval', 'fast']:
+            times = []
+            for i in range(nRepeats):
+                start = time.time()
+                results[engine] = configfile.readConfigFile(fn, engine=engine)
+                times.append(time.time() - start)
+            print("%s engine: %0.3f s (best of %d)" % (engine, min(times), nRepeats))
+        if results['eval'] != results['fast']:
+            print("WARNING: parser engines returned different results!")
+    finally:
+        os.remove(fn)
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    benchmark(*args)
@@ -0,0 +1,100 @@
+"""
+Benchmark NI-DAQ task overhead and streaming throughput.
+
+Runs back-to-back finite tasks (as used by Manager tasks and the TaskRunner)
+and reports the time spent outside of acquisition per task, then streams
+continuously and reports the sustained throughput and the latency from the
+end of each chunk's acquisition to its delivery to the stream callback.
+
+By default the simulated DAQ (acq4/drivers/nidaq/mock.py) is used, so the
+overhead of the acquisition code itself can be measured on any machine; use
+--real to measure a real device instead.
+
+Usage:  python tools/benchmarkDAQ.py [--channels N] [--rate HZ] [--duration S]
+                                     [--tasks N] [--chunk N] [--stream-time S]
+                                     [--noise V] [--jitter S] [--real]
+"""
+import os, sys, time, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+
+
+def makeTask(daq, dev, nChans):
+    st = daq.createSuperTask()
+    for i in range(nChans):
+        st.addChannel('/%s/ai%d' % (dev, i), 'ai')
+    st.addChannel('/%s/ao0' % dev, 'ao')
+    return st
+
+
+def benchmarkFinite(daq, dev, nChans, rate, duration, nTasks):
+    nPts = int(rate * duration)
+    times = []
+    for i in range(nTasks):
+        start = time.time()
+        st = makeTask(daq, dev, nChans)
+        st.configureClocks(rate=rate, nPts=nPts)
+        st.setWaveform('/%s/ao0' % dev, np.zeros(nPts))
+        st.run()
+        st.stop()
+        times.append(time.time() - start)
+    times = np.array(times)
+    print "Finite tasks: %d x %d channels x %d samples at %g Hz" % (nTasks, nChans, nPts, rate)
+    print "    %.1f tasks/s, overhead per task: mean %.2f ms, max %.2f ms" % (
+        nTasks / times.sum(), (times.mean() - duration) * 1e3, (times.max() - duration) * 1e3)
+
+
+def benchmarkStream(daq, dev, nChans, rate, chunkSize, streamTime):
+    st = makeTask(daq, dev, nChans)
+    st.configureStream(rate=rate, chunkSize=chunkSize, waveformFunc=lambda ch, start, n: np.zeros(n))
+    latency = []
+    def callback(chunk):
+        ## time since the last sample of the chunk was acquired
+        latency.append(time.time() - (chunk['time'] + chunk['nPts'] / chunk['rate']))
+    st.startStream(callback)
+    time.sleep(streamTime)
+    try:
+        st.stopStream()
+        error = None
+    except Exception as exc:
+        error = exc
+    latency = np.array(latency)
+    nSamples = len(latency) * chunkSize
+    print "Streaming: %d channels at %g Hz, %d samples per chunk" % (nChans, rate, chunkSize)
+    print "    %d chunks, %.2f MSamples/s" % (len(latency), nSamples * nChans / streamTime / 1e6)
+    if len(latency) > 0:
+        print "    chunk latency: median %.2f ms, max %.2f ms" % (np.median(latency) * 1e3, latency.max() * 1e3)
+    if error is not None:
+        print "    stream stopped with error: %s" % error
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark NI-DAQ task overhead and streaming throughput.")
+    parser.add_argument('--channels', type=int, default=8, help="number of AI channels")
+    parser.add_argument('--rate', type=float, default=20e3, help="sample rate (Hz)")
+    parser.add_argument('--duration', type=float, default=0.1, help="duration of finite tasks (s)")
+    parser.add_argument('--tasks', type=int, default=20, help="number of finite tasks to run")
+    parser.add_argument('--chunk', type=int, default=2000, help="samples per streamed chunk")
+    parser.add_argument('--stream-time', type=float, default=2.0, help="time to stream for (s)")
+    parser.add_argument('--noise', type=float, default=0.0, help="simulated input noise (V rms)")
+    parser.add_argument('--jitter', type=float, default=0.0, help="simulated timing jitter (s)")
+    parser.add_argument('--real', action='store_true', help="use the real NI-DAQmx driver")
+    args = parser.parse_args()
+
+    if args.real:
+        from acq4.drivers.nidaq.nidaq import NIDAQ
+    else:
+        from acq4.drivers.nidaq.mock import NIDAQ
+        NIDAQ.configure(
+            devices={'Dev1': {'ai': max(32, args.channels), 'ao': 4, 'lines': 32}},
+            noise=args.noise, jitter=args.jitter,
+            loopback={'/Dev1/ai0': {'source': '/Dev1/ao0'}},
+        )
+    dev = NIDAQ.listDevices()[0]
+
+    benchmarkFinite(NIDAQ, dev, args.channels, args.rate, args.duration, args.tasks)
+    benchmarkStream(NIDAQ, dev, args.channels, args.rate, args.chunk, args.stream_time)
+
+
+if __name__ == '__main__':
+    main()
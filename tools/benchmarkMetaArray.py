@@ -0,0 +1,136 @@
+"""
+Benchmark HDF5 write profiles and compression codecs for MetaArray files.
+
+For each write profile (see MetaArray.writeProfiles) and each available codec,
+writes sample data, then reports the write speed, the speed of reading the
+whole file, the speed of the partial reads typical for that kind of data,
+and the file size (including axis values). Use the results to choose the
+'writeProfiles' and 'defaultCompression' settings in the acq4 configuration.
+
+Usage:  python tools/benchmarkMetaArray.py [--profile video|trace|scan] [--file data.ma]
+                                           [--chunk-bytes N] [--repeats N]
+
+With --file, the array stored in an existing MetaArray file is used as the
+sample data instead of synthetic data (--profile must also be given).
+"""
+import os, sys, time, tempfile, argparse
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import numpy as np
+from acq4.util.metaarray import MetaArray
+
+CODECS = [None, ('gzip', 1), ('gzip', 4), ('gzip', 9), 'lzf', 'szip']
+
+
+def sampleData(profile):
+    """Return a synthetic MetaArray resembling the data usually written with *profile*."""
+    rand = np.random.RandomState(0)
+    if profile == 'video':
+        ## camera stack: smooth image with shot noise
+        y, x = np.mgrid[0:512, 0:512]
+        img = 1000 + 500 * np.sin(x / 40.) * np.cos(y / 60.)
+        frames = rand.poisson(img[np.newaxis, ...], size=(100, 512, 512)).astype(np.uint16)
+        info = [{'name': 'Time', 'units': 's', 'values': np.arange(100) * 0.01}, {'name': 'X'}, {'name': 'Y'}, {}]
+        return MetaArray(frames, info=info)
+    elif profile == 'trace':
+        ## 10 s of 2-channel clamp data at 20 kHz
+        t = np.arange(200000) / 20e3
+        data = np.empty((2, len(t)), dtype=np.float32)
+        data[0] = -65e-3 + 5e-3 * np.sin(t * 20) + rand.normal(scale=0.2e-3, size=len(t))
+        data[1] = 100e-12 * (t % 1 < 0.5) + rand.normal(scale=5e-12, size=len(t))
+        info = [{'name': 'Channel', 'cols': [{'name': 'primary', 'units': 'V'}, {'name': 'secondary', 'units': 'A'}]},
+                {'name': 'Time', 'units': 's', 'values': t}, {'rate': 20e3}]
+        return MetaArray(data, info=info)
+    elif profile == 'scan':
+        ## PMT record of a raster scan: 20 frames of 256x256 samples
+        data = rand.exponential(scale=0.1, size=(20, 256, 256)).astype(np.float32)
+        info = [{'name': 'Time', 'units': 's', 'values': np.arange(20) * 0.5}, {'name': 'X'}, {'name': 'Y'}, {}]
+        return MetaArray(data, info=info)
+    raise ValueError("No sample data for profile '%s'" % profile)
+
+
+def partialReads(profile, arr):
+    """Return a list of index tuples representing typical partial reads of arr."""
+    rand = np.random.RandomState(1)
+    shape = arr.shape
+    reads = []
+    for i in range(10):
+        if profile == 'video':
+            ## a few consecutive frames
+            j = rand.randint(0, max(1, shape[0] - 3))
+            reads.append((slice(j, j+3),))
+        elif profile == 'trace':
+            ## one channel over a 1/10 window of the recording
+            n = max(1, shape[-1] // 10)
+            j = rand.randint(0, max(1, shape[-1] - n))
+            reads.append((rand.randint(0, shape[0]), slice(j, j+n)))
+        else:
+            ## a small block
+            ind = []
+            for s in shape:
+                n = max(1, s // 8)
+                j = rand.randint(0, max(1, s - n))
+                ind.append(slice(j, j+n))
+            reads.append(tuple(ind))
+    return reads
+
+
+def benchmark(profile, data, chunkBytes=None, repeats=3):
+    prof = dict(MetaArray.writeProfiles[profile])
+    if chunkBytes is not None:
+        prof['chunkBytes'] = chunkBytes
+    nbytes = data.asarray().nbytes
+    mb = nbytes / 1e6
+    print("Profile '%s': %s %s (%0.1f MB), %s" % (profile, data.shape, data.dtype, mb, prof))
+    print("  %-12s %12s %12s %14s %8s" % ('codec', 'write MB/s', 'read MB/s', 'partial ms', 'file MB'))
+    reads = partialReads(profile, data)
+    fn = tempfile.mktemp(suffix='.ma')
+    for codec in CODECS:
+        prof['compression'] = codec
+        try:
+            wtimes = []
+            rtimes = []
+            ptimes = []
+            for i in range(repeats):
+                if os.path.exists(fn):
+                    os.remove(fn)
+                start = time.time()
+                data.write(fn, profile=prof)
+                wtimes.append(time.time() - start)
+
+                start = time.time()
+                MetaArray(file=fn, readAllData=True)
+                rtimes.append(time.time() - start)
+
+                lazy = MetaArray(file=fn, lazy=True)
+                start = time.time()
+                for ind in reads:
+                    lazy[ind]
+                ptimes.append((time.time() - start) / len(reads))
+                lazy.close()
+            size = os.stat(fn).st_size
+            print("  %-12s %12.1f %12.1f %14.2f %8.1f" % (
+                codec, mb / min(wtimes), mb / min(rtimes), min(ptimes) * 1000, size / 1e6))
+        except Exception as exc:
+            print("  %-12s  not available (%s)" % (codec, exc))
+        finally:
+            if os.path.exists(fn):
+                os.remove(fn)
+    print("")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark MetaArray write profiles and HDF5 codecs.")
+    parser.add_argument('--profile', choices=sorted(MetaArray.writeProfiles.keys()),
+                        help="profile to test (default is all profiles)")
+    parser.add_argument('--file', help="use the data in this MetaArray file as the sample")
+    parser.add_argument('--chunk-bytes', type=float, default=None, help="override the profile's chunk size")
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.file is not None:
+        if args.profile is None:
+            parser.error("--profile is required with --file")
+        benchmark(args.profile, MetaArray(file=args.file, readAllData=True), args.chunk_bytes, args.repeats)
+    else:
+        for profile in ([args.profile] if args.profile else ['video', 'trace', 'scan']):
+            benchmark(profile, sampleData(profile), args.chunk_bytes, args.repeats)